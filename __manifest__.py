@@ -10,13 +10,18 @@
     'images': ['ai_health_management/static/description/ai_health_icon.png'],
     'web_icon_data':  ['ai_health_management/static/description/ai_health_icon.png'],
     'depends': ['base', 'hr'],
+    'external_dependencies': {
+        'python': ['numpy'],
+    },
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron_data.xml',
         'views/report.xml',
         'views/health_diagnosis_views.xml',
         'views/health_diagnosis_attribute_views.xml',
         'views/health_diagnosis_attribute_value_views.xml',
         'views/health_diagnosis_attribute_set_views.xml',
+        'views/health_diagnosis_synonym_views.xml',
         'views/hr_employee_views.xml',
         'views/res_config_settings_views.xml',
         'views/report_health_diagnosis_templates.xml',
@@ -27,6 +32,11 @@
         'views/health_risk_scoring_report_views.xml',
         'views/health_recommendation_views.xml', 
         'views/symptom_checker_views.xml', 
+        'views/health_ai_job_views.xml',
+        'views/health_ai_batch_views.xml',
+        'views/health_ai_call_views.xml',
+        'views/health_triage_classifier_views.xml',
+        'views/health_risk_model_views.xml',
         'views/menu_health_diagnosis.xml',
     ],
     'assets': {
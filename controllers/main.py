@@ -1,15 +1,212 @@
-from odoo import http
-from odoo.http import request
+from odoo import http, api, fields, _
+from odoo.http import request, Response, content_disposition
+from odoo.exceptions import AccessError
+from odoo.tools import html_escape
+import json
+import time
+import logging
+
+from ..models.health_ai_client import stream_chat_completion, complete_streamed
+from ..models.health_ai_telemetry import make_call
+from ..models.health_diagnosis_export import EXPORT_MODELS
+
+_logger = logging.getLogger(__name__)
+
+# Minimal page rendering the streamed diagnosis as it arrives
+LIVE_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8"/>
+    <title>%(title)s</title>
+    <style>
+        body { font-family: sans-serif; margin: 2em; }
+        #output { white-space: pre-wrap; border: 1px solid #ccc; padding: 1em; min-height: 10em; }
+        #status { color: #666; margin-bottom: 1em; }
+    </style>
+</head>
+<body>
+    <h2>%(title)s</h2>
+    <div id="status">%(waiting)s</div>
+    <div id="output"></div>
+    <script>
+        var output = document.getElementById('output');
+        var status = document.getElementById('status');
+        var source = new EventSource(%(stream_url)s);
+        source.onmessage = function (event) {
+            output.textContent += JSON.parse(event.data).delta;
+        };
+        source.addEventListener('done', function (event) {
+            status.textContent = JSON.parse(event.data).message;
+            source.close();
+        });
+        source.addEventListener('error', function (event) {
+            status.textContent = event.data ? JSON.parse(event.data).message : %(failed)s;
+            source.close();
+        });
+    </script>
+</body>
+</html>
+"""
+
+
+def _sse(data, event=None):
+    message = 'data: %s\n\n' % json.dumps(data)
+    if event:
+        message = 'event: %s\n%s' % (event, message)
+    return message.encode('utf-8')
+
 
 class HealthDiagnosisController(http.Controller):
-    
+
     @http.route('/web/content/diagnosis_report/<int:diagnosis_id>', type='http', auth="user", csrf=False)
     def download_excel_report(self, diagnosis_id, **kwargs):
-        # Get the diagnosis record
+        # Kept for existing links, the export route handles any selection
+        return self.export_records('health.diagnosis', 'xlsx', ids=str(diagnosis_id))
+
+    @http.route('/ai_health/export/<string:model_name>/<string:file_format>', type='http', auth="user")
+    def export_records(self, model_name, file_format, ids=None, domain=None, **kwargs):
+        """ Stream an export of the given ids, domain, or all records.
+
+        Rows are read in chunks while the response is being sent, by a
+        generator holding its own cursor since the request cursor is closed
+        by then.
+        """
+        if file_format not in ('csv', 'xlsx'):
+            return request.not_found()
+        request.env['health.diagnosis.export']._check_model(model_name)
+        try:
+            if ids:
+                search_domain = [('id', 'in', [int(record_id) for record_id in ids.split(',') if record_id.strip()])]
+            else:
+                search_domain = json.loads(domain) if domain else []
+                if not isinstance(search_domain, list):
+                    raise ValueError(domain)
+            # Checked now, the generator can only fail once the response started
+            request.env[model_name].search_count(search_domain)
+        except (ValueError, AccessError):
+            return Response(_("Invalid ids or domain."), status=400, mimetype='text/plain')
+
+        registry = request.env.registry
+        uid, context = request.env.uid, dict(request.env.context)
+
+        def generate():
+            with registry.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                exporter = env['health.diagnosis.export']
+                stream = exporter._stream_csv if file_format == 'csv' else exporter._stream_xlsx
+                yield from stream(model_name, search_domain)
+
+        filename = '%s_%s.%s' % (EXPORT_MODELS[model_name], fields.Date.today(), file_format)
+        if file_format == 'csv':
+            mimetype = 'text/csv'
+        else:
+            mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        headers = [
+            ('Content-Disposition', content_disposition(filename)),
+            ('X-Accel-Buffering', 'no'),
+        ]
+        return Response(generate(), headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+    @http.route('/ai_health/api/<string:kind>/submit', type='json', auth="user", methods=['POST'])
+    def api_submit(self, kind, items=None, **kwargs):
+        """ Create a batch of diagnoses or symptom checks and queue their AI processing.
+
+        ``items`` is a list of ``{"employee": id, badge or identification
+        number, "symptoms": text, "title"?, "date"?}``. Returns the ids of the
+        created records with the index of their item, and the errors of the
+        rejected items. The AI results are fetched with the status endpoint.
+        """
+        return request.env['health.api.intake']._submit(kind, items)
+
+    @http.route('/ai_health/api/<string:kind>/status', type='json', auth="user", methods=['POST'])
+    def api_status(self, kind, ids=None, **kwargs):
+        """ Return the AI status, and results once done, of the given record ids. """
+        return request.env['health.api.intake']._status(kind, ids)
+
+    @http.route('/ai_health/diagnosis/<int:diagnosis_id>/live', type='http', auth="user")
+    def diagnosis_live(self, diagnosis_id, **kwargs):
+        """ Page showing the AI diagnosis while it is being generated. """
         diagnosis = request.env['health.diagnosis'].browse(diagnosis_id)
+        diagnosis.check_access_rights('write')
+        diagnosis.check_access_rule('write')
+        html = LIVE_PAGE % {
+            'title': html_escape(diagnosis.display_name),
+            'waiting': html_escape(_("Waiting for the AI response...")),
+            'failed': json.dumps(_("The AI diagnosis failed.")),
+            'stream_url': json.dumps('/ai_health/diagnosis/%s/stream' % diagnosis.id),
+        }
+        return request.make_response(html, headers=[('Content-Type', 'text/html; charset=utf-8')])
+
+    @http.route('/ai_health/diagnosis/<int:diagnosis_id>/stream', type='http', auth="user")
+    def diagnosis_stream(self, diagnosis_id, **kwargs):
+        """ Proxy the upstream completion as server-sent events.
+
+        The request is prepared here, but the response body is produced after
+        the request cursor is closed, so the final parse into attribute lines
+        runs in a cursor of its own once the stream ends.
+        """
+        diagnosis = request.env['health.diagnosis'].browse(diagnosis_id)
+        diagnosis.check_access_rights('write')
+        diagnosis.check_access_rule('write')
+        ai_request = diagnosis._prepare_ai_request()
+        config, payload, cached = request.env['health.ai.client']._prepare_stream(diagnosis._ai_engine, ai_request)
+
+        registry = request.env.registry
+        uid, context = request.env.uid, dict(request.env.context)
+        done_message = _("Diagnosis saved, you can close this window.")
 
-        # Generate the report (ensure export_diagnosis_excel method exists and returns the correct response)
-        report = diagnosis.export_diagnosis_excel()
+        def generate():
+            chunks = []
+            metrics = {}
+            start = time.monotonic()
+            call = None
+            follow_up_calls = []
+            try:
+                if cached:
+                    chunks.append(cached)
+                    yield _sse({'delta': cached})
+                else:
+                    for delta in stream_chat_completion(config, payload, metrics):
+                        chunks.append(delta)
+                        yield _sse({'delta': delta})
+                metrics['duration'] = time.monotonic() - start
+                call = make_call(diagnosis._ai_engine, config['model'], 'stream', metrics, metrics.get('usage'),
+                                 cache_hit=bool(cached), parse_ok=False)
+                content = ''.join(chunks)
+                if metrics.get('finish_reason') == 'length':
+                    # Cut by max_tokens: ask for the rest and send it as one delta
+                    _logger.warning("Streamed diagnosis %s was truncated, asking for the rest", diagnosis_id)
+                    completed, follow_ups = complete_streamed(config, payload, content)
+                    follow_up_calls = [
+                        make_call(diagnosis._ai_engine, config['model'], metrics=stats, usage=stats.get('usage'),
+                                  parse_ok=not stats.get('failed'))
+                        for stats in follow_ups
+                    ]
+                    if len(completed) > len(content):
+                        yield _sse({'delta': completed[len(content):]})
+                    content = completed
+                with registry.cursor() as cr:
+                    env = api.Environment(cr, uid, context)
+                    record = env['health.diagnosis'].browse(diagnosis_id)
+                    record._apply_ai_response(content, ai_request)
+                    record.write({'ai_state': 'done', 'ai_error': False})
+                    if not cached:
+                        env['health.ai.client']._store_streamed(record._ai_engine, ai_request, content)
+                    call['parse_ok'] = True
+                    env['health.ai.call']._record([call] + follow_up_calls)
+                yield _sse({'message': done_message}, event='done')
+            except Exception as e:
+                _logger.error("Streaming diagnosis %s failed: %s", diagnosis_id, str(e))
+                if call is None:
+                    metrics['duration'] = time.monotonic() - start
+                    call = make_call(diagnosis._ai_engine, config['model'], 'stream', metrics, parse_ok=False)
+                if not call['parse_ok']:
+                    with registry.cursor() as cr:
+                        api.Environment(cr, uid, context)['health.ai.call']._record([call] + follow_up_calls)
+                yield _sse({'message': str(e)}, event='error')
 
-        # Return the generated report
-        return report
+        headers = [
+            ('Cache-Control', 'no-cache'),
+            ('X-Accel-Buffering', 'no'),
+        ]
+        return Response(generate(), headers=headers, mimetype='text/event-stream', direct_passthrough=True)
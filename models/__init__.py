@@ -1,15 +1,34 @@
 from . import hr_employee
 from . import res_config_settings
+from . import health_ai_telemetry
+from . import health_ai_rate_limit
+from . import health_ai_client
+from . import health_ai_cache
+from . import health_ai_flight
+from . import health_ai_prompt
+from . import health_ai_engine_mixin
+from . import health_ai_job
+from . import health_ai_batch
+from . import health_ai_rescore
 from . import health_diagnosis
+from . import health_diagnosis_history
+from . import health_symptom_index
+from . import health_diagnosis_export
+from . import health_api_intake
+from . import health_report_mixin
+from . import health_diagnosis_dictionary
 from . import health_diagnosis_attribute_set
 from . import health_diagnosis_attribute_value
 from . import health_diagnosis_attribute
 from . import health_diagnosis_attribute_line
 from . import health_diagnosis_report
 from . import health_disease_outbreak_prediction
+from . import health_outbreak_detector
 from . import health_disease_outbreak_report
 from . import health_recommendation
 from . import health_recommendation_report
 from . import health_risk_scoring
 from . import health_risk_scoring_report
-from . import symptom_checker
\ No newline at end of file
+from . import symptom_checker
+from . import health_triage_classifier
+from . import health_risk_model
@@ -0,0 +1,248 @@
+from odoo import fields, models, api, _
+from odoo.exceptions import UserError
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import json
+import logging
+
+import requests
+
+from .health_ai_client import api_request, _post_or_error
+from .health_ai_telemetry import make_call
+
+_logger = logging.getLogger(__name__)
+
+BATCH_ENGINES = ('health.risk.scoring', 'health.recommendation', 'health.disease.outbreak.prediction')
+FINAL_REMOTE_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class HealthAIBatch(models.Model):
+    _name = 'health.ai.batch'
+    _description = 'Offline AI Batch'
+    _order = 'id desc'
+
+    name = fields.Char('Batch', required=True, default=lambda self: _("New Batch"))
+    res_model = fields.Char('Model', required=True, readonly=True)
+    backend = fields.Selection([
+        ('openai', 'OpenAI Batch API'),
+        ('local', 'Local Stand-in'),
+    ], string='Backend', required=True, readonly=True,
+        default=lambda self: self.env['ir.config_parameter'].sudo().get_param('ai_health.batch_backend') or 'openai')
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('submitted', 'Submitted'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='draft', required=True, readonly=True, index=True)
+    remote_id = fields.Char('Remote Batch ID', readonly=True)
+    remote_status = fields.Char('Remote Status', readonly=True)
+    input_file_id = fields.Char('Input File ID', readonly=True)
+    output_file_id = fields.Char('Output File ID', readonly=True)
+    date_submitted = fields.Datetime('Submitted On', readonly=True)
+    date_done = fields.Datetime('Finished On', readonly=True)
+    error = fields.Text('Error', readonly=True)
+    line_ids = fields.One2many('health.ai.batch.line', 'batch_id', string='Requests', readonly=True)
+    line_count = fields.Integer('Requests', compute='_compute_counts')
+    done_count = fields.Integer('Applied', compute='_compute_counts')
+    failed_count = fields.Integer('Failed', compute='_compute_counts')
+
+    @api.depends('line_ids.state')
+    def _compute_counts(self):
+        for batch in self:
+            states = batch.line_ids.mapped('state')
+            batch.line_count = len(states)
+            batch.done_count = states.count('done')
+            batch.failed_count = states.count('failed')
+
+    @api.model
+    def _submit_records(self, records):
+        """ Serialize the requests of ``records`` into one batch and submit it. """
+        if records._name not in BATCH_ENGINES:
+            raise UserError(_("Batch mode is not available for %s.") % records._description)
+
+        lines = []
+        for record in records:
+            try:
+                lines.append({'res_id': record.id, 'request': json.dumps(record._prepare_ai_request())})
+            except UserError as e:
+                record.write({'ai_state': 'failed', 'ai_error': str(e)})
+        if not lines:
+            raise UserError(_("None of the selected records can be submitted."))
+
+        # Users only read batches, they are written by the module itself
+        batch = self.sudo().create({
+            'name': _("%s batch of %s") % (records._description, fields.Datetime.now()),
+            'res_model': records._name,
+            'line_ids': [(0, 0, vals) for vals in lines],
+        })
+        records.browse([vals['res_id'] for vals in lines]).write({'ai_state': 'queued', 'ai_error': False})
+        batch.action_submit()
+        return batch.sudo(False)
+
+    def _build_input_file(self, config):
+        """ One JSONL line per request, in the OpenAI batch input format. """
+        client = self.env['health.ai.client']
+        return '\n'.join(json.dumps({
+            'custom_id': str(line.id),
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': client._build_payload(config, json.loads(line.request)),
+        }) for line in self.line_ids) + '\n'
+
+    def _attach(self, name, content):
+        self.env['ir.attachment'].sudo().create({
+            'name': name,
+            'res_model': self._name,
+            'res_id': self.id,
+            'mimetype': 'application/jsonl',
+            'datas': base64.b64encode(content.encode('utf-8')),
+        })
+
+    def action_submit(self):
+        for batch in self.sudo().filtered(lambda b: b.state == 'draft'):
+            config = self.env['health.ai.client']._get_config()
+            if not config['api_key'] or not config['model']:
+                raise UserError(_("Missing configuration for OpenAI API."))
+            content = batch._build_input_file(config)
+            batch._attach('input_%s.jsonl' % batch.id, content)
+            try:
+                if batch.backend == 'local':
+                    values = {'remote_id': 'local-%s' % batch.id, 'remote_status': 'in_progress'}
+                else:
+                    values = batch._openai_submit(config, content)
+            except requests.RequestException as e:
+                _logger.error("Submitting AI batch %s failed: %s", batch.id, str(e))
+                raise UserError(_("Failed to submit the batch to OpenAI."))
+            batch.write(dict(values, state='submitted', date_submitted=fields.Datetime.now()))
+
+    def _openai_submit(self, config, content):
+        upload = api_request(
+            config, 'POST', '/files',
+            files={'file': ('batch_%s.jsonl' % self.id, content.encode('utf-8'), 'application/jsonl')},
+            data={'purpose': 'batch'},
+        ).json()
+        remote = api_request(config, 'POST', '/batches', json={
+            'input_file_id': upload['id'],
+            'endpoint': '/v1/chat/completions',
+            'completion_window': '24h',
+        }).json()
+        return {'input_file_id': upload['id'], 'remote_id': remote['id'], 'remote_status': remote['status']}
+
+    def _run_local(self, config):
+        """ Local stand-in for the Batch API: send the requests to the chat
+        completions endpoint (itself possibly a local server, see
+        ``ai_health.openai_base_url``) and return a batch output file. """
+        client = self.env['health.ai.client']
+        lines = list(self.line_ids)
+        payloads = [client._build_payload(config, json.loads(line.request)) for line in lines]
+        workers = max(1, min(config['max_concurrency'], len(payloads)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ai_health_batch') as executor:
+            responses = list(executor.map(lambda payload: _post_or_error(config, payload), payloads))
+
+        output = []
+        for line, response in zip(lines, responses):
+            if isinstance(response, Exception):
+                entry = {'custom_id': str(line.id), 'response': None, 'error': {'message': str(response)}}
+            else:
+                entry = {'custom_id': str(line.id), 'response': {'status_code': 200, 'body': response}, 'error': None}
+            output.append(json.dumps(entry))
+        return '\n'.join(output) + '\n'
+
+    @api.model
+    def _cron_poll(self):
+        """ Poll the submitted batches and apply the finished ones. """
+        for batch in self.search([('state', '=', 'submitted')]):
+            try:
+                batch._poll()
+            except Exception as e:
+                _logger.exception("Polling AI batch %s failed", batch.id)
+                self.env.cr.rollback()
+                batch.write({'error': str(e)})
+            self.env.cr.commit()
+
+    def _poll(self):
+        self.ensure_one()
+        config = self.env['health.ai.client']._get_config()
+        if self.backend == 'local':
+            output = self._run_local(config)
+            self.write({'remote_status': 'completed'})
+        else:
+            remote = api_request(config, 'GET', '/batches/%s' % self.remote_id).json()
+            self.write({'remote_status': remote['status'], 'output_file_id': remote.get('output_file_id')})
+            if remote['status'] not in FINAL_REMOTE_STATES:
+                return
+            if remote['status'] != 'completed' or not remote.get('output_file_id'):
+                self._fail(_("The batch ended with status %s.") % remote['status'])
+                return
+            output = api_request(config, 'GET', '/files/%s/content' % remote['output_file_id']).text
+
+        self._attach('output_%s.jsonl' % self.id, output)
+        self._apply_output(output)
+
+    def _apply_output(self, output):
+        """ Apply every result of the output file on its record, each in its own savepoint. """
+        lines = {str(line.id): line for line in self.line_ids}
+        records = self.env[self.res_model].browse(self.line_ids.mapped('res_id')).exists()
+        client = self.env['health.ai.client']
+        config = client._get_config()
+        cache = self.env['health.ai.cache']
+        fresh = {}
+        calls = []
+        for raw in output.splitlines():
+            if not raw.strip():
+                continue
+            entry = json.loads(raw)
+            line = lines.pop(entry['custom_id'], None)
+            if not line:
+                continue
+            record = records.browse(line.res_id)
+            request = json.loads(line.request)
+            response = entry.get('response') or {}
+            call = make_call(records._ai_engine, config['model'], 'batch', {'status': response.get('status_code')},
+                             (response.get('body') or {}).get('usage'), parse_ok=False)
+            calls.append(call)
+            try:
+                if record not in records:
+                    raise UserError(_("Record no longer exists."))
+                if entry.get('error') or response.get('status_code') != 200:
+                    raise UserError(request.get('error_message') or _("Error retrieving a response from OpenAI."))
+                content = response['body']['choices'][0]['message']['content']
+                with self.env.cr.savepoint():
+                    record._apply_ai_response(content, request)
+                call['parse_ok'] = True
+                fresh[cache._make_key(record._ai_engine, config['model'], request)] = content
+                line.write({'state': 'done'})
+                record.write({'ai_state': 'done', 'ai_error': False})
+            except Exception as e:
+                line.write({'state': 'failed', 'error': str(e)})
+                if record in records:
+                    record.write({'ai_state': 'failed', 'ai_error': str(e)})
+
+        # Requests missing from the output file
+        for line in lines.values():
+            line.write({'state': 'failed', 'error': _("No result in the batch output.")})
+        cache._store(records._ai_engine, config['model'], fresh)
+        self.env['health.ai.call']._record(calls)
+        self.write({'state': 'done', 'date_done': fields.Datetime.now()})
+
+    def _fail(self, error):
+        self.write({'state': 'failed', 'error': error, 'date_done': fields.Datetime.now()})
+        self.line_ids.write({'state': 'failed', 'error': error})
+        self.env[self.res_model].browse(self.line_ids.mapped('res_id')).exists().write({
+            'ai_state': 'failed', 'ai_error': error,
+        })
+
+
+class HealthAIBatchLine(models.Model):
+    _name = 'health.ai.batch.line'
+    _description = 'Offline AI Batch Request'
+
+    batch_id = fields.Many2one('health.ai.batch', string='Batch', required=True, ondelete='cascade', index=True)
+    res_id = fields.Integer('Record ID', required=True)
+    request = fields.Text('Request', required=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='pending', required=True)
+    error = fields.Text('Error')
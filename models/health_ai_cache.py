@@ -0,0 +1,213 @@
+from odoo import fields, models, api
+from collections import OrderedDict
+import hashlib
+import json
+import re
+import threading
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 86400  # seconds
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MEMORY_ENTRIES = 512
+STATS_FLUSH_INTERVAL = 60  # seconds
+STATS_FLUSH_COUNT = 100
+
+# Per-worker front layer: key -> (expires_at, content), kept in LRU order
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+# Per-worker hit/miss counters and per-key hits, periodically written to
+# the database so lookups never lock a row
+_stats = {'hits': 0, 'misses': 0, 'touched': {}, 'flushed_at': time.monotonic()}
+
+
+def _normalize(text):
+    return re.sub(r'\s+', ' ', text or '').strip()
+
+
+class HealthAICache(models.Model):
+    _name = 'health.ai.cache'
+    _description = 'AI Response Cache'
+    _order = 'last_hit desc'
+
+    key = fields.Char('Key', required=True, index=True, readonly=True)
+    engine = fields.Char('Engine', readonly=True)
+    model = fields.Char('Model', readonly=True)
+    response = fields.Text('Response', readonly=True)
+    hit_count = fields.Integer('Hits', readonly=True)
+    last_hit = fields.Datetime('Last Used', readonly=True, index=True)
+
+    _sql_constraints = [
+        ('key_uniq', 'unique(key)', 'The cache key must be unique.'),
+    ]
+
+    @api.model
+    def _make_key(self, engine, model, request):
+        """ Hash the engine, model, temperature and normalized prompt of a
+        request. ``max_tokens`` is left out: it follows the recent answers of
+        the engine and would change the key of identical prompts. """
+        prompt = [(message['role'], _normalize(message['content'])) for message in request['messages']]
+        raw = json.dumps([engine, model, prompt, request.get('temperature')], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @api.model
+    def _get_settings(self):
+        config = self.env['ir.config_parameter'].sudo()
+        return {
+            'ttl': int(config.get_param('ai_health.cache_ttl', DEFAULT_TTL)),
+            'max_entries': int(config.get_param('ai_health.cache_max_entries', DEFAULT_MAX_ENTRIES)),
+            'memory_entries': int(config.get_param('ai_health.cache_memory_entries', DEFAULT_MEMORY_ENTRIES)),
+        }
+
+    @api.model
+    def _lookup(self, keys):
+        """ Return a dict of the cached responses found for ``keys``. """
+        settings = self._get_settings()
+        if settings['ttl'] <= 0 or not keys:
+            return {}
+
+        found = {}
+        now = time.time()
+        with _memory_lock:
+            for key in keys:
+                entry = _memory.get(key)
+                if entry and entry[0] > now:
+                    _memory.move_to_end(key)
+                    found[key] = entry[1]
+                elif entry:
+                    del _memory[key]
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            self.env.cr.execute("""
+                SELECT key, response, extract(epoch from create_date at time zone 'UTC')
+                  FROM health_ai_cache
+                 WHERE key IN %s
+                   AND create_date > (now() at time zone 'UTC') - %s * interval '1 second'
+            """, (tuple(missing), settings['ttl']))
+            for key, response, created in self.env.cr.fetchall():
+                found[key] = response
+                self._remember(key, response, float(created) + settings['ttl'], settings['memory_entries'])
+
+        self._count(found, misses=len(keys) - len(found))
+        return found
+
+    @api.model
+    def _store(self, engine, model, entries):
+        """ Store ``{key: response}`` in both cache layers. """
+        settings = self._get_settings()
+        if settings['ttl'] <= 0 or not entries:
+            return
+        for key, response in entries.items():
+            self.env.cr.execute("""
+                INSERT INTO health_ai_cache (key, engine, model, response, hit_count, last_hit,
+                                             create_uid, create_date, write_uid, write_date)
+                VALUES (%s, %s, %s, %s, 0, (now() at time zone 'UTC'),
+                        %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'))
+                ON CONFLICT (key) DO UPDATE
+                   SET response = EXCLUDED.response, create_date = EXCLUDED.create_date,
+                       last_hit = EXCLUDED.last_hit
+            """, (key, engine, model, response, self.env.uid, self.env.uid))
+            self._remember(key, response, time.time() + settings['ttl'], settings['memory_entries'])
+
+    @api.model
+    def _discard(self, keys):
+        """ Forget responses that turned out to be unusable. """
+        with _memory_lock:
+            for key in keys:
+                _memory.pop(key, None)
+        self.env.cr.execute("DELETE FROM health_ai_cache WHERE key IN %s", (tuple(keys),))
+
+    @api.model
+    def _remember(self, key, response, expires_at, capacity):
+        with _memory_lock:
+            _memory[key] = (expires_at, response)
+            _memory.move_to_end(key)
+            while len(_memory) > capacity:
+                _memory.popitem(last=False)
+
+    @api.model
+    def _count(self, hit_keys, misses=0):
+        _stats['hits'] += len(hit_keys)
+        _stats['misses'] += misses
+        for key in hit_keys:
+            _stats['touched'][key] = _stats['touched'].get(key, 0) + 1
+        pending = _stats['hits'] + _stats['misses']
+        if pending >= STATS_FLUSH_COUNT or time.monotonic() - _stats['flushed_at'] > STATS_FLUSH_INTERVAL:
+            self._flush_stats()
+
+    @api.model
+    def _flush_stats(self):
+        """ Add this worker's counters to the shared totals and record the
+        per-key hits used for LRU eviction.
+
+        A separate cursor keeps the rows locked only for the length of this
+        small transaction, not for the caller's.
+        """
+        hits, misses, touched = _stats['hits'], _stats['misses'], _stats['touched']
+        _stats.update(hits=0, misses=0, touched={}, flushed_at=time.monotonic())
+        if not hits and not misses:
+            return
+        try:
+            with self.env.registry.cursor() as cr:
+                if touched:
+                    cr.execute("""
+                        UPDATE health_ai_cache c
+                           SET hit_count = c.hit_count + t.hits, last_hit = (now() at time zone 'UTC')
+                          FROM unnest(%s::varchar[], %s::int[]) AS t(key, hits)
+                         WHERE c.key = t.key
+                    """, (list(touched), list(touched.values())))
+                for key, value in (('ai_health.cache_hits', hits), ('ai_health.cache_misses', misses)):
+                    cr.execute("""
+                        INSERT INTO ir_config_parameter (key, value, create_uid, create_date, write_uid, write_date)
+                        VALUES (%s, %s, %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'))
+                        ON CONFLICT (key) DO UPDATE
+                           SET value = (COALESCE(NULLIF(ir_config_parameter.value, ''), '0')::bigint + %s)::varchar
+                    """, (key, str(value), self.env.uid, self.env.uid, value))
+        except Exception as e:
+            _logger.warning("Could not flush AI cache statistics: %s", str(e))
+
+    @api.model
+    def _get_stats(self):
+        """ Shared hit/miss totals plus the counters not flushed yet. """
+        self.env.cr.execute("""
+            SELECT key, value FROM ir_config_parameter
+             WHERE key IN ('ai_health.cache_hits', 'ai_health.cache_misses')
+        """)
+        totals = {key: int(value or 0) for key, value in self.env.cr.fetchall()}
+        self.env.cr.execute("SELECT count(*) FROM health_ai_cache")
+        return {
+            'hits': totals.get('ai_health.cache_hits', 0) + _stats['hits'],
+            'misses': totals.get('ai_health.cache_misses', 0) + _stats['misses'],
+            'entries': self.env.cr.fetchone()[0],
+        }
+
+    @api.model
+    def _cron_evict(self):
+        """ Drop expired entries, then the least recently used beyond the size bound. """
+        settings = self._get_settings()
+        self.env.cr.execute("""
+            DELETE FROM health_ai_cache
+             WHERE create_date <= (now() at time zone 'UTC') - %s * interval '1 second'
+        """, (max(settings['ttl'], 0),))
+        expired = self.env.cr.rowcount
+        self.env.cr.execute("""
+            DELETE FROM health_ai_cache
+             WHERE id IN (
+                SELECT id FROM health_ai_cache
+                 ORDER BY last_hit DESC NULLS LAST, id DESC
+                OFFSET %s
+             )
+        """, (max(settings['max_entries'], 0),))
+        _logger.info("AI cache eviction: %s expired, %s over capacity", expired, self.env.cr.rowcount)
+        self._flush_stats()
+        self.env['health.ai.flight']._purge()
+
+    @api.model
+    def action_clear(self):
+        """ Empty the cache in the database and in this worker. """
+        self.env.cr.execute("DELETE FROM health_ai_cache")
+        with _memory_lock:
+            _memory.clear()
@@ -0,0 +1,489 @@
+from odoo import models, api, _
+from odoo.exceptions import UserError
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import random
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .health_ai_telemetry import make_call
+from .health_ai_prompt import count_message_tokens
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_MAX_CONCURRENCY = 8
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+# Follow-up requests asking for the rest of an answer cut by max_tokens
+MAX_CONTINUATIONS = 2
+CONTINUE_PROMPT = ("Your previous answer was cut off. Reply with the rest of it only, starting right after "
+                   "its last character, without repeating anything or adding any comment.")
+
+# One pooled session per worker process. Odoo forks its workers after the
+# registry is loaded, so the owning pid is tracked and the session rebuilt
+# in the child instead of sharing sockets with the parent.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# (base_url, model) pairs that rejected the JSON response format, per worker
+_json_mode_unsupported = set()
+
+
+def _get_session():
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, pid
+    return _session
+
+
+def _backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, honouring a Retry-After header."""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_CAP)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+def api_request(config, method, path, metrics=None, before_send=None, **kwargs):
+    """Send a request to the OpenAI API through the pooled session.
+
+    Connection errors, timeouts and 429/5xx responses are retried with
+    jittered backoff. This function does not touch the ORM so it can be
+    called from helper threads. It returns the successful response and
+    raises ``requests.RequestException`` once the retries are exhausted.
+    The last HTTP status and the number of retries are set in ``metrics``
+    when a dict is given. ``before_send`` is called before every attempt,
+    retries included. A 429 empties the shared rate limiter bucket so the
+    other workers back off too.
+    """
+    metrics = {} if metrics is None else metrics
+    url = '%s/%s' % (config['base_url'].rstrip('/'), path.lstrip('/'))
+    headers = dict(kwargs.pop('headers', {}), Authorization=f"Bearer {config['api_key']}")
+    timeout = (config['connect_timeout'], config['read_timeout'])
+    session = _get_session()
+
+    attempt = 0
+    while True:
+        metrics.update(status=0, retries=attempt)
+        if before_send is not None:
+            before_send()
+        try:
+            response = session.request(method, url, headers=headers, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= config['max_retries']:
+                raise
+            delay = _backoff_delay(attempt)
+            _logger.warning("OpenAI request failed (%s), retrying in %.2fs", e, delay)
+        else:
+            metrics['status'] = response.status_code
+            if response.status_code == 200:
+                return response
+            if response.status_code == 429 and config.get('rate_limiter'):
+                config['rate_limiter'].throttle()
+            if response.status_code not in RETRY_STATUSES or attempt >= config['max_retries']:
+                _logger.error("Error from OpenAI API: %s", response.text)
+                response.raise_for_status()
+                raise requests.HTTPError("Unexpected status %s" % response.status_code, response=response)
+            delay = _backoff_delay(attempt, response.headers.get('Retry-After'))
+            response.close()
+            _logger.warning("OpenAI returned %s, retrying in %.2fs", response.status_code, delay)
+        time.sleep(delay)
+        attempt += 1
+
+
+def _rejects_json_mode(response):
+    """ Whether ``response`` is a 400 about the response format, rather
+    than about the context length or any other part of the request. """
+    if response is None or response.status_code != 400:
+        return False
+    try:
+        error = response.json().get('error') or {}
+    except ValueError:
+        return 'response_format' in (response.text or '')
+    if not isinstance(error, dict):
+        return 'response_format' in str(error)
+    return error.get('param') == 'response_format' or 'response_format' in (error.get('message') or '')
+
+
+def _chat_request(config, payload, metrics=None, **kwargs):
+    """Send a chat completion request, without the JSON response format
+    when the server rejects it. The server is then remembered so the
+    following requests do not ask for it again.
+
+    With a rate limiter in ``config``, every attempt sent waits for its
+    share of the quota first: one request and its prompt tokens plus
+    ``max_tokens``, which the provider counts against the tokens per minute.
+    """
+    limiter = config.get('rate_limiter')
+    if limiter is not None:
+        tokens = count_message_tokens(payload['messages'], config['model']) + (payload.get('max_tokens') or 0)
+        kwargs['before_send'] = lambda: limiter.acquire(tokens)
+    try:
+        return api_request(config, 'POST', '/chat/completions', metrics=metrics, json=payload, **kwargs)
+    except requests.HTTPError as e:
+        if 'response_format' not in payload or not _rejects_json_mode(e.response):
+            raise
+    _logger.info("%s does not support the JSON response format, asking without it", config['model'])
+    _json_mode_unsupported.add((config['base_url'], config['model']))
+    payload = {key: value for key, value in payload.items() if key != 'response_format'}
+    return api_request(config, 'POST', '/chat/completions', metrics=metrics, json=payload, **kwargs)
+
+
+def post_chat_completion(config, payload, metrics=None):
+    """Send a chat completion request and return the decoded JSON body."""
+    return _chat_request(config, payload, metrics).json()
+
+
+def stream_chat_completion(config, payload, metrics=None):
+    """Stream a chat completion and yield the content deltas as they arrive.
+
+    Like ``post_chat_completion`` this does not touch the ORM. Transient
+    errors are retried only until the first byte is received; after that
+    the stream cannot be replayed and errors are raised. The token usage
+    sent with the last event is set in ``metrics['usage']`` and the reason
+    the answer ended in ``metrics['finish_reason']``.
+    """
+    metrics = {} if metrics is None else metrics
+    response = _chat_request(
+        config, dict(payload, stream=True, stream_options={'include_usage': True}), metrics=metrics,
+        headers={'Accept': 'text/event-stream'}, stream=True,
+    )
+    with response:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                return
+            event = json.loads(data)
+            if event.get('usage'):
+                metrics['usage'] = event['usage']
+            choices = event.get('choices') or [{}]
+            if choices[0].get('finish_reason'):
+                metrics['finish_reason'] = choices[0]['finish_reason']
+            delta = (choices[0].get('delta') or {}).get('content')
+            if delta:
+                yield delta
+
+
+def _post_or_error(config, payload, metrics=None):
+    # Runs in helper threads: hand the error back instead of raising it
+    start = time.monotonic()
+    try:
+        return post_chat_completion(config, payload, metrics)
+    except (requests.RequestException, ValueError) as e:
+        return e
+    finally:
+        if metrics is not None:
+            metrics['duration'] = time.monotonic() - start
+
+
+def _continuation_payload(payload, partial):
+    """ Payload asking for the rest of ``partial``, an answer cut by max_tokens. """
+    messages = payload['messages'] + [
+        {'role': 'assistant', 'content': partial},
+        {'role': 'user', 'content': CONTINUE_PROMPT},
+    ]
+    # The tail alone is not a JSON object
+    return dict({key: value for key, value in payload.items() if key != 'response_format'}, messages=messages)
+
+
+def complete_streamed(config, payload, content):
+    """ Complete ``content``, a streamed answer cut by ``max_tokens``, the
+    way ``_complete_truncated`` completes the other calls: the rest is asked
+    for without streaming, up to ``MAX_CONTINUATIONS`` times. Does not touch
+    the ORM. Returns the completed content and the metrics of each
+    follow-up call; a failed follow-up keeps the content received so far,
+    with ``metrics['failed']`` set. """
+    follow_ups = []
+    for _round in range(MAX_CONTINUATIONS):
+        metrics = {}
+        follow_ups.append(metrics)
+        start = time.monotonic()
+        try:
+            response = post_chat_completion(config, _continuation_payload(payload, content), metrics)
+            metrics['usage'] = response.get('usage')
+            tail = response['choices'][0]
+            content = _merge_tail(content, tail['message']['content'] or '')
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError) as e:
+            # Keep the partial answer, the parser closes what it can
+            _logger.warning("Continuation of a truncated streamed response failed: %s", str(e))
+            metrics['failed'] = True
+            break
+        finally:
+            metrics['duration'] = time.monotonic() - start
+        if tail.get('finish_reason') != 'length':
+            break
+    return content, follow_ups
+
+
+def _merge_tail(partial, tail):
+    """ Append ``tail`` to ``partial``, dropping what the model repeated.
+    Short overlaps are kept, they are as likely to be a coincidence. """
+    tail = tail.lstrip('\n')
+    for size in range(min(len(partial), len(tail), 200), 9, -1):
+        if partial.endswith(tail[:size]):
+            return partial + tail[size:]
+    return partial + tail
+
+
+class HealthAIClient(models.AbstractModel):
+    _name = 'health.ai.client'
+    _description = 'Shared OpenAI Client'
+
+    @api.model
+    def _get_config(self):
+        """ Read the connection settings from the system parameters. """
+        config = self.env['ir.config_parameter'].sudo()
+        return {
+            'api_key': config.get_param('ai_health.openai_api_key'),
+            'model': config.get_param('ai_health.openai_model'),
+            'base_url': config.get_param('ai_health.openai_base_url') or DEFAULT_BASE_URL,
+            'connect_timeout': float(config.get_param('ai_health.connect_timeout') or DEFAULT_CONNECT_TIMEOUT),
+            'read_timeout': float(config.get_param('ai_health.read_timeout') or DEFAULT_READ_TIMEOUT),
+            'max_retries': int(config.get_param('ai_health.max_retries') or DEFAULT_MAX_RETRIES),
+            'max_concurrency': int(config.get_param('ai_health.max_concurrency') or DEFAULT_MAX_CONCURRENCY),
+            'json_mode': (config.get_param('ai_health.json_mode') or 'auto') == 'auto',
+            'rate_limiter': self.env['health.ai.rate.limit']._get_limiter(
+                config.get_param('ai_health.openai_base_url') or DEFAULT_BASE_URL, config.get_param('ai_health.openai_model')),
+        }
+
+    @api.model
+    def _build_payload(self, config, request):
+        """ Chat completion body for an engine request. The engines answer
+        with a JSON object, so it is asked for in JSON mode when enabled and
+        not known to be unsupported by the server. """
+        payload = {
+            'model': config['model'],
+            'messages': request['messages'],
+            'max_tokens': request['max_tokens'],
+            'temperature': request['temperature'],
+        }
+        if config['json_mode'] and (config['base_url'], config['model']) not in _json_mode_unsupported:
+            payload['response_format'] = {'type': 'json_object'}
+        return payload
+
+    @api.model
+    def _chat_completion(self, engine, messages, max_tokens, temperature, error_message=None):
+        """ Run a chat completion for the given engine and return the message content. """
+        result = self._chat_completion_many(engine, [{
+            'messages': messages,
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'error_message': error_message,
+        }])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    @api.model
+    def _chat_completion_many(self, engine, requests_list, telemetry=None):
+        """ Run several chat completions concurrently.
+
+        Each request is a dict with ``messages``, ``max_tokens``, ``temperature``
+        and an optional ``error_message``. The HTTP calls are spread over a
+        thread pool bounded by ``ai_health.max_concurrency``; the helper threads
+        never touch the ORM. Returns, in the same order, the message content or
+        the ``UserError`` raised for each request. Responses already in the
+        cache are returned without calling the API, and identical requests
+        in flight in any worker are sent once, see ``health.ai.flight``.
+
+        One ``health.ai.call`` row is recorded per request. When a
+        ``telemetry`` list is given the rows are appended to it instead, in
+        the order of the requests, for the caller to flag the responses it
+        could not parse before recording them.
+        """
+        config = self._get_config()
+        if not config['api_key'] or not config['model']:
+            raise UserError(_("Missing configuration for OpenAI API."))
+        if not requests_list:
+            return []
+
+        # Serve what we can from the response cache and only send the rest
+        cache = self.env['health.ai.cache']
+        keys = [cache._make_key(engine, config['model'], request) for request in requests_list]
+        cached = cache._lookup(keys)
+
+        # Identical requests are sent once, and not at all while another
+        # caller is already sending them: their response is shared
+        first = {}
+        for index, key in enumerate(keys):
+            if key not in cached:
+                first.setdefault(key, index)
+        flight = self.env['health.ai.flight']
+        led, followed = flight._claim(list(first), stale_after=self._flight_timeout(config))
+        answers, sent_calls, extra_calls = {}, {}, []
+
+        def send(send_keys):
+            contents, calls = self._send_requests(engine, config, [requests_list[first[key]] for key in send_keys])
+            answers.update(zip(send_keys, contents))
+            sent_calls.update(zip(send_keys, calls))
+            extra_calls.extend(calls[len(send_keys):])
+
+        try:
+            send(led)
+        finally:
+            flight._land({key: answers.get(key) if isinstance(answers.get(key), str) else None for key in led})
+        if followed:
+            answers.update(flight._wait(followed, self._flight_timeout(config)))
+            # The leader failed or is too slow: send them ourselves
+            send([key for key in followed if key not in answers])
+
+        results, calls = [], []
+        for index, key in enumerate(keys):
+            result = cached[key] if key in cached else answers[key]
+            if first.get(key) == index and key in sent_calls:
+                calls.append(sent_calls[key])
+            else:
+                calls.append(make_call(engine, config['model'], cache_hit=True))
+            if isinstance(result, Exception):
+                result = UserError(requests_list[index].get('error_message') or _("Error retrieving a response from OpenAI."))
+            results.append(result)
+        cache._store(engine, config['model'], {
+            key: content for key, content in answers.items() if key in sent_calls and isinstance(content, str)
+        })
+        # The continuation calls come after the per-request rows so callers
+        # can still flag those by position
+        calls += extra_calls
+        if telemetry is None:
+            self.env['health.ai.call']._record(calls)
+        else:
+            telemetry.extend(calls)
+        return results
+
+    @api.model
+    def _flight_timeout(self, config):
+        """ Longest time a caller can take to get its response, retries included. """
+        return (config['connect_timeout'] + config['read_timeout'] + BACKOFF_CAP) * (config['max_retries'] + 1)
+
+    @api.model
+    def _send_requests(self, engine, config, requests_list):
+        """ Send ``requests_list`` concurrently, completing the truncated answers.
+
+        Returns the message content or the error of each request, and the
+        telemetry rows: one per request, in order, then one per continuation.
+        """
+        payloads = [self._build_payload(config, request) for request in requests_list]
+        metrics = [{} for _payload in payloads]
+        responses = self._post_many(config, payloads, metrics)
+        extra_calls = self._complete_truncated(engine, config, payloads, responses)
+
+        contents, calls = [], []
+        for response, stats in zip(responses, metrics):
+            usage = response.get('usage') if isinstance(response, dict) else None
+            call = make_call(engine, config['model'], metrics=stats, usage=usage, parse_ok=False)
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                contents.append(response['choices'][0]['message']['content'])
+                call['parse_ok'] = True
+            except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+                _logger.error("OpenAI call for %s failed: %s", engine, str(e))
+                contents.append(e)
+            calls.append(call)
+        return contents, calls + extra_calls
+
+    @api.model
+    def _post_many(self, config, payloads, metrics):
+        """ Send ``payloads`` over a thread pool bounded by ``ai_health.max_concurrency``
+        and return the decoded responses or the errors, in the same order. """
+        workers = max(1, min(config['max_concurrency'], len(payloads)))
+        if workers == 1:
+            return [_post_or_error(config, payload, stats) for payload, stats in zip(payloads, metrics)]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ai_health') as executor:
+            return list(executor.map(lambda args: _post_or_error(config, *args), zip(payloads, metrics)))
+
+    @api.model
+    def _complete_truncated(self, engine, config, payloads, responses):
+        """ Ask for the missing tail of the responses cut by ``max_tokens``.
+
+        Rather than sending the whole request again with a larger budget,
+        the partial answer is sent back as the assistant's turn and only
+        the rest of it is generated. The tail is appended to the content of
+        ``responses`` in place, up to ``MAX_CONTINUATIONS`` times. Returns
+        the telemetry rows of the follow-up calls.
+        """
+        calls = []
+        for _round in range(MAX_CONTINUATIONS):
+            cut = []
+            for index, response in enumerate(responses):
+                try:
+                    choice = response['choices'][0]
+                    if choice.get('finish_reason') == 'length' and choice['message'].get('content'):
+                        cut.append(index)
+                except (TypeError, KeyError, IndexError):
+                    continue
+            if not cut:
+                break
+            follow_ups = [
+                _continuation_payload(payloads[index], responses[index]['choices'][0]['message']['content'])
+                for index in cut
+            ]
+            metrics = [{} for _payload in follow_ups]
+            for index, response, stats in zip(cut, self._post_many(config, follow_ups, metrics), metrics):
+                usage = response.get('usage') if isinstance(response, dict) else None
+                calls.append(make_call(engine, config['model'], metrics=stats, usage=usage))
+                choice = responses[index]['choices'][0]
+                try:
+                    if isinstance(response, Exception):
+                        raise response
+                    tail = response['choices'][0]
+                    choice['message']['content'] = _merge_tail(choice['message']['content'], tail['message']['content'] or '')
+                    choice['finish_reason'] = tail.get('finish_reason')
+                except (requests.RequestException, ValueError, KeyError, IndexError, TypeError) as e:
+                    # Keep the partial answer, the parser closes what it can
+                    _logger.warning("Continuation of a truncated %s response failed: %s", engine, str(e))
+                    calls[-1]['parse_ok'] = False
+                    choice['finish_reason'] = 'stop'
+        return calls
+
+    @api.model
+    def _forget_response(self, engine, request):
+        """ Drop a cached response the engine could not use. """
+        config = self._get_config()
+        cache = self.env['health.ai.cache']
+        key = cache._make_key(engine, config['model'], request)
+        cache._discard([key])
+        self.env['health.ai.flight']._land({key: None})
+
+    @api.model
+    def _prepare_stream(self, engine, request):
+        """ Return ``(config, payload, cached)`` to stream ``request`` outside the cursor.
+
+        ``cached`` is the cached response, if any, in which case nothing
+        needs to be streamed.
+        """
+        config = self._get_config()
+        if not config['api_key'] or not config['model']:
+            raise UserError(_("Missing configuration for OpenAI API."))
+        cache = self.env['health.ai.cache']
+        key = cache._make_key(engine, config['model'], request)
+        cached = cache._lookup([key]).get(key)
+        return config, self._build_payload(config, request), cached
+
+    @api.model
+    def _store_streamed(self, engine, request, content):
+        """ Cache a response received through ``stream_chat_completion``. """
+        config = self._get_config()
+        cache = self.env['health.ai.cache']
+        cache._store(engine, config['model'], {cache._make_key(engine, config['model'], request): content})
@@ -0,0 +1,114 @@
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+import logging
+
+from .health_ai_response import parse_response, ResponseParseError
+
+_logger = logging.getLogger(__name__)
+
+
+class HealthAIEngineMixin(models.AbstractModel):
+    _name = 'health.ai.engine.mixin'
+    _description = 'AI Engine Mixin'
+
+    # Engine name used for logging and by the shared AI client
+    _ai_engine = None
+    # Keys and types of the JSON object the engine answers with, see
+    # ``health_ai_response.parse_response``
+    _ai_response_schema = {}
+
+    ai_state = fields.Selection([
+        ('draft', 'Not Requested'),
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='AI Status', default='draft', readonly=True, copy=False)
+    ai_error = fields.Text('AI Error', readonly=True, copy=False)
+
+    def _enqueue_ai_job(self, method):
+        """ Queue ``method`` for every record in ``self`` and return immediately. """
+        self.env['health.ai.job']._enqueue(self, method)
+
+    def action_submit_ai_batch(self):
+        """ Send the requests of the selected records as one offline batch. """
+        batch = self.env['health.ai.batch']._submit_records(self)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'health.ai.batch',
+            'res_id': batch.id,
+            'view_mode': 'form',
+        }
+
+    def _prepare_ai_request(self):
+        """ Return the request dict (messages, max_tokens, temperature,
+        error_message and any extra keys needed to apply the response)
+        for the current record. """
+        raise NotImplementedError()
+
+    def _ai_request(self, messages, max_tokens, temperature, error_message, engine=None, **extra):
+        """ Request dict for ``messages``; ``max_tokens`` is an upper bound,
+        the answer budget is sized from the engine's recent answers. """
+        return self.env['health.ai.prompt']._make_request(
+            engine or self._ai_engine, messages, max_tokens, temperature, error_message, **extra)
+
+    def _apply_ai_response(self, content, request):
+        """ Parse ``content`` and write the result on the current record. """
+        raise NotImplementedError()
+
+    def _parse_ai_json(self, content, schema=None):
+        """ Return the values of the engine schema, or of ``schema``, found in ``content``.
+
+        Common defects of the JSON answer are repaired locally instead of
+        asking again; a truncated answer keeps the keys it completed.
+        """
+        try:
+            values, truncated = parse_response(content, schema or self._ai_response_schema)
+        except ResponseParseError as e:
+            raise UserError(_("Could not read the AI response: %s") % e)
+        if truncated:
+            _logger.warning("Truncated %s response, using the keys it completed: %s", self._ai_engine, ', '.join(values))
+        return values
+
+    def _run_ai_batch(self, engine=None, prepare='_prepare_ai_request', apply='_apply_ai_response'):
+        """ Run the engine for every record in ``self``.
+
+        Models running other requests than their main one name them by
+        their ``engine`` and ``prepare``/``apply`` methods.
+
+        Requests are prepared and responses applied here, in the cursor
+        thread, each response in its own savepoint; only the upstream calls
+        are fanned out by the client. Returns a dict mapping the ids of the
+        failed records to their exception. A single record raises a
+        ``UserError`` caused by it instead, so direct calls keep reporting
+        errors to the user.
+        """
+        engine = engine or self._ai_engine
+        errors = {}
+        prepared = []
+        for record in self:
+            try:
+                prepared.append((record, getattr(record, prepare)()))
+            except UserError as e:
+                errors[record.id] = e
+
+        client = self.env['health.ai.client']
+        calls = []
+        results = client._chat_completion_many(engine, [request for _record, request in prepared], telemetry=calls)
+        for (record, request), result, call in zip(prepared, results, calls):
+            if isinstance(result, Exception):
+                errors[record.id] = result
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    getattr(record, apply)(result, request)
+            except Exception as e:
+                _logger.error("Error applying %s response on %s: %s", engine, record, str(e))
+                client._forget_response(engine, request)
+                errors[record.id] = e
+                call['parse_ok'] = False
+        self.env['health.ai.call']._record(calls)
+
+        if errors and len(self) == 1:
+            raise UserError(str(errors[self.id])) from errors[self.id]
+        return errors
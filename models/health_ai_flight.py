@@ -0,0 +1,140 @@
+from odoo import models, api
+import threading
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Flights left unanswered this long are taken over by the next caller
+DEFAULT_STALE_AFTER = 300  # seconds
+PURGE_AFTER = 3600  # seconds
+# Landed responses stay readable this long for the callers already waiting,
+# then the key can be claimed again: this is not a response cache
+LANDED_GRACE = 5  # seconds
+POLL_START = 0.05
+POLL_MAX = 1.0
+
+# Per-worker events of the flights led by this process, set when they land
+# so the other threads of the worker stop waiting without polling
+_events = {}
+_events_lock = threading.Lock()
+
+
+class HealthAIFlight(models.AbstractModel):
+    """ Single-flight coalescing of identical upstream calls.
+
+    Before sending a request that missed the cache, the client claims its
+    cache key in ``health_ai_flight``. The first caller leads the flight
+    and sends the request; callers of the same key meanwhile, in this
+    worker or another one, wait for the response it publishes instead of
+    sending it again. Rows are written on a cursor of their own, so they
+    are visible at once and do not depend on the callers' transactions.
+    """
+    _name = 'health.ai.flight'
+    _description = 'AI In-Flight Requests'
+
+    def init(self):
+        self._cr.execute("""
+            CREATE TABLE IF NOT EXISTS health_ai_flight (
+                key varchar PRIMARY KEY,
+                response text,
+                started_at timestamp NOT NULL
+            )
+        """)
+        self._cr.execute("ALTER TABLE health_ai_flight ADD COLUMN IF NOT EXISTS landed_at timestamp")
+
+    @api.model
+    def _claim(self, keys, stale_after=DEFAULT_STALE_AFTER):
+        """ Return ``(led, followed)``: the keys this caller must send and the
+        keys already in flight elsewhere. A flight that never landed is taken
+        over after ``stale_after`` seconds, one that landed after
+        ``LANDED_GRACE`` seconds. """
+        if not keys:
+            return [], []
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute("""
+                    INSERT INTO health_ai_flight (key, started_at)
+                    SELECT key, now() at time zone 'UTC' FROM unnest(%s::varchar[]) AS key
+                    ON CONFLICT (key) DO UPDATE
+                       SET started_at = EXCLUDED.started_at, response = NULL, landed_at = NULL
+                     WHERE health_ai_flight.started_at < EXCLUDED.started_at - %s * interval '1 second'
+                        OR health_ai_flight.landed_at < EXCLUDED.started_at - %s * interval '1 second'
+                 RETURNING key
+                """, (list(keys), stale_after, LANDED_GRACE))
+                claimed = {row[0] for row in cr.fetchall()}
+        except Exception as e:
+            _logger.warning("Could not coalesce %s AI requests, sending them: %s", len(keys), str(e))
+            return list(keys), []
+        with _events_lock:
+            for key in claimed:
+                _events[key] = threading.Event()
+        return [key for key in keys if key in claimed], [key for key in keys if key not in claimed]
+
+    @api.model
+    def _land(self, responses):
+        """ Publish the ``{key: content}`` of the led flights; keys whose
+        content is None failed, or were not usable, and are released for the
+        waiters to send. """
+        if not responses:
+            return
+        done = {key: content for key, content in responses.items() if content is not None}
+        failed = [key for key, content in responses.items() if content is None]
+        try:
+            with self.env.registry.cursor() as cr:
+                if done:
+                    cr.execute("""
+                        UPDATE health_ai_flight f SET response = t.response, landed_at = now() at time zone 'UTC'
+                          FROM unnest(%s::varchar[], %s::text[]) AS t(key, response)
+                         WHERE f.key = t.key
+                    """, (list(done), list(done.values())))
+                if failed:
+                    cr.execute("DELETE FROM health_ai_flight WHERE key IN %s", (tuple(failed),))
+        except Exception as e:
+            # The waiters send the requests themselves once the flights are stale
+            _logger.warning("Could not publish %s AI responses: %s", len(responses), str(e))
+        finally:
+            with _events_lock:
+                for key in responses:
+                    event = _events.pop(key, None)
+                    if event:
+                        event.set()
+
+    @api.model
+    def _wait(self, keys, timeout):
+        """ Wait up to ``timeout`` seconds for the flights of ``keys`` and
+        return the ``{key: content}`` that landed. Keys missing from the
+        result failed or took too long, the caller sends them itself. """
+        found = {}
+        waiting = set(keys)
+        deadline = time.monotonic() + timeout
+        delay = POLL_START
+        with self.env.registry.cursor() as cr:
+            while waiting:
+                cr.execute("SELECT key, response FROM health_ai_flight WHERE key IN %s", (tuple(waiting),))
+                rows = dict(cr.fetchall())
+                for key in list(waiting):
+                    if key not in rows:
+                        waiting.discard(key)
+                    elif rows[key] is not None:
+                        found[key] = rows[key]
+                        waiting.discard(key)
+                remaining = deadline - time.monotonic()
+                if not waiting or remaining <= 0:
+                    break
+                with _events_lock:
+                    event = next((_events[key] for key in waiting if key in _events), None)
+                if event is not None:
+                    event.wait(min(delay, remaining))
+                else:
+                    time.sleep(min(delay, remaining))
+                delay = min(delay * 2, POLL_MAX)
+        return found
+
+    @api.model
+    def _purge(self):
+        self.env.cr.execute("""
+            DELETE FROM health_ai_flight
+             WHERE started_at < (now() at time zone 'UTC') - %s * interval '1 second'
+                OR landed_at < (now() at time zone 'UTC') - %s * interval '1 second'
+        """, (PURGE_AFTER, LANDED_GRACE))
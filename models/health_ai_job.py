@@ -0,0 +1,210 @@
+from odoo import fields, models, api, _
+from odoo.exceptions import UserError
+from datetime import timedelta
+import logging
+import time
+
+import psycopg2
+import requests
+
+from .health_ai_client import RETRY_STATUSES
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_DELAY = 30  # seconds, doubled on every attempt
+STALE_AFTER = 15  # minutes a job may stay running before being requeued
+DEFAULT_TIME_BUDGET = 240  # seconds a cron run keeps claiming jobs
+
+
+def _is_transient(error):
+    """ Whether ``error`` may go away on its own: the API could not be
+    reached, or answered with a rate limit or server error. """
+    # Single records raise a UserError caused by the actual error
+    error = error.__cause__ or error
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, requests.RequestException)
+
+
+class HealthAIJob(models.Model):
+    _name = 'health.ai.job'
+    _description = 'Queued AI Job'
+    _order = 'id desc'
+
+    name = fields.Char('Job', required=True)
+    res_model = fields.Char('Model', required=True, index=True)
+    res_id = fields.Integer('Record ID', required=True, index=True)
+    method = fields.Char('Method', required=True)
+    user_id = fields.Many2one('res.users', string='Requested By', default=lambda self: self.env.user)
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='queued', required=True, index=True)
+    attempts = fields.Integer('Attempts', default=0)
+    max_attempts = fields.Integer('Max Attempts', default=DEFAULT_MAX_ATTEMPTS)
+    date_next = fields.Datetime('Next Attempt', default=fields.Datetime.now, index=True)
+    date_started = fields.Datetime('Started', readonly=True)
+    date_done = fields.Datetime('Finished', readonly=True)
+    error = fields.Text('Error', readonly=True)
+
+    def init(self):
+        # At most one pending job per record and method, so concurrent clicks
+        # collapse into a single upstream call.
+        self._cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS health_ai_job_pending_uniq
+            ON health_ai_job (res_model, res_id, method)
+            WHERE state IN ('queued', 'running')
+        """)
+
+    @api.model
+    def _enqueue(self, records, method):
+        """ Queue ``method`` for each record and wake up the job worker. """
+        if not method.startswith('_run_'):
+            raise UserError(_("Method %s cannot be queued.") % method)
+
+        pending = self.sudo().search([
+            ('res_model', '=', records._name),
+            ('res_id', 'in', records.ids),
+            ('method', '=', method),
+            ('state', 'in', ('queued', 'running')),
+        ])
+        pending_ids = set(pending.mapped('res_id'))
+        to_queue = records.filtered(lambda r: r.id not in pending_ids)
+        vals_list = [{
+            'name': '%s: %s' % (record._description, record.display_name),
+            'res_model': record._name,
+            'res_id': record.id,
+            'method': method,
+        } for record in to_queue]
+        try:
+            with self.env.cr.savepoint():
+                jobs = self.sudo().create(vals_list)
+        except psycopg2.IntegrityError:
+            # Another request queued the same records in the meantime
+            jobs = self.sudo().search([
+                ('res_model', '=', records._name),
+                ('res_id', 'in', to_queue.ids),
+                ('method', '=', method),
+                ('state', 'in', ('queued', 'running')),
+            ])
+        records.write({'ai_state': 'queued', 'ai_error': False})
+        self._trigger_worker()
+        return pending | jobs
+
+    @api.model
+    def _trigger_worker(self):
+        cron = self.env.ref('%s.ir_cron_health_ai_job' % self._module, raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _requeue_stale_jobs(self):
+        """ Jobs left running by a killed worker go back to the queue. """
+        limit = fields.Datetime.now() - timedelta(minutes=STALE_AFTER)
+        stale = self.search([('state', '=', 'running'), ('date_started', '<', limit)])
+        if stale:
+            _logger.warning("Requeueing %s stale AI jobs", len(stale))
+            stale.write({'state': 'queued', 'date_next': fields.Datetime.now()})
+
+    @api.model
+    def _claim_jobs(self, limit):
+        """ Atomically move up to ``limit`` due jobs to running. """
+        self.env.cr.execute("""
+            UPDATE health_ai_job
+               SET state = 'running', date_started = (now() at time zone 'UTC'),
+                   attempts = attempts + 1
+             WHERE id IN (
+                SELECT id FROM health_ai_job
+                 WHERE state = 'queued' AND date_next <= (now() at time zone 'UTC')
+                 ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+             )
+         RETURNING id
+        """, (limit,))
+        job_ids = [row[0] for row in self.env.cr.fetchall()]
+        self.invalidate_model(['state', 'date_started', 'attempts'])
+        return self.browse(job_ids)
+
+    @api.model
+    def _cron_process_jobs(self, limit=None):
+        """ Entry point of the job worker cron.
+
+        Jobs are claimed ``limit`` at a time and run as batches sharing the
+        same model, method and user, so the engines can fan the upstream
+        calls out. The worker keeps claiming until the queue is empty or its
+        time budget is spent, then wakes itself up again if work remains.
+        """
+        config = self.env['ir.config_parameter'].sudo()
+        limit = limit or int(config.get_param('ai_health.job_batch_size') or DEFAULT_BATCH_SIZE)
+        deadline = time.monotonic() + int(config.get_param('ai_health.job_time_budget') or DEFAULT_TIME_BUDGET)
+
+        self._requeue_stale_jobs()
+        while time.monotonic() < deadline:
+            jobs = self._claim_jobs(limit)
+            self.env.cr.commit()
+            if not jobs:
+                return
+            groups = {}
+            for job in jobs:
+                groups.setdefault((job.res_model, job.method, job.user_id), self.browse())
+                groups[(job.res_model, job.method, job.user_id)] |= job
+            for group in groups.values():
+                group._run()
+                self.env.cr.commit()
+        self._trigger_worker()
+
+    def _run(self):
+        """ Run jobs sharing the same model, method and user as one batch. """
+        first = self[0]
+        model = self.env[first.res_model].with_user(first.user_id or self.env.user)
+        records = model.browse(self.mapped('res_id')).exists()
+        jobs_by_res_id = {job.res_id: job for job in self}
+
+        missing = self.filtered(lambda j: j.res_id not in records.ids)
+        missing.write({'state': 'done', 'date_done': fields.Datetime.now(), 'error': _("Record no longer exists.")})
+        if not records:
+            return
+
+        records.sudo().write({'ai_state': 'running'})
+        try:
+            with self.env.cr.savepoint():
+                errors = getattr(records, first.method)() or {}
+        except Exception as e:
+            _logger.exception("AI jobs %s failed", self.ids)
+            errors = dict.fromkeys(records.ids, e)
+
+        for record in records:
+            job = jobs_by_res_id[record.id]
+            if record.id in errors:
+                job._mark_failed(record, errors[record.id])
+            else:
+                job.write({'state': 'done', 'date_done': fields.Datetime.now(), 'error': False})
+                record.sudo().write({'ai_state': 'done', 'ai_error': False})
+
+    def _mark_failed(self, records, error):
+        """ Requeue with exponential backoff until the attempts run out,
+        when ``error`` is transient; fail the job at once otherwise. """
+        message = str(error)
+        if _is_transient(error) and self.attempts < self.max_attempts:
+            delay = RETRY_DELAY * (2 ** (self.attempts - 1))
+            self.write({
+                'state': 'queued',
+                'error': message,
+                'date_next': fields.Datetime.now() + timedelta(seconds=delay),
+            })
+            records.sudo().write({'ai_state': 'queued', 'ai_error': message})
+        else:
+            self.write({'state': 'failed', 'error': message, 'date_done': fields.Datetime.now()})
+            records.sudo().write({'ai_state': 'failed', 'ai_error': message})
+
+    def action_retry(self):
+        """ Put failed jobs back in the queue. """
+        for job in self.filtered(lambda j: j.state == 'failed'):
+            job.write({'state': 'queued', 'attempts': 0, 'error': False, 'date_next': fields.Datetime.now()})
+            self.env[job.res_model].browse(job.res_id).exists().sudo().write({'ai_state': 'queued', 'ai_error': False})
+        self._trigger_worker()
@@ -0,0 +1,169 @@
+from odoo import models, api, _
+from odoo.exceptions import UserError
+import json
+import math
+import threading
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:
+    _logger.debug("Cannot import tiktoken, prompt tokens will be estimated.")
+    tiktoken = None
+
+DEFAULT_PROMPT_BUDGET = 3000
+DEFAULT_CONTEXT_WINDOW = 16385
+# Tokens the chat format adds around each message and before the answer
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+MIN_ANSWER_TOKENS = 128
+# The answer budget is the longest recent answers of the engine plus this margin
+ANSWER_MARGIN = 1.25
+ANSWER_STEP = 64
+ANSWER_SAMPLE_DAYS = 14
+MIN_ANSWER_SAMPLES = 20
+ANSWER_REFRESH = 600  # seconds
+
+# Per-worker tokenizers by model name, None when unavailable
+_encodings = {}
+_encodings_lock = threading.Lock()
+# Per-worker answer sizes: (dbname, engine) -> (tokens or None, read at)
+_answer_sizes = {}
+_answer_sizes_lock = threading.Lock()
+
+
+def compact_json(data):
+    """ JSON without the indentation and spaces, which cost tokens for nothing. """
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def _get_encoding(model):
+    with _encodings_lock:
+        if model not in _encodings:
+            encoding = None
+            if tiktoken is not None:
+                try:
+                    try:
+                        encoding = tiktoken.encoding_for_model(model or '')
+                    except KeyError:
+                        encoding = tiktoken.get_encoding('cl100k_base')
+                except Exception as e:
+                    # The encoding files are downloaded on first use
+                    _logger.warning("Cannot load the tokenizer of %s, prompt tokens will be estimated: %s", model, e)
+            _encodings[model] = encoding
+        return _encodings[model]
+
+
+def count_tokens(text, model=None):
+    """ Number of tokens of ``text`` with the tokenizer of ``model``, or an
+    estimate of about four characters per token without tiktoken. """
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return int(math.ceil(len(text) / 4.0))
+
+
+def count_message_tokens(messages, model=None):
+    return sum(count_tokens(message['content'], model) + MESSAGE_OVERHEAD for message in messages) + REPLY_OVERHEAD
+
+
+def shrink_dict(data):
+    """ Drop the last key of ``data``, whose keys go by decreasing importance. """
+    if not data:
+        return None
+    return dict(list(data.items())[:-1])
+
+
+def fit_sections(sections, budget, model=None):
+    """ Serialize the prompt ``sections`` within ``budget`` tokens.
+
+    ``sections`` is a list of ``(data, shrink)`` by decreasing priority;
+    strings are kept as is, anything else is written as compact JSON.
+    ``shrink(data)`` returns a smaller version of ``data``, or None once it
+    cannot be reduced; sections without ``shrink`` are kept whole. The
+    lowest priority sections are reduced first. Returns the texts, which
+    can still exceed the budget when the sections kept whole do.
+    """
+    datas = [data for data, _shrink in sections]
+    texts = [data if isinstance(data, str) else compact_json(data) for data in datas]
+    sizes = [count_tokens(text, model) for text in texts]
+    for position in reversed(range(len(sections))):
+        shrink = sections[position][1]
+        while shrink and sum(sizes) > budget:
+            smaller = shrink(datas[position])
+            if smaller is None:
+                break
+            datas[position] = smaller
+            texts[position] = compact_json(smaller)
+            sizes[position] = count_tokens(texts[position], model)
+    return texts
+
+
+class HealthAIPrompt(models.AbstractModel):
+    """ Token budget of the engine requests.
+
+    The data sent in the prompts is serialized compactly and reduced to
+    fit ``ai_health.prompt_token_budget``; ``max_tokens`` is sized from the
+    answers the engine actually gave recently instead of a fixed value.
+    """
+    _name = 'health.ai.prompt'
+    _description = 'AI Prompt Budget'
+
+    @api.model
+    def _get_settings(self):
+        config = self.env['ir.config_parameter'].sudo()
+        return {
+            'model': config.get_param('ai_health.openai_model'),
+            'budget': int(config.get_param('ai_health.prompt_token_budget') or DEFAULT_PROMPT_BUDGET),
+            'context_window': int(config.get_param('ai_health.context_window') or DEFAULT_CONTEXT_WINDOW),
+        }
+
+    @api.model
+    def _fit(self, sections):
+        """ ``fit_sections`` with the configured budget and tokenizer. """
+        settings = self._get_settings()
+        return fit_sections(sections, settings['budget'], settings['model'])
+
+    @api.model
+    def _answer_tokens(self, engine, limit):
+        """ ``max_tokens`` for ``engine``: the 99th percentile of its recent
+        answers plus a margin, rounded up so the cache keys stay stable, and
+        at most ``limit``. Answers cut at the budget raise the percentile,
+        so the budget grows back when it is too tight. """
+        key = (self.env.cr.dbname, engine)
+        with _answer_sizes_lock:
+            tokens, read_at = _answer_sizes.get(key, (None, 0.0))
+        if not read_at or time.monotonic() - read_at > ANSWER_REFRESH:
+            self.env.cr.execute("""
+                SELECT count(*), percentile_cont(0.99) WITHIN GROUP (ORDER BY completion_tokens)
+                  FROM health_ai_call
+                 WHERE engine = %s AND mode != 'batch' AND http_status = 200 AND parse_ok AND NOT cache_hit
+                   AND completion_tokens > 0
+                   AND date > (now() at time zone 'UTC') - %s * interval '1 day'
+            """, (engine, ANSWER_SAMPLE_DAYS))
+            count, percentile = self.env.cr.fetchone()
+            tokens = percentile if count >= MIN_ANSWER_SAMPLES else None
+            with _answer_sizes_lock:
+                _answer_sizes[key] = (tokens, time.monotonic())
+        if tokens is None:
+            return limit
+        tokens = int(math.ceil(tokens * ANSWER_MARGIN / ANSWER_STEP)) * ANSWER_STEP
+        return max(MIN_ANSWER_TOKENS, min(limit, tokens))
+
+    @api.model
+    def _make_request(self, engine, messages, max_tokens, temperature, error_message, **extra):
+        """ Engine request for ``messages``, answering within ``max_tokens`` at most. """
+        settings = self._get_settings()
+        available = settings['context_window'] - count_message_tokens(messages, settings['model'])
+        if available < MIN_ANSWER_TOKENS:
+            raise UserError(_("The request is too long for the AI model, lower the prompt token budget."))
+        return dict(
+            extra,
+            messages=messages,
+            max_tokens=min(self._answer_tokens(engine, max_tokens), available),
+            temperature=temperature,
+            error_message=error_message,
+        )
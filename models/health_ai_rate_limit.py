@@ -0,0 +1,133 @@
+from odoo import models, api
+from odoo.sql_db import db_connect
+import time
+import logging
+
+import psycopg2
+import requests
+
+_logger = logging.getLogger(__name__)
+
+# Share of the quotas actually used, so clock skew and the calls of other
+# applications on the same key do not push the provider over its limit
+HEADROOM = 0.95
+DEFAULT_MAX_WAIT = 60.0  # seconds
+
+
+class RateLimitExceeded(requests.RequestException):
+    pass
+
+
+class RateLimiter(object):
+    """ Token bucket shared by all the workers using the same database.
+
+    The bucket of an API key and model is a row of ``health_ai_rate_bucket``
+    holding the requests and tokens left; it is refilled at the quota rate
+    and debited by every request, in one UPDATE committed on its own
+    cursor. The balance may go negative: the request then waits for the
+    time the refill takes to cover it, so concurrent callers are spaced
+    evenly instead of all retrying when the quota resets. It does not
+    touch the ORM and can be used from helper threads.
+    """
+
+    def __init__(self, dbname, key, rpm, tpm, max_wait=DEFAULT_MAX_WAIT):
+        self.dbname = dbname
+        self.key = key
+        self.rpm = rpm * HEADROOM
+        self.tpm = tpm * HEADROOM
+        self.max_wait = max_wait
+
+    def _update(self, query, requests_count=0, tokens=0):
+        """ Run ``query`` on the bucket and return its ``(requests, tokens)``,
+        or None when the database cannot be reached. """
+        params = {
+            'key': self.key, 'rpm': self.rpm or 1.0, 'tpm': self.tpm or 1.0,
+            'requests': requests_count, 'tokens': tokens,
+        }
+        try:
+            with db_connect(self.dbname).cursor() as cr:
+                cr.execute(query, params)
+                row = cr.fetchone()
+                if row is None:
+                    # First use of the key: start with a full bucket
+                    cr.execute("""
+                        INSERT INTO health_ai_rate_bucket (key, requests, tokens, updated_at)
+                        VALUES (%(key)s, %(rpm)s, %(tpm)s, clock_timestamp())
+                        ON CONFLICT (key) DO NOTHING
+                    """, params)
+                    cr.execute(query, params)
+                    row = cr.fetchone()
+                return row
+        except psycopg2.Error as e:
+            # Better an occasional 429 than no AI call at all
+            _logger.warning("Rate limiter unavailable, sending without it: %s", e)
+            return None
+
+    def acquire(self, tokens):
+        """ Take one request and ``tokens`` tokens from the bucket, sleeping
+        until they are available. Raises ``RateLimitExceeded``, without
+        taking anything, when that would take more than ``max_wait``. """
+        requests_count = 1 if self.rpm else 0
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+        row = self._update("""
+            UPDATE health_ai_rate_bucket
+               SET requests = LEAST(%(rpm)s, requests + %(rpm)s / 60.0 * EXTRACT(EPOCH FROM clock_timestamp() - updated_at)) - %(requests)s,
+                   tokens = LEAST(%(tpm)s, tokens + %(tpm)s / 60.0 * EXTRACT(EPOCH FROM clock_timestamp() - updated_at)) - %(tokens)s,
+                   updated_at = clock_timestamp()
+             WHERE key = %(key)s
+         RETURNING requests, tokens
+        """, requests_count, tokens)
+        if row is None:
+            return
+        wait = max(0.0, -row[0] * 60.0 / (self.rpm or 1.0), -row[1] * 60.0 / (self.tpm or 1.0))
+        if wait > self.max_wait:
+            self.release(requests_count, tokens)
+            raise RateLimitExceeded("Rate limit of %s reached, the next slot is in %.0fs" % (self.key, wait))
+        if wait:
+            _logger.debug("Rate limit of %s, waiting %.2fs", self.key, wait)
+            time.sleep(wait)
+
+    def release(self, requests_count, tokens):
+        """ Give back what was taken for a request that is not sent. """
+        self._update("""
+            UPDATE health_ai_rate_bucket
+               SET requests = requests + %(requests)s, tokens = tokens + %(tokens)s
+             WHERE key = %(key)s
+         RETURNING requests, tokens
+        """, requests_count, tokens)
+
+    def throttle(self):
+        """ Empty the bucket after the provider answered 429: the quota is
+        used by someone else too, every worker backs off until it refills. """
+        self._update("""
+            UPDATE health_ai_rate_bucket
+               SET requests = LEAST(requests, 0), tokens = LEAST(tokens, 0), updated_at = clock_timestamp()
+             WHERE key = %(key)s
+         RETURNING requests, tokens
+        """)
+
+
+class HealthAIRateLimit(models.AbstractModel):
+    _name = 'health.ai.rate.limit'
+    _description = 'AI Rate Limiter'
+
+    def init(self):
+        self._cr.execute("""
+            CREATE TABLE IF NOT EXISTS health_ai_rate_bucket (
+                key varchar PRIMARY KEY,
+                requests double precision NOT NULL,
+                tokens double precision NOT NULL,
+                updated_at timestamp NOT NULL
+            )
+        """)
+
+    @api.model
+    def _get_limiter(self, base_url, model):
+        """ The limiter of ``model``, or None when no quota is configured. """
+        config = self.env['ir.config_parameter'].sudo()
+        rpm = float(config.get_param('ai_health.rate_limit_rpm') or 0)
+        tpm = float(config.get_param('ai_health.rate_limit_tpm') or 0)
+        if not rpm and not tpm:
+            return None
+        max_wait = float(config.get_param('ai_health.rate_limit_max_wait') or DEFAULT_MAX_WAIT)
+        return RateLimiter(self.env.cr.dbname, '%s|%s' % (base_url, model), rpm, tpm, max_wait)
@@ -0,0 +1,168 @@
+from odoo import models, api
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50
+DEFAULT_TIME_BUDGET = 240  # seconds a cron run keeps starting chunks
+
+# Engines run over the workforce: model, batch method, and the field the
+# records are kept per, the employee's latest diagnosis or the employee
+ENGINES = {
+    'risk_scoring': ('health.risk.scoring', '_run_risk_scoring', 'diagnosis_id'),
+    'recommendation': ('health.recommendation', '_run_recommendation', 'diagnosis_id'),
+    'outbreak_prediction': ('health.disease.outbreak.prediction', '_run_prediction', 'employee_id'),
+}
+# Records in these states are up to date or about to be
+KEPT_STATES = ('done', 'queued', 'running')
+
+
+class HealthAIRescore(models.AbstractModel):
+    """ Scheduled runs of the engines over all the active employees.
+
+    Employees are walked by increasing id, a chunk per transaction, and
+    the last id of each committed chunk is kept in the
+    ``ai_health.rescore_checkpoint.<engine>`` parameter: a run stopped by
+    its time budget, or killed, resumes after it. Each chunk runs the
+    engine as one batch, each response applied in its own savepoint, so
+    a bad answer only fails its record. Employees whose latest diagnosis
+    was already processed are skipped, records that failed are retried.
+    """
+    _name = 'health.ai.rescore'
+    _description = 'Scheduled AI Rescoring'
+
+    @api.model
+    def _get_settings(self):
+        config = self.env['ir.config_parameter'].sudo()
+        return {
+            'chunk_size': int(config.get_param('ai_health.rescore_chunk_size') or DEFAULT_CHUNK_SIZE),
+            'time_budget': int(config.get_param('ai_health.rescore_time_budget') or DEFAULT_TIME_BUDGET),
+        }
+
+    @api.model
+    def _get_checkpoint(self, engine):
+        # Read directly, the parameter cache does not see the direct writes
+        self.env.cr.execute("SELECT value FROM ir_config_parameter WHERE key = %s",
+                            ('ai_health.rescore_checkpoint.%s' % engine,))
+        row = self.env.cr.fetchone()
+        return int(row and row[0] or 0)
+
+    @api.model
+    def _set_checkpoint(self, engine, last_id):
+        # Written directly so the parameter cache of every worker is not
+        # invalidated after each chunk
+        self.env.cr.execute("""
+            INSERT INTO ir_config_parameter (key, value, create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'))
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, write_date = EXCLUDED.write_date
+        """, ('ai_health.rescore_checkpoint.%s' % engine, str(last_id), self.env.uid, self.env.uid))
+
+    @api.model
+    def _get_latest_diagnoses(self, employees):
+        """ Return ``{employee id: (diagnosis id, date)}`` of the latest finished diagnoses. """
+        self.env['health.diagnosis'].flush_model(['employee_id', 'date_diagnosis', 'ai_state'])
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (employee_id) employee_id, id, date_diagnosis
+              FROM health_diagnosis
+             WHERE employee_id IN %s AND ai_state = 'done'
+             ORDER BY employee_id, date_diagnosis DESC NULLS LAST, id DESC
+        """, (tuple(employees.ids),))
+        return {employee_id: (diagnosis_id, date) for employee_id, diagnosis_id, date in self.env.cr.fetchall()}
+
+    @api.model
+    def _get_chunk_records(self, engine, employees):
+        """ Return the records of ``engine`` to run for ``employees``: the
+        failed or unprocessed ones about their latest diagnosis, and new
+        ones where there is none. """
+        model_name, _method, key = ENGINES[engine]
+        Model = self.env[model_name]
+        latest = self._get_latest_diagnoses(employees)
+        if not latest:
+            return Model
+
+        if key == 'diagnosis_id':
+            domain = [('diagnosis_id', 'in', [diagnosis_id for diagnosis_id, _date in latest.values()])]
+        else:
+            domain = [('employee_id', 'in', list(latest)), ('source', '=', 'employee')]
+        current = {}
+        for record in Model.search(domain, order='id desc'):
+            date = latest[record.employee_id.id][1]
+            # Per employee, only the records created since the latest diagnosis are about it
+            if key == 'employee_id' and date and record.create_date < date:
+                continue
+            current.setdefault(record.employee_id.id, record)
+
+        records = Model
+        vals_list = []
+        for employee_id, (diagnosis_id, _date) in latest.items():
+            record = current.get(employee_id)
+            if record is None:
+                vals = {'employee_id': employee_id}
+                if key == 'diagnosis_id':
+                    vals['diagnosis_id'] = diagnosis_id
+                vals_list.append(vals)
+            elif record.ai_state not in KEPT_STATES:
+                records |= record
+        return records | Model.create(vals_list)
+
+    @api.model
+    def _run_chunk(self, engine, employees):
+        """ Run ``engine`` for ``employees``; return the numbers of records run and failed. """
+        _model_name, method, _key = ENGINES[engine]
+        records = self._get_chunk_records(engine, employees)
+        if not records:
+            return 0, 0
+        records.write({'ai_state': 'running', 'ai_error': False})
+        try:
+            with self.env.cr.savepoint():
+                errors = getattr(records, method)() or {}
+        except Exception as e:
+            # A single record raises instead of returning its error
+            _logger.error("Scheduled %s of %s failed: %s", engine, records, str(e))
+            errors = dict.fromkeys(records.ids, e)
+
+        failed = records.filtered(lambda record: record.id in errors)
+        (records - failed).write({'ai_state': 'done'})
+        for record in failed:
+            record.write({'ai_state': 'failed', 'ai_error': str(errors[record.id])})
+        return len(records), len(failed)
+
+    @api.model
+    def _cron_rescore(self, engine):
+        """ Entry point of the rescoring crons.
+
+        Chunks are started while the time budget allows one more chunk as
+        long as the longest so far. When it is spent, the cron wakes itself
+        up again to go on from the checkpoint; once all the employees are
+        done the checkpoint is reset for the next run.
+        """
+        settings = self._get_settings()
+        last_id = self._get_checkpoint(engine)
+        if last_id:
+            _logger.info("Resuming the scheduled %s after employee %s", engine, last_id)
+
+        deadline = time.monotonic() + settings['time_budget']
+        longest = 0.0
+        while time.monotonic() + longest < deadline:
+            started = time.monotonic()
+            employees = self.env['hr.employee'].search([('id', '>', last_id)], order='id', limit=settings['chunk_size'])
+            if not employees:
+                self._set_checkpoint(engine, 0)
+                self.env.cr.commit()
+                _logger.info("Scheduled %s done for all the employees", engine)
+                return
+            count, failed = self._run_chunk(engine, employees)
+            last_id = employees[-1].id
+            self._set_checkpoint(engine, last_id)
+            self.env.cr.commit()
+            self.env.invalidate_all()
+            longest = max(longest, time.monotonic() - started)
+            _logger.info("Scheduled %s: %s records run, %s failed, up to employee %s", engine, count, failed, last_id)
+        self._trigger_cron(engine)
+
+    @api.model
+    def _trigger_cron(self, engine):
+        cron = self.env.ref('%s.ir_cron_health_rescore_%s' % (self._module, engine), raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
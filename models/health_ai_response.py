@@ -0,0 +1,174 @@
+import json
+import re
+
+FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)(?:```|$)', re.DOTALL | re.IGNORECASE)
+# A JSON string, or one of the defects fixed outside strings
+PYTHON_LITERAL_RE = re.compile(r'"(?:\\.|[^"\\])*"|\b(True|False|None)\b')
+BARE_KEY_RE = re.compile(r'"(?:\\.|[^"\\])*"|([{,]\s*)([A-Za-z_][\w-]*)(\s*:)')
+TRAILING_COMMA_RE = re.compile(r'"(?:\\.|[^"\\])*"|,(\s*[}\]])')
+DANGLING_TAIL_RE = re.compile(r'(?:,\s*|(?<=[{\[])\s*)(?:"(?:\\.|[^"\\])*"\s*:?\s*)?$')
+LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+
+
+class ResponseParseError(ValueError):
+    pass
+
+
+def _scan(text):
+    """ Copy the first JSON object of ``text``, quoting strings with double
+    quotes, and return ``(copy, open brackets, in_string)``. The copy stops
+    where the object closes, ignoring anything after it. """
+    out = []
+    stack = []
+    quote = None
+    escape = False
+    for char in text[text.index('{'):]:
+        if quote:
+            if escape:
+                escape = False
+                if char == "'":
+                    out[-1] = "'"  # \' is not a JSON escape
+                    continue
+            elif char == '\\':
+                escape = True
+            elif char == quote:
+                out.append('"')
+                quote = None
+                continue
+            elif char == '"':
+                out.append('\\"')
+                continue
+            elif char == '\n':
+                out.append('\\n')
+                continue
+            out.append(char)
+            continue
+        if char in '"\'':
+            quote = char
+            out.append('"')
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+            out.append(char)
+        elif char in '}]':
+            if stack:
+                stack.pop()
+            out.append(char)
+            if not stack:
+                break
+        else:
+            out.append(char)
+    return ''.join(out), stack, quote is not None
+
+
+def _sub_outside_strings(regex, replace, text):
+    return regex.sub(lambda match: replace(match) if match.group(1) is not None else match.group(0), text)
+
+
+def extract_json(content):
+    """ Return ``(data, repaired, truncated)`` for the JSON object in ``content``.
+
+    The object is taken from the first ``{`` to its matching brace, inside
+    code fences or prose. If it does not decode, common defects are fixed:
+    single-quoted strings, Python literals, unquoted keys, trailing commas
+    and raw newlines in strings. A truncated object is closed after dropping
+    its incomplete last member; ``truncated`` tells the caller data may be
+    missing. Raises ``ResponseParseError`` when no object can be recovered.
+    """
+    text = (content or '').strip()
+    fenced = FENCE_RE.search(text)
+    if fenced and '{' in fenced.group(1):
+        text = fenced.group(1)
+    if '{' not in text:
+        raise ResponseParseError("No JSON object in the response.")
+
+    start = text.index('{')
+    candidate = text[start:]
+    copy, stack, in_string = _scan(candidate)
+    truncated = bool(stack)
+    try:
+        # Valid JSON followed by prose is the common case
+        data, _end = json.JSONDecoder(strict=False).raw_decode(candidate)
+        return _check_object(data), False, False
+    except ValueError:
+        pass
+
+    if in_string:
+        copy += '"'
+    copy = _sub_outside_strings(PYTHON_LITERAL_RE, lambda m: LITERALS[m.group(1)], copy)
+    copy = _sub_outside_strings(BARE_KEY_RE, lambda m: '%s"%s"%s' % (m.group(1), m.group(2), m.group(3)), copy)
+    if truncated:
+        copy = DANGLING_TAIL_RE.sub('', copy.rstrip()) + ''.join(reversed(stack))
+    copy = _sub_outside_strings(TRAILING_COMMA_RE, lambda m: m.group(1), copy)
+    try:
+        data = json.loads(copy, strict=False)
+    except ValueError as e:
+        raise ResponseParseError("Invalid JSON in the response: %s" % e)
+    return _check_object(data), True, truncated
+
+
+def _check_object(data):
+    if not isinstance(data, dict):
+        raise ResponseParseError("The response is not a JSON object.")
+    return data
+
+
+def _to_text(value):
+    if isinstance(value, dict):
+        return '\n'.join('%s: %s' % (key, _to_text(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return '\n'.join(_to_text(item) for item in value)
+    return '' if value is None else str(value)
+
+
+def to_number(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict) and len(value) == 1:
+        return to_number(next(iter(value.values())))
+    match = re.search(r'-?\d+(?:[.,]\d+)?', str(value))
+    if not match:
+        raise ValueError(value)
+    return float(match.group(0).replace(',', '.'))
+
+
+COERCE = {
+    'text': _to_text,
+    'number': to_number,
+    'any': lambda value: value,
+}
+
+
+def coerce_values(data, schema):
+    """ Values of ``data`` for the keys of ``schema``, ``{key: 'text' | 'number' | 'any'}``.
+
+    Keys are matched ignoring case and spacing, values coerced to their
+    type; keys that are missing or cannot be coerced are left out for the
+    engine to default.
+    """
+    if not isinstance(data, dict):
+        return {}
+    by_key = {re.sub(r'[\s_-]+', '_', str(key).strip().lower()): value for key, value in data.items()}
+    values = {}
+    for key, kind in schema.items():
+        if by_key.get(key) is None:
+            continue
+        try:
+            values[key] = COERCE[kind](by_key[key])
+        except (TypeError, ValueError):
+            continue
+    return values
+
+
+def parse_response(content, schema):
+    """ Parse an engine response against ``schema``, see ``coerce_values``.
+
+    Raises ``ResponseParseError`` when none of the keys of the schema is
+    found. Returns ``(values, truncated)``.
+    """
+    data, _repaired, truncated = extract_json(content)
+    values = coerce_values(data, schema)
+    if not values:
+        raise ResponseParseError("None of the expected keys (%s) in the response." % ', '.join(schema))
+    return values, truncated
@@ -0,0 +1,189 @@
+from odoo import fields, models, api, tools
+from datetime import datetime
+import threading
+import logging
+
+from psycopg2.extras import execute_values
+
+_logger = logging.getLogger(__name__)
+
+FLUSH_COUNT = 200
+# Key of the flag in ``cr.postcommit.data`` of a transaction whose calls
+# are already due to be written when it ends
+FLUSH_KEY = 'health_ai_call.flush'
+DEFAULT_RETENTION_DAYS = 90
+CALL_COLUMNS = [
+    'date', 'engine', 'model', 'mode', 'prompt_tokens', 'completion_tokens',
+    'duration_ms', 'http_status', 'retries', 'parse_ok', 'cache_hit',
+]
+
+# Per-worker buffer of the calls not written yet. Calls are appended
+# during a transaction and written in one INSERT, from a cursor of their
+# own, when it ends.
+_buffer = []
+_buffer_lock = threading.Lock()
+
+
+def make_call(engine, model, mode='call', metrics=None, usage=None, cache_hit=False, parse_ok=True):
+    """ Telemetry row of one upstream call, or of a response served from the cache. """
+    metrics = metrics or {}
+    usage = usage or {}
+    return {
+        'date': datetime.utcnow(),
+        'engine': engine,
+        'model': model,
+        'mode': mode,
+        'prompt_tokens': int(usage.get('prompt_tokens') or 0),
+        'completion_tokens': int(usage.get('completion_tokens') or 0),
+        'duration_ms': int(metrics.get('duration', 0) * 1000),
+        'http_status': metrics.get('status') or 0,
+        'retries': metrics.get('retries', 0),
+        'parse_ok': parse_ok,
+        'cache_hit': cache_hit,
+    }
+
+
+def buffer_calls(calls):
+    """ Queue telemetry rows without touching the database. """
+    with _buffer_lock:
+        _buffer.extend(calls)
+
+
+class HealthAICall(models.Model):
+    _name = 'health.ai.call'
+    _description = 'AI Call'
+    _order = 'date desc, id desc'
+    _log_access = False
+
+    date = fields.Datetime('Date', readonly=True, index=True)
+    engine = fields.Char('Engine', readonly=True)
+    model = fields.Char('Model', readonly=True)
+    mode = fields.Selection([
+        ('call', 'Direct'),
+        ('stream', 'Streaming'),
+        ('batch', 'Batch'),
+    ], string='Mode', readonly=True)
+    prompt_tokens = fields.Integer('Prompt Tokens', readonly=True)
+    completion_tokens = fields.Integer('Completion Tokens', readonly=True)
+    duration_ms = fields.Integer('Duration (ms)', readonly=True, group_operator='avg')
+    http_status = fields.Integer('HTTP Status', readonly=True, help="0 when no response was received.")
+    retries = fields.Integer('Retries', readonly=True)
+    parse_ok = fields.Boolean('Parsed', readonly=True)
+    cache_hit = fields.Boolean('Cache Hit', readonly=True)
+    cost = fields.Float('Cost', readonly=True, digits=(16, 6))
+
+    @api.model
+    def _record(self, calls):
+        """ Buffer ``calls`` and write the buffer when the current transaction
+        ends, committed or rolled back, or sooner once it is large. """
+        buffer_calls(calls)
+        if len(_buffer) >= FLUSH_COUNT:
+            self._flush()
+        cr = self.env.cr
+        if not cr.postcommit.data.get(FLUSH_KEY):
+            cr.postcommit.data[FLUSH_KEY] = True
+            cr.postcommit.add(self._flush)
+            cr.postrollback.add(self._flush)
+
+    @api.model
+    def _flush(self):
+        """ Write the buffered calls with one INSERT.
+
+        A separate cursor is used so the calls are kept even when the
+        caller's transaction is rolled back: a failed call still cost time
+        and tokens.
+        """
+        with _buffer_lock:
+            calls = _buffer[:]
+            del _buffer[:]
+        if not calls:
+            return
+        try:
+            with self.env.registry.cursor() as cr:
+                config = self.env(cr=cr)['ir.config_parameter'].sudo()
+                prompt_price = float(config.get_param('ai_health.price_prompt_1k') or 0.0)
+                completion_price = float(config.get_param('ai_health.price_completion_1k') or 0.0)
+                execute_values(cr._obj, """
+                    INSERT INTO health_ai_call (%s, cost) VALUES %%s
+                """ % ', '.join(CALL_COLUMNS), [
+                    tuple(call[column] for column in CALL_COLUMNS) + (
+                        (call['prompt_tokens'] * prompt_price + call['completion_tokens'] * completion_price) / 1000.0,
+                    ) for call in calls
+                ], page_size=1000)
+        except Exception as e:
+            _logger.warning("Could not write %s AI call records: %s", len(calls), str(e))
+
+    @api.model
+    def _cron_flush(self):
+        """ Drop the calls past the retention period.
+
+        The calls are written when the transaction that recorded them ends,
+        this only writes what is left in the buffer of the cron worker.
+        """
+        self._flush()
+        days = int(self.env['ir.config_parameter'].sudo().get_param('ai_health.telemetry_retention_days') or DEFAULT_RETENTION_DAYS)
+        self.env.cr.execute("""
+            DELETE FROM health_ai_call WHERE date < (now() at time zone 'UTC') - %s * interval '1 day'
+        """, (days,))
+
+
+class HealthAICallReport(models.Model):
+    _name = 'health.ai.call.report'
+    _description = 'AI Call Analysis'
+    _auto = False
+    _order = 'date desc'
+
+    date = fields.Date('Day', readonly=True)
+    engine = fields.Char('Engine', readonly=True)
+    model = fields.Char('Model', readonly=True)
+    mode = fields.Selection([
+        ('call', 'Direct'),
+        ('stream', 'Streaming'),
+        ('batch', 'Batch'),
+    ], string='Mode', readonly=True)
+    call_count = fields.Integer('Calls', readonly=True)
+    error_count = fields.Integer('Errors', readonly=True)
+    error_rate = fields.Float('Error Rate (%)', readonly=True, group_operator='avg')
+    parse_failures = fields.Integer('Parse Failures', readonly=True)
+    cache_hits = fields.Integer('Cache Hits', readonly=True)
+    retries = fields.Integer('Retries', readonly=True)
+    prompt_tokens = fields.Integer('Prompt Tokens', readonly=True)
+    completion_tokens = fields.Integer('Completion Tokens', readonly=True)
+    cost = fields.Float('Cost', readonly=True, digits=(16, 4))
+    latency_avg = fields.Float('Average Latency (ms)', readonly=True, group_operator='avg')
+    latency_p50 = fields.Float('Latency p50 (ms)', readonly=True, group_operator='avg')
+    latency_p95 = fields.Float('Latency p95 (ms)', readonly=True, group_operator='max')
+    latency_p99 = fields.Float('Latency p99 (ms)', readonly=True, group_operator='max')
+
+    def init(self):
+        # Percentiles cannot be summed, so they are computed per day here;
+        # grouping by larger periods shows the worst day
+        tools.drop_view_if_exists(self._cr, 'health_ai_call_report')
+        self._cr.execute("""
+            CREATE VIEW health_ai_call_report AS (
+                SELECT
+                    row_number() OVER (ORDER BY day, engine, model, mode) AS id,
+                    day AS date,
+                    engine,
+                    model,
+                    mode,
+                    count(*) AS call_count,
+                    count(*) FILTER (WHERE NOT cache_hit AND http_status != 200) AS error_count,
+                    round(100.0 * count(*) FILTER (WHERE NOT cache_hit AND http_status != 200)
+                          / GREATEST(count(*) FILTER (WHERE NOT cache_hit), 1), 2) AS error_rate,
+                    count(*) FILTER (WHERE http_status = 200 AND NOT parse_ok) AS parse_failures,
+                    count(*) FILTER (WHERE cache_hit) AS cache_hits,
+                    sum(retries) AS retries,
+                    sum(prompt_tokens) AS prompt_tokens,
+                    sum(completion_tokens) AS completion_tokens,
+                    sum(cost) AS cost,
+                    avg(duration_ms) FILTER (WHERE NOT cache_hit) AS latency_avg,
+                    percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms) FILTER (WHERE NOT cache_hit) AS latency_p50,
+                    percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms) FILTER (WHERE NOT cache_hit) AS latency_p95,
+                    percentile_cont(0.99) WITHIN GROUP (ORDER BY duration_ms) FILTER (WHERE NOT cache_hit) AS latency_p99
+                FROM (
+                    SELECT c.*, c.date::date AS day FROM health_ai_call c
+                ) calls
+                GROUP BY day, engine, model, mode
+            )
+        """)
@@ -0,0 +1,130 @@
+from odoo import fields, models, api, _
+from odoo.exceptions import UserError
+
+DEFAULT_MAX_BATCH = 500
+MAX_STATUS_IDS = 1000
+
+# Kind accepted by the API -> (model, method queuing the AI processing)
+INTAKE_KINDS = {
+    'diagnosis': ('health.diagnosis', 'get_health_advice'),
+    'symptom_check': ('symptom.checker', 'trigger_check'),
+}
+
+
+class HealthAPIIntake(models.AbstractModel):
+    _name = 'health.api.intake'
+    _description = 'Symptom Submission API'
+
+    @api.model
+    def _get_model(self, kind):
+        if kind not in INTAKE_KINDS:
+            raise UserError(_("Unknown kind %s, expected one of: %s.") % (kind, ', '.join(INTAKE_KINDS)))
+        return self.env[INTAKE_KINDS[kind][0]]
+
+    @api.model
+    def _resolve_employees(self, references):
+        """ Map the employee references of the items (id, badge or
+        identification number) to employee ids, with one search. """
+        ids = {ref for ref in references if isinstance(ref, int)}
+        codes = {ref for ref in references if isinstance(ref, str) and ref}
+        domain = [('id', 'in', list(ids))]
+        if codes:
+            domain = ['|', '|'] + domain + [('barcode', 'in', list(codes)), ('identification_id', 'in', list(codes))]
+        resolved = {}
+        for employee in self.env['hr.employee'].search(domain):
+            resolved[employee.id] = employee.id
+            for code in (employee.barcode, employee.identification_id):
+                if code in codes:
+                    resolved[code] = employee.id
+        return resolved
+
+    @api.model
+    def _submit(self, kind, items):
+        """ Create one record per ``{employee, symptoms}`` item and queue them.
+
+        Invalid items are reported by index and skipped; the valid ones are
+        created with a single ``create`` and queued for the AI worker, so the
+        call returns without waiting for the AI service.
+        """
+        Model = self._get_model(kind)
+        max_batch = int(self.env['ir.config_parameter'].sudo().get_param('ai_health.api_max_batch') or DEFAULT_MAX_BATCH)
+        if not isinstance(items, list) or not items:
+            raise UserError(_("'items' must be a non-empty list."))
+        if len(items) > max_batch:
+            raise UserError(_("At most %s items can be submitted at once.") % max_batch)
+
+        employees = self._resolve_employees([item.get('employee') for item in items if isinstance(item, dict)])
+        date_field = 'date_diagnosis' if kind == 'diagnosis' else 'check_date'
+        vals_list, indexes, errors = [], [], []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors.append({'index': index, 'error': _("Item must be an object.")})
+                continue
+            symptoms = item.get('symptoms')
+            if isinstance(symptoms, list):
+                symptoms = ', '.join(str(symptom) for symptom in symptoms)
+            if not symptoms or not isinstance(symptoms, str) or not symptoms.strip():
+                errors.append({'index': index, 'error': _("Symptoms are required.")})
+                continue
+            reference = item.get('employee')
+            employee_id = isinstance(reference, (int, str)) and employees.get(reference)
+            if not employee_id:
+                errors.append({'index': index, 'error': _("Unknown employee %s.") % item.get('employee')})
+                continue
+            vals = {'employee_id': employee_id, 'symptom_description': symptoms.strip()}
+            if item.get('title'):
+                vals['name'] = str(item['title'])
+            if item.get('date'):
+                try:
+                    vals[date_field] = fields.Datetime.to_datetime(item['date'])
+                except (TypeError, ValueError):
+                    errors.append({'index': index, 'error': _("Invalid date %s.") % item['date']})
+                    continue
+            vals_list.append(vals)
+            indexes.append(index)
+
+        records = Model.create(vals_list)
+        if records:
+            getattr(records, INTAKE_KINDS[kind][1])()
+        return {
+            'records': [{'index': index, 'id': record_id} for index, record_id in zip(indexes, records.ids)],
+            'errors': errors,
+        }
+
+    @api.model
+    def _status(self, kind, ids):
+        """ Return the AI status and results of many records in one call. """
+        Model = self._get_model(kind)
+        if not isinstance(ids, list) or not all(isinstance(record_id, int) for record_id in ids):
+            raise UserError(_("'ids' must be a list of integers."))
+        if len(ids) > MAX_STATUS_IDS:
+            raise UserError(_("At most %s ids can be queried at once.") % MAX_STATUS_IDS)
+        records = Model.browse(ids).exists()
+        found = set(records.ids)
+        results = [self._get_result(kind, record) for record in records]
+        return {
+            'results': results,
+            'missing': [record_id for record_id in ids if record_id not in found],
+        }
+
+    @api.model
+    def _get_result(self, kind, record):
+        result = {
+            'id': record.id,
+            'employee_id': record.employee_id.id,
+            'state': record.ai_state,
+            'error': record.ai_error or None,
+            'title': record.name,
+        }
+        if record.ai_state != 'done':
+            return result
+        if kind == 'diagnosis':
+            result['attributes'] = [{
+                'attribute_set': line.attribute_id.attribute_set_id.name,
+                'attribute': line.attribute_id.name,
+                'values': line.value_ids.mapped('name'),
+            } for line in record.diagnosis_attribute_line_ids]
+        else:
+            result['suggested_conditions'] = record.suggested_conditions
+            result['recommendation'] = record.recommendation
+        return result
@@ -1,51 +1,121 @@
 from odoo import models, fields, api, _
-import json
-import re
-import requests
 from odoo.exceptions import UserError
 import logging
 
-from odoo import http
-from odoo.http import request, content_disposition
-
-from io import BytesIO
-import xlsxwriter
 
+from .health_ai_prompt import shrink_dict
+from .health_ai_response import coerce_values
+from .hr_employee import shrink_health_digest
 
 _logger = logging.getLogger(__name__)
 
+# Titles of diagnoses the AI did not name
+DEFAULT_TITLE = "New Diagnosis"
+UNKNOWN_TITLE = "Unknown Diagnosis"
+
 class HealthDiagnosis(models.Model):
     _name = 'health.diagnosis'
     _description = 'Health Diagnosis Record'
+    _inherit = ['health.ai.engine.mixin']
+    _ai_engine = 'diagnosis'
+    _ai_response_schema = {'title': 'any', 'preliminary': 'any', 'treatment': 'any', 'notes': 'any'}
+    # Answer of the combined triage, see ``action_full_triage``
+    _triage_response_schema = dict(_ai_response_schema, risk='any', recommendation='any')
 
     # Set default value for name to "New Diagnosis"
-    name = fields.Char("Diagnosis Title", required=True, default="New Diagnosis")
+    name = fields.Char("Diagnosis Title", required=True, default=DEFAULT_TITLE)
     employee_id = fields.Many2one('hr.employee', string="Employee", required=True)
     symptom_description = fields.Text("Symptom Description", required=True)
     date_diagnosis = fields.Datetime("Date", default=fields.Datetime.now)
     diagnosis_attribute_line_ids = fields.One2many('health.diagnosis.attribute.line', 'diagnosis_id', string="Diagnosis Attribute Lines")
-    
+    # Earlier diagnosis of a near-identical description, see health.symptom.index
+    similar_diagnosis_id = fields.Many2one('health.diagnosis', string="Similar Diagnosis", readonly=True, copy=False)
+    similarity = fields.Float("Similarity", readonly=True, copy=False)
+    symptom_indexed = fields.Boolean("Symptoms Indexed", readonly=True, copy=False)
 
     @api.model
     def create(self, vals):
         if 'name' not in vals or not vals['name']:
             vals['name'] = _("Auto-Generated Diagnosis")
-        return super(HealthDiagnosis, self).create(vals)
+        diagnosis = super(HealthDiagnosis, self).create(vals)
+        diagnosis._index_symptoms()
+        return diagnosis
+
+    def write(self, vals):
+        res = super(HealthDiagnosis, self).write(vals)
+        if 'symptom_description' in vals or 'employee_id' in vals:
+            self._index_symptoms()
+        return res
+
+    def _index_symptoms(self):
+        """ Index the descriptions and look up an earlier similar diagnosis. """
+        index = self.env['health.symptom.index']
+        index._index_diagnoses(self)
+        for diagnosis in self:
+            similar, similarity = index._find_similar(diagnosis)
+            super(HealthDiagnosis, diagnosis).write({'similar_diagnosis_id': similar and similar.id, 'similarity': similarity})
 
     def get_health_advice(self):
+        """ Queue the AI diagnosis; the job worker runs it in the background.
+
+        With ``ai_health.reuse_auto`` set, diagnoses with an earlier similar
+        one get its attribute lines right away instead.
+        """
+        to_queue = self
+        if self.env['ir.config_parameter'].sudo().get_param('ai_health.reuse_auto'):
+            reused = self.filtered('similar_diagnosis_id')
+            reused.action_apply_similar()
+            to_queue -= reused
+        to_queue._enqueue_ai_job('_run_health_advice')
+
+    def action_apply_similar(self):
+        """ Copy the title and attribute lines of the similar diagnosis. """
+        Line = self.env['health.diagnosis.attribute.line']
+        for diagnosis in self.filtered('similar_diagnosis_id'):
+            source = diagnosis.similar_diagnosis_id
+            diagnosis.diagnosis_attribute_line_ids.unlink()
+            Line.create([{
+                'diagnosis_id': diagnosis.id,
+                'attribute_id': line.attribute_id.id,
+                'value_ids': [(6, 0, line.value_ids.ids)],
+            } for line in source.diagnosis_attribute_line_ids])
+            diagnosis.write({'name': source.name, 'ai_state': 'done', 'ai_error': False})
+            diagnosis._update_employee_digest()
+
+    def action_stream_health_advice(self):
+        """ Open a page streaming the AI diagnosis as it is generated. """
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/ai_health/diagnosis/%s/live' % self.id,
+            'target': 'new',
+        }
+
+    def _run_health_advice(self):
+        """ Fetch the AI diagnosis for every record in the set. """
+        return self._run_ai_batch()
+
+    def action_full_triage(self):
+        """ Queue the diagnosis, risk scoring and recommendation as one AI request. """
+        self._enqueue_ai_job('_run_full_triage')
+
+    def _run_full_triage(self):
+        """ Run the combined triage for every record in the set. """
+        return self._run_ai_batch(engine='triage', prepare='_prepare_triage_request', apply='_apply_triage_response')
+
+    def _prepare_ai_request(self):
+        """ Build the diagnosis request for the current record. """
+        self.ensure_one()
         _logger.info("Executing get_health_advice for diagnosis: %s", self.name)
 
-        # Retrieve the API key, prompt, and model from the system parameters
-        config = self.env['ir.config_parameter'].sudo()
-        api_key = config.get_param('ai_health.openai_api_key')
-        prompt_template = config.get_param('ai_health.openai_prompt')
-        model = config.get_param('ai_health.openai_model')
+        # Retrieve the prompt from the system parameters
+        prompt_template = self.env['ir.config_parameter'].sudo().get_param('ai_health.openai_prompt')
 
         if not self.symptom_description:
             raise UserError(_("Please provide the symptom description."))
 
-        # Collect employee data
-        employee_data = self._get_employee_data()
+        # Collect employee data, reduced to fit the token budget
+        employee_data, = self.env['health.ai.prompt']._fit([(self._get_employee_data(), shrink_dict)])
 
         # Build the prompt
         prompt = (
@@ -53,151 +123,229 @@ class HealthDiagnosis(models.Model):
             f"Symptoms: {self.symptom_description}\n"
             f"Employee Data: {employee_data}\n"
             "Please return the diagnosis strictly as a JSON object with key-value pairs inside the following structure:\n"
-            "{'title': {}, 'preliminary': {}, 'treatment': {}, 'notes': {}}. "
-            "Each key ('title', 'preliminary', 'treatment', and 'notes') should have a value. "
-            "Ensure the response is a valid JSON object."
+            "{\"title\": {}, \"preliminary\": {}, \"treatment\": {}, \"notes\": {}}. "
+            "Each key ('title', 'preliminary', 'treatment', and 'notes') should have a value."
         )
 
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
-        }
-
         messages = [
             {"role": "system", "content": "You are a medical assistant AI that provides health diagnosis based on symptoms. You must return structured JSON in key-value pairs."},
             {"role": "user", "content": prompt}
         ]
 
-        data = {
-            'model': model,
-            'messages': messages,
-            'max_tokens': 2048,
-            'temperature': 0.7,
-        }
+        return self._ai_request(
+            messages=messages,
+            max_tokens=2048,
+            temperature=0.7,
+            error_message=_("Error retrieving health advice from OpenAI."),
+        )
 
-        # Make the request to OpenAI's API
-        response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
+    def _prepare_triage_request(self):
+        """ Build the combined triage request: the diagnosis, risk scoring and
+        recommendation asked at once, with the employee data and history sent
+        a single time. """
+        self.ensure_one()
+        prompt_template = self.env['ir.config_parameter'].sudo().get_param('ai_health.openai_prompt')
+        if not self.symptom_description:
+            raise UserError(_("Please provide the symptom description."))
 
-        if response.status_code != 200:
-            _logger.error("Error from OpenAI: %s", response.text)
-            raise UserError(_("Error retrieving health advice from OpenAI."))
+        # Collect employee data and history, reduced to fit the token budget
+        employee_data, historical_data = self.env['health.ai.prompt']._fit([
+            (self._get_employee_data(), shrink_dict),
+            (self.employee_id._get_health_digest_prompt(label='diagnosis'), shrink_health_digest),
+        ])
+        prompt = (
+            f"{prompt_template}\n"
+            f"Symptoms: {self.symptom_description}\n"
+            f"Employee Data: {employee_data}\n"
+            f"Medical History: {historical_data}\n"
+            "Return the diagnosis, a risk score (0-100) where 0 is no risk and 100 is high risk with escalation steps "
+            "for critical cases and a brief analysis of the risk, and a health recommendation including lifestyle "
+            "suggestions and preventive measures, as one JSON object with the following structure:\n"
+            "{\"title\": {}, \"preliminary\": {}, \"treatment\": {}, \"notes\": {}, "
+            "\"risk\": {\"risk_score\": 0, \"escalation_steps\": \"...\", \"risk_analysis\": \"...\", \"title\": \"...\"}, "
+            "\"recommendation\": {\"recommendation\": \"...\", \"lifestyle_suggestion\": \"...\", "
+            "\"preventive_measures\": \"...\", \"title\": \"...\"}}."
+        )
+        messages = [
+            {"role": "system", "content": "You are a medical assistant AI that provides health diagnosis, risk scores and recommendations based on symptoms and medical history. You must return structured JSON in key-value pairs."},
+            {"role": "user", "content": prompt}
+        ]
+        return self._ai_request(
+            messages=messages,
+            max_tokens=3072,
+            temperature=0.7,
+            error_message=_("Error retrieving the AI triage."),
+            engine='triage',
+            historical_data=historical_data,
+        )
 
+    def _apply_ai_response(self, advice_text, request):
+        """ Parse the AI diagnosis and store it as attribute lines. """
         try:
-            # Get the AI's response
-            advice_text = response.json()['choices'][0]['message']['content']
             _logger.info("OpenAI response: %s", advice_text)
 
             # Parse the response as a JSON object
-            diagnosis_data = json.loads(re.search(r'({.*})', advice_text, re.DOTALL).group(1))
-
-            # Extract the title and update the diagnosis name
-            self.name = diagnosis_data.get('title', {}).get('diagnosis', 'Unknown Diagnosis')
-
-            # Process each attribute set (preliminary, treatment, notes)
-            for set_name, attributes in diagnosis_data.items():
-                if set_name != 'title':  # Skip the title in attribute sets
-                    self._process_attribute_set(set_name, attributes)
+            self._apply_diagnosis_data(self._parse_ai_json(advice_text))
 
         except Exception as e:
             _logger.error("Error processing diagnosis: %s", str(e))
             raise UserError(f"Error processing diagnosis: {e}")
 
+    def _apply_diagnosis_data(self, diagnosis_data):
+        """ Store parsed diagnosis data: title and attribute sets. """
+        # Extract the title and update the diagnosis name
+        title = diagnosis_data.get('title', {})
+        if isinstance(title, dict):
+            title = title.get('diagnosis')
+        self.name = title or UNKNOWN_TITLE
+
+        # Process the attribute sets (preliminary, treatment, notes) in one pass
+        self._process_attribute_sets({
+            set_name: attributes
+            for set_name, attributes in diagnosis_data.items()
+            if set_name != 'title'  # Skip the title in attribute sets
+        })
+
+        # Keep the employee's rolling history digest up to date
+        self._update_employee_digest()
+
+    def _apply_triage_response(self, content, request):
+        """ Store the diagnosis and create its risk scoring and recommendation,
+        all in the savepoint of the response. """
+        _logger.info("OpenAI triage response: %s", content)
+        data = self._parse_ai_json(content, self._triage_response_schema)
+        self._apply_diagnosis_data({key: value for key, value in data.items() if key in self._ai_response_schema})
+
+        Risk = self.env['health.risk.scoring']
+        risk_data = coerce_values(data.get('risk'), Risk._ai_response_schema)
+        if risk_data:
+            risk_score, escalation_steps, risk_analysis, title = Risk._read_risk_scoring_data(risk_data)
+            Risk.create({
+                'name': title,
+                'employee_id': self.employee_id.id,
+                'diagnosis_id': self.id,
+                'risk_score': risk_score,
+                'escalation_steps': escalation_steps,
+                'risk_analysis': risk_analysis,
+                'historical_data': request['historical_data'],
+                'ai_state': 'done',
+            })
+
+        Recommendation = self.env['health.recommendation']
+        recommendation_data = coerce_values(data.get('recommendation'), Recommendation._ai_response_schema)
+        if recommendation_data:
+            recommendation, lifestyle_suggestion, preventive_measures, title = Recommendation._read_recommendation_data(recommendation_data)
+            Recommendation.create({
+                'name': title,
+                'employee_id': self.employee_id.id,
+                'diagnosis_id': self.id,
+                'recommendation_result': recommendation,
+                'lifestyle_suggestion': lifestyle_suggestion,
+                'preventive_measures': preventive_measures,
+                'historical_data': request['historical_data'],
+                'ai_state': 'done',
+            })
+
     def _process_attribute_set(self, set_name, attributes):
-        # Find or create the attribute set
-        attribute_set = self.env['health.diagnosis.attribute.set'].search([('name', '=', set_name)], limit=1)
-        if not attribute_set:
-            attribute_set = self.env['health.diagnosis.attribute.set'].create({'name': set_name})
-
-        for attr_name, attr_values in attributes.items():
-            # Find or create the attribute under this set
-            attribute = self.env['health.diagnosis.attribute'].search([
-                ('name', '=', attr_name),
-                ('attribute_set_id', '=', attribute_set.id)
-            ], limit=1)
-            if not attribute:
-                attribute = self.env['health.diagnosis.attribute'].create({
-                    'name': attr_name,
-                    'attribute_set_id': attribute_set.id
-                })
-
-            # Prepare value_ids to hold the ids of the diagnosis values
-            value_ids = []
-            if isinstance(attr_values, list):
-                for value in attr_values:
-                    val = self.env['health.diagnosis.attribute.value'].search([('name', '=', value)], limit=1)
-                    if not val:
-                        val = self.env['health.diagnosis.attribute.value'].create({
-                            'name': value,
-                            'attribute_id': attribute.id
-                        })
-                    value_ids.append(val.id)
-            else:
-                val = self.env['health.diagnosis.attribute.value'].search([('name', '=', attr_values)], limit=1)
-                if not val:
-                    val = self.env['health.diagnosis.attribute.value'].create({
-                        'name': attr_values,
-                        'attribute_id': attribute.id
-                    })
-                value_ids.append(val.id)
-
-            # Check if there is already an attribute line for this diagnosis and attribute
-            existing_line = self.env['health.diagnosis.attribute.line'].search([
-                ('diagnosis_id', '=', self.id),
-                ('attribute_id', '=', attribute.id)
-            ], limit=1)
-
-            if existing_line:
-                # Append new values to the existing line
-                existing_line.write({
-                    'value_ids': [(4, value_id) for value_id in value_ids]
-                })
-            else:
-                # Create a new line if no line exists
-                self.env['health.diagnosis.attribute.line'].create({
-                    'diagnosis_id': self.id,
-                    'attribute_id': attribute.id,
-                    'value_ids': [(6, 0, value_ids)]
-                })
+        self._process_attribute_sets({set_name: attributes})
+
+    def _process_attribute_sets(self, attribute_sets):
+        """ Store a parsed AI response as attribute lines.
+
+        ``attribute_sets`` maps set names to ``{attribute: value(s)}``. Names
+        are resolved to their canonical set, attribute and value through the
+        cached dictionaries, see ``health.diagnosis.named.mixin``; only the
+        missing ones are created, with one multi-row create per model, so the
+        number of queries does not grow with the size of the response.
+        """
+        self.ensure_one()
+        # Flatten the response to (set, attribute) -> [values]
+        wanted = {}
+        for set_name, attributes in attribute_sets.items():
+            if not isinstance(attributes, dict):
+                attributes = {set_name: attributes}
+            for attr_name, attr_values in attributes.items():
+                if not isinstance(attr_values, list):
+                    attr_values = [attr_values]
+                values = wanted.setdefault((str(set_name), str(attr_name)), [])
+                values.extend(str(value) for value in attr_values if value not in (None, '', [], {}))
+        if not wanted:
+            return
+
+        set_ids = self.env['health.diagnosis.attribute.set']._resolve_names({
+            (False, set_name) for set_name, _attr in wanted
+        })
+        attribute_ids = self.env['health.diagnosis.attribute']._resolve_names({
+            (set_ids[(False, set_name)], attr_name) for set_name, attr_name in wanted
+        })
+        value_keys = {
+            (attribute_ids[(set_ids[(False, set_name)], attr_name)], value)
+            for (set_name, attr_name), values in wanted.items()
+            for value in values
+        }
+        value_ids = self.env['health.diagnosis.attribute.value']._resolve_names(value_keys)
+
+        # Attribute id -> value ids for this diagnosis, in response order
+        line_values = {}
+        for (set_name, attr_name), values in wanted.items():
+            attribute_id = attribute_ids[(set_ids[(False, set_name)], attr_name)]
+            ids = line_values.setdefault(attribute_id, [])
+            ids.extend(value_ids[(attribute_id, value)] for value in values if value_ids[(attribute_id, value)] not in ids)
+
+        Line = self.env['health.diagnosis.attribute.line']
+        existing = {
+            line.attribute_id.id: line.id
+            for line in Line.search([('diagnosis_id', '=', self.id), ('attribute_id', 'in', list(line_values))])
+        }
+        Line.create([{
+            'diagnosis_id': self.id,
+            'attribute_id': attribute_id,
+            'value_ids': [(6, 0, ids)],
+        } for attribute_id, ids in line_values.items() if attribute_id not in existing])
+
+        # Append new values to the existing lines in a single statement
+        appended = [(existing[attribute_id], value_id)
+                    for attribute_id, ids in line_values.items() if attribute_id in existing
+                    for value_id in ids]
+        if appended:
+            Line.flush_model(['value_ids'])
+            self.env.cr.execute("""
+                INSERT INTO health_diagnosis_attribute_value_rel
+                       (health_diagnosis_attribute_line_id, health_diagnosis_attribute_value_id)
+                SELECT * FROM unnest(%s::int[], %s::int[])
+                ON CONFLICT DO NOTHING
+            """, ([line_id for line_id, _value in appended], [value_id for _line, value_id in appended]))
+            Line.invalidate_model(['value_ids'])
+
+    def _get_history_entry(self):
+        """ This diagnosis in the format of the employee history, or None without values. """
+        self.ensure_one()
+        attributes = [{
+            'attribute': line.attribute_id.name,
+            'values': line.value_ids.mapped('name'),
+        } for line in self.diagnosis_attribute_line_ids.sorted('id') if line.value_ids]
+        if not attributes or not self.date_diagnosis:
+            return None
+        return {
+            'id': self.id,
+            'date': self.date_diagnosis.strftime('%Y-%m-%d'),
+            'diagnosis': self.name,
+            'attributes': attributes,
+        }
+
+    def _update_employee_digest(self):
+        for diagnosis in self:
+            entry = diagnosis._get_history_entry()
+            if entry and diagnosis.employee_id:
+                diagnosis.employee_id._update_health_digest(entry)
 
     def export_diagnosis_excel(self):
-        # Create an in-memory Excel file
-        output = BytesIO()
-        workbook = xlsxwriter.Workbook(output)
-        sheet = workbook.add_worksheet('Diagnosis Report')
-        
-        # Add column headers
-        headers = ['Attribute Set', 'Attribute', 'Values']
-        for col_num, header in enumerate(headers):
-            sheet.write(0, col_num, header)
-        
-        # Write data rows
-        row_num = 1
-        for line in self.diagnosis_attribute_line_ids:
-            sheet.write(row_num, 0, line.attribute_id.attribute_set_id.name or '')
-            sheet.write(row_num, 1, line.attribute_id.name or '')
-            values = ', '.join([value.name for value in line.value_ids])
-            sheet.write(row_num, 2, values or '')
-            row_num += 1
-        
-        # Close the workbook
-        workbook.close()
-        output.seek(0)
-        
-        # Create a response with the Excel content
-        excel_data = output.read()
-        output.close()
-
-        # Correctly create the response using the request object from odoo.http
-        return request.make_response(
-            excel_data,
-            headers=[
-                ('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
-                ('Content-Disposition', content_disposition(f'Diagnosis_Report_{self.id}.xlsx'))
-            ]
-        )
-    
+        """ Download the attribute lines of the diagnoses as an Excel file. """
+        return self.env['health.diagnosis.export']._action_export(self._name, 'xlsx', self.ids)
+
     def _get_employee_data(self):
-        """Retrieve relevant employee information to include in the prompt."""
+        """Retrieve relevant employee information to include in the prompt,
+        the most relevant first."""
         if not self.employee_id:
             return {}
 
@@ -228,5 +376,4 @@ class HealthDiagnosis(models.Model):
         }
 
         # Filter out empty values
-        employee_data = {k: v for k, v in employee_data.items() if v}
-        return json.dumps(employee_data, indent=4)
+        return {k: v for k, v in employee_data.items() if v}
@@ -3,7 +3,13 @@ from odoo import models, fields
 class HealthDiagnosisAttribute(models.Model):
     _name = 'health.diagnosis.attribute'
     _description = 'Health Diagnosis Attribute'
+    _inherit = ['health.diagnosis.named.mixin']
+    _name_parent_field = 'attribute_set_id'
 
     name = fields.Char("Attribute", required=True)
     description = fields.Text("Description")
     attribute_set_id = fields.Many2one('health.diagnosis.attribute.set', string="Attribute Set")
+
+    _sql_constraints = [
+        ('name_set_uniq', 'unique(attribute_set_id, name)', 'This attribute already exists in the attribute set.'),
+    ]
@@ -7,3 +7,7 @@ class HealthDiagnosisAttributeLine(models.Model):
     diagnosis_id = fields.Many2one('health.diagnosis', string="Diagnosis", required=True)
     attribute_id = fields.Many2one('health.diagnosis.attribute', string="Attribute", required=True)
     value_ids = fields.Many2many('health.diagnosis.attribute.value', string="Values", relation="health_diagnosis_attribute_value_rel")
+
+    _sql_constraints = [
+        ('diagnosis_attribute_uniq', 'unique(diagnosis_id, attribute_id)', 'A diagnosis can only have one line per attribute.'),
+    ]
@@ -3,6 +3,11 @@ from odoo import models, fields
 class HealthDiagnosisAttributeSet(models.Model):
     _name = 'health.diagnosis.attribute.set'
     _description = 'Health Diagnosis Attribute Set'
+    _inherit = ['health.diagnosis.named.mixin']
 
     name = fields.Char("Attribute Set", required=True)
     attribute_ids = fields.Many2many('health.diagnosis.attribute', string="Attributes")
+
+    _sql_constraints = [
+        ('name_uniq', 'unique(name)', 'An attribute set with this name already exists.'),
+    ]
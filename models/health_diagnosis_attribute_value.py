@@ -1,8 +1,19 @@
-from odoo import models, fields
+from odoo import models, fields, api
 
 class HealthDiagnosisAttributeValue(models.Model):
     _name = 'health.diagnosis.attribute.value'
     _description = 'Health Diagnosis Attribute Value'
+    _inherit = ['health.diagnosis.named.mixin']
+    _name_parent_field = 'attribute_id'
 
     name = fields.Char("Value", required=True)
     attribute_id = fields.Many2one('health.diagnosis.attribute', string="Attribute", required=True)
+
+    _sql_constraints = [
+        ('name_attribute_uniq', 'unique(attribute_id, name)', 'This value already exists for the attribute.'),
+    ]
+
+    @api.model
+    def _canonical_name(self, parent_id, name):
+        # Values also use the synonyms specific to their attribute
+        return self.env['health.diagnosis.synonym']._resolve(parent_id, name)
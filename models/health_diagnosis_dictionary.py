@@ -0,0 +1,255 @@
+from odoo import fields, models, api, tools, _
+from odoo.exceptions import UserError
+import re
+import logging
+
+import psycopg2
+
+_logger = logging.getLogger(__name__)
+
+GENERATIONS_KEY = 'health_diagnosis_name_generations'
+
+
+
+def normalize_name(name):
+    """ Case and whitespace folding of an attribute or value name. """
+    return re.sub(r'\s+', ' ', name or '').strip().lower()
+
+
+def clean_name(name):
+    """ Name as stored when a record is created from an AI response. """
+    return re.sub(r'\s+', ' ', name or '').strip()
+
+
+def _create_generation(cr, table):
+    cr.execute("CREATE SEQUENCE IF NOT EXISTS %s_name_generation" % table)
+
+
+def _get_generation(cr, table):
+    """ Generation of the names of ``table``, read once per transaction:
+    its snapshot does not see the names committed later anyway. """
+    generations = cr.cache.get(GENERATIONS_KEY)
+    if generations is None:
+        generations = cr.cache[GENERATIONS_KEY] = {}
+        drop = lambda: cr.cache.pop(GENERATIONS_KEY, None)
+        cr.postcommit.add(drop)
+        cr.postrollback.add(drop)
+    if table not in generations:
+        # A new sequence and the one bumped once both have last_value 1,
+        # is_called tells them apart
+        cr.execute("SELECT last_value + is_called::int FROM %s_name_generation" % table)
+        generations[table] = cr.fetchone()[0]
+    return generations[table]
+
+
+def _bump_generation(env, table):
+    """ Move ``table`` to a new generation once the current transaction
+    commits, so every worker reloads its names on next use. """
+    tables = env.cr.postcommit.data.get(GENERATIONS_KEY)
+    if tables is None:
+        tables = env.cr.postcommit.data[GENERATIONS_KEY] = set()
+        registry = env.registry
+
+        @env.cr.postcommit.add
+        def bump():
+            with registry.cursor() as cr:
+                for name in sorted(tables):
+                    cr.execute("SELECT nextval('%s_name_generation')" % name)
+    tables.add(table)
+
+
+class HealthDiagnosisNamedMixin(models.AbstractModel):
+    """ Names of the diagnosis dictionary, unique per parent once folded.
+
+    The ``{(parent_id, normalized_name): id}`` map of each model is kept in
+    the ORM cache of every worker, keyed by a generation counter that is
+    bumped after a commit changing the names, so resolving the names of an
+    AI response does not read them all again.
+    """
+    _name = 'health.diagnosis.named.mixin'
+    _description = 'Diagnosis Dictionary Name'
+
+    # Field scoping the names, if any
+    _name_parent_field = None
+
+    normalized_name = fields.Char('Normalized Name', readonly=True, index=True, copy=False)
+
+    def init(self):
+        if self._abstract:
+            return
+        _create_generation(self._cr, self._table)
+        parent = self._name_parent_field or 'NULL'
+        self._cr.execute("""
+            UPDATE %s SET normalized_name = lower(btrim(regexp_replace(name, '\\s+', ' ', 'g')))
+             WHERE normalized_name IS NULL
+        """ % self._table)
+        try:
+            with self._cr.savepoint():
+                self._cr.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS %s_normalized_name_uniq
+                    ON %s (COALESCE(%s, 0), normalized_name)
+                """ % (self._table, self._table, parent))
+        except psycopg2.IntegrityError:
+            _logger.warning("%s holds names differing only by case or spacing, merge them "
+                            "to enforce the unique normalized names.", self._table)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if 'name' in vals:
+                vals['normalized_name'] = normalize_name(vals['name'])
+        records = super().create(vals_list)
+        self._clear_name_maps()
+        return records
+
+    def write(self, vals):
+        if 'name' in vals:
+            vals['normalized_name'] = normalize_name(vals['name'])
+        res = super().write(vals)
+        if 'name' in vals or self._name_parent_field in vals:
+            self._clear_name_maps()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self._clear_name_maps()
+        return res
+
+    def _get_name_map(self):
+        return self._load_name_map(_get_generation(self.env.cr, self._table))
+
+    @tools.ormcache('generation')
+    def _load_name_map(self, generation):
+        # Read from a cursor of its own so the map only ever holds committed
+        # names, never ids of rows a rolled back savepoint removed
+        parent = self._name_parent_field or 'NULL'
+        with self.env.registry.cursor() as cr:
+            cr.execute("SELECT %s, normalized_name, id FROM %s" % (parent, self._table))
+            return {(parent_id or False, normalized): record_id for parent_id, normalized, record_id in cr.fetchall()}
+
+    def _clear_name_maps(self):
+        _bump_generation(self.env, self._table)
+
+    @api.model
+    def _canonical_name(self, parent_id, name):
+        """ Return ``(normalized_name, display_name)`` for ``name`` after synonyms. """
+        return self.env['health.diagnosis.synonym']._resolve(False, name)
+
+    @api.model
+    def _resolve_names(self, keys):
+        """ Return ``{(parent_id, name): id}`` for ``keys``, creating the missing names.
+
+        Spellings that fold to the same normalized name, or that are synonyms
+        of one another, resolve to the same record. Known names are read from
+        the cached map; the missing ones are searched, then created in one
+        ``create`` call. When a concurrent transaction creates them first,
+        the unique index makes the create fail and they are read back.
+        """
+        canonical = {(parent, name): (parent, ) + self._canonical_name(parent, name) for parent, name in keys}
+        name_map = self._get_name_map()
+        found = {}
+        missing = {}
+        for key, (parent, normalized, display) in canonical.items():
+            record_id = name_map.get((parent, normalized))
+            if record_id:
+                found[key] = record_id
+            else:
+                missing.setdefault((parent, normalized), display)
+        if not missing:
+            return found
+
+        # Names created earlier in this transaction are not in the map yet
+        created_ids = self._load_names(list(missing))
+        new_keys = sorted(key for key in missing if key not in created_ids)
+        if new_keys:
+            try:
+                with self.env.cr.savepoint():
+                    created = self.create([
+                        dict({'name': missing[key]}, **({self._name_parent_field: key[0]} if self._name_parent_field else {}))
+                        for key in new_keys
+                    ])
+                created_ids.update(zip(new_keys, created.ids))
+            except psycopg2.IntegrityError:
+                created_ids.update(self._load_names(new_keys))
+                if any(key not in created_ids for key in new_keys):
+                    # The competing rows are not visible in our snapshot yet;
+                    # failing here lets the AI job retry with a fresh one.
+                    raise UserError(_("Diagnosis attributes were updated concurrently, please retry."))
+        for key, (parent, normalized, display) in canonical.items():
+            if key not in found:
+                found[key] = created_ids[(parent, normalized)]
+        return found
+
+    @api.model
+    def _load_names(self, keys):
+        domain = [('normalized_name', 'in', list({normalized for _parent, normalized in keys}))]
+        if self._name_parent_field:
+            domain.append((self._name_parent_field, 'in', list({parent for parent, _normalized in keys})))
+        loaded = {
+            (record[self._name_parent_field].id if self._name_parent_field else False, record.normalized_name): record.id
+            for record in self.search(domain)
+        }
+        return {key: loaded[key] for key in keys if key in loaded}
+
+
+class HealthDiagnosisSynonym(models.Model):
+    _name = 'health.diagnosis.synonym'
+    _description = 'Diagnosis Synonym'
+    _order = 'canonical_name, name'
+
+    name = fields.Char('Variant', required=True)
+    canonical_name = fields.Char('Canonical Name', required=True)
+    attribute_id = fields.Many2one('health.diagnosis.attribute', string='Attribute', ondelete='cascade',
+                                   help="Only apply to the values of this attribute. Without attribute, the "
+                                        "synonym applies to the names of attribute sets, attributes and values.")
+    normalized_name = fields.Char('Normalized Variant', compute='_compute_normalized_name', store=True)
+
+    _sql_constraints = [
+        ('variant_uniq', 'unique(attribute_id, normalized_name)', 'This variant already has a canonical name.'),
+    ]
+
+    def init(self):
+        _create_generation(self._cr, self._table)
+
+    @api.depends('name')
+    def _compute_normalized_name(self):
+        for synonym in self:
+            synonym.normalized_name = normalize_name(synonym.name)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        _bump_generation(self.env, self._table)
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        _bump_generation(self.env, self._table)
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        _bump_generation(self.env, self._table)
+        return res
+
+    def _get_synonym_map(self):
+        return self._load_synonym_map(_get_generation(self.env.cr, self._table))
+
+    @tools.ormcache('generation')
+    def _load_synonym_map(self, generation):
+        # Committed synonyms only, like the name maps
+        with self.env.registry.cursor() as cr:
+            cr.execute("SELECT attribute_id, normalized_name, canonical_name FROM health_diagnosis_synonym")
+            return {(attribute_id or False, normalized): canonical for attribute_id, normalized, canonical in cr.fetchall()}
+
+    @api.model
+    def _resolve(self, attribute_id, name):
+        """ Return ``(normalized_name, display_name)`` of the canonical form of
+        ``name``, using the synonyms of ``attribute_id`` then the global ones. """
+        normalized = normalize_name(name)
+        synonyms = self._get_synonym_map()
+        canonical = synonyms.get((attribute_id, normalized)) if attribute_id else None
+        canonical = canonical or synonyms.get((False, normalized))
+        if canonical:
+            return normalize_name(canonical), clean_name(canonical)
+        return normalized, clean_name(name)
@@ -0,0 +1,178 @@
+from odoo import fields, models, api, _
+from odoo.exceptions import UserError
+from datetime import date, datetime
+import csv
+import io
+import json
+import tempfile
+from urllib.parse import urlencode
+
+import xlsxwriter
+
+EXPORT_CHUNK = 1000
+XLSX_MAX_ROWS = 1048576
+STREAM_BLOCK = 65536
+
+# Models that can be exported, with the file name of their exports
+EXPORT_MODELS = {
+    'health.diagnosis': 'Diagnoses',
+    'health.diagnosis.report': 'Diagnosis_Analysis',
+    'health.risk.scoring.report': 'Risk_Scoring_Analysis',
+    'health.disease.outbreak.report': 'Disease_Outbreak_Analysis',
+    'health.recommendation.report': 'Health_Recommendation_Analysis',
+}
+
+
+class HealthDiagnosisExport(models.AbstractModel):
+    _name = 'health.diagnosis.export'
+    _description = 'Diagnosis Bulk Export'
+
+    @api.model
+    def _check_model(self, model_name):
+        if model_name not in EXPORT_MODELS:
+            raise UserError(_("Model %s cannot be exported.") % model_name)
+        self.env[model_name].check_access_rights('read')
+
+    @api.model
+    def _action_export(self, model_name, file_format, ids=None, domain=None):
+        """ Action downloading the export of ``ids``, or of the records
+        matching ``domain``, which is preferred for large selections. """
+        self._check_model(model_name)
+        url = '/ai_health/export/%s/%s' % (model_name, file_format)
+        if domain is not None and (not ids or len(ids) > EXPORT_CHUNK):
+            url += '?' + urlencode({'domain': json.dumps(domain)})
+        elif ids:
+            url += '?' + urlencode({'ids': ','.join(str(record_id) for record_id in ids)})
+        return {'type': 'ir.actions.act_url', 'url': url, 'target': 'self'}
+
+    @api.model
+    def _iter_ids(self, model_name, domain):
+        """ Yield the ids matching ``domain`` by chunks, paging on the id so
+        no more than a chunk of ids is ever held. """
+        Model = self.env[model_name]
+        last_id = 0
+        while True:
+            ids = Model.search(domain + [('id', '>', last_id)], order='id', limit=EXPORT_CHUNK).ids
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
+
+    @api.model
+    def _get_headers(self, model_name):
+        if model_name == 'health.diagnosis':
+            return [_('Diagnosis'), _('Date'), _('Employee'), _('Attribute Set'), _('Attribute'), _('Values')]
+        Model = self.env[model_name]
+        return [Model._fields[name].string for name in self._get_report_fields(model_name)]
+
+    @api.model
+    def _get_report_fields(self, model_name):
+        Model = self.env[model_name]
+        # Some report views do not select every field they declare
+        self.env.cr.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (Model._table,))
+        columns = {row[0] for row in self.env.cr.fetchall()}
+        return [
+            name for name, field in Model._fields.items()
+            if field.store and name != 'id' and name in columns
+            and field.type not in ('one2many', 'many2many', 'binary')
+        ]
+
+    @api.model
+    def _iter_rows(self, model_name, domain):
+        """ Yield the export rows of the records matching ``domain``.
+
+        Rows are produced a chunk of records at a time and the record cache
+        is emptied after each chunk, so memory does not grow with the export.
+        """
+        if model_name == 'health.diagnosis':
+            for ids in self._iter_ids(model_name, domain):
+                yield from self._diagnosis_rows(ids)
+            return
+        field_names = self._get_report_fields(model_name)
+        Model = self.env[model_name]
+        for ids in self._iter_ids(model_name, domain):
+            for values in Model.browse(ids).read(field_names):
+                yield [self._format_value(values[name]) for name in field_names]
+            self.env.invalidate_all()
+
+    @api.model
+    def _diagnosis_rows(self, ids):
+        # One row per attribute line, names joined in the same query rather
+        # than followed through the ORM line by line
+        self.env.cr.execute("""
+            SELECT d.name, d.date_diagnosis, e.name, s.name, a.name,
+                   string_agg(v.name, ', ' ORDER BY v.id)
+              FROM health_diagnosis d
+              LEFT JOIN hr_employee e ON e.id = d.employee_id
+              LEFT JOIN health_diagnosis_attribute_line l ON l.diagnosis_id = d.id
+              LEFT JOIN health_diagnosis_attribute a ON a.id = l.attribute_id
+              LEFT JOIN health_diagnosis_attribute_set s ON s.id = a.attribute_set_id
+              LEFT JOIN health_diagnosis_attribute_value_rel rel ON rel.health_diagnosis_attribute_line_id = l.id
+              LEFT JOIN health_diagnosis_attribute_value v ON v.id = rel.health_diagnosis_attribute_value_id
+             WHERE d.id IN %s
+             GROUP BY d.id, l.id, e.name, s.name, a.name
+             ORDER BY d.id, l.id
+        """, (tuple(ids),))
+        for row in self.env.cr.fetchall():
+            yield [self._format_value(value) for value in row]
+
+    @api.model
+    def _format_value(self, value):
+        if isinstance(value, tuple):  # many2one
+            return value[1]
+        if value is False or value is None:
+            return ''
+        if isinstance(value, datetime):
+            return fields.Datetime.to_string(value)
+        if isinstance(value, date):
+            return fields.Date.to_string(value)
+        return value
+
+    @api.model
+    def _stream_csv(self, model_name, domain):
+        """ Yield the CSV export as encoded blocks while the rows are read. """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self._get_headers(model_name))
+        # Byte order mark so spreadsheets detect the encoding
+        yield '\ufeff'.encode('utf-8') + buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        for row in self._iter_rows(model_name, domain):
+            writer.writerow(row)
+            if buffer.tell() >= STREAM_BLOCK:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+
+    @api.model
+    def _stream_xlsx(self, model_name, domain):
+        """ Yield the XLSX export as blocks.
+
+        The workbook is written in constant memory mode, flushing each row to
+        a temporary file, and assembled in a temporary file too; the archive
+        can only be sent once complete. Rows beyond the sheet limit continue
+        on new sheets.
+        """
+        headers = self._get_headers(model_name)
+        with tempfile.TemporaryFile() as output:
+            workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'in_memory': False})
+            bold = workbook.add_format({'bold': True})
+            sheet, row_num = None, XLSX_MAX_ROWS
+            for row in self._iter_rows(model_name, domain):
+                if row_num >= XLSX_MAX_ROWS:
+                    sheet = workbook.add_worksheet('%s %s' % (_('Export'), len(workbook.worksheets()) + 1))
+                    sheet.write_row(0, 0, headers, bold)
+                    row_num = 1
+                sheet.write_row(row_num, 0, row)
+                row_num += 1
+            if sheet is None:
+                workbook.add_worksheet(_('Export')).write_row(0, 0, headers, bold)
+            workbook.close()
+            output.seek(0)
+            while True:
+                block = output.read(STREAM_BLOCK)
+                if not block:
+                    return
+                yield block
@@ -0,0 +1,72 @@
+from odoo import models, api
+
+
+class HealthDiagnosisHistory(models.AbstractModel):
+    _name = 'health.diagnosis.history'
+    _description = 'Employee Diagnosis History'
+
+    @api.model
+    def _get_history(self, employee_ids, date_from=False, limit=0, label='diagnosis', with_ids=False):
+        """ Return ``{employee_id: [diagnosis, ...]}`` for the given employees.
+
+        Each diagnosis is a dict with ``date``, ``label`` (the diagnosis name)
+        and ``attributes``, a list of ``{'attribute', 'values'}``; only
+        diagnoses and lines with values are included. The whole history is
+        read with a single query, optionally restricted to diagnoses since
+        ``date_from`` and to the ``limit`` most recent ones per employee.
+        With ``with_ids`` each entry also holds the diagnosis ``id``.
+        """
+        if not employee_ids:
+            return {}
+
+        # Flush pending ORM writes so the query sees them
+        self.env['health.diagnosis'].flush_model(['employee_id', 'date_diagnosis', 'name'])
+        self.env['health.diagnosis.attribute.line'].flush_model(['diagnosis_id', 'attribute_id', 'value_ids'])
+
+        self.env.cr.execute("""
+            WITH diagnoses AS (
+                SELECT d.id, d.employee_id, d.date_diagnosis, d.name,
+                       row_number() OVER (PARTITION BY d.employee_id
+                                          ORDER BY d.date_diagnosis DESC, d.id DESC) AS rank
+                  FROM health_diagnosis d
+                 WHERE d.employee_id IN %(employee_ids)s
+                   AND d.date_diagnosis IS NOT NULL
+                   AND (%(date_from)s IS NULL OR d.date_diagnosis >= %(date_from)s)
+                   AND EXISTS (
+                        SELECT 1
+                          FROM health_diagnosis_attribute_line l
+                          JOIN health_diagnosis_attribute_value_rel rel
+                            ON rel.health_diagnosis_attribute_line_id = l.id
+                         WHERE l.diagnosis_id = d.id
+                   )
+            )
+            SELECT d.employee_id, d.id, d.date_diagnosis, d.name, a.name,
+                   array_agg(v.name ORDER BY v.id)
+              FROM diagnoses d
+              JOIN health_diagnosis_attribute_line l ON l.diagnosis_id = d.id
+              JOIN health_diagnosis_attribute a ON a.id = l.attribute_id
+              JOIN health_diagnosis_attribute_value_rel rel ON rel.health_diagnosis_attribute_line_id = l.id
+              JOIN health_diagnosis_attribute_value v ON v.id = rel.health_diagnosis_attribute_value_id
+             WHERE %(limit)s = 0 OR d.rank <= %(limit)s
+             GROUP BY d.employee_id, d.id, d.date_diagnosis, d.name, l.id, a.name
+             ORDER BY d.employee_id, d.id, l.id
+        """, {
+            'employee_ids': tuple(employee_ids),
+            'date_from': date_from or None,
+            'limit': limit or 0,
+        })
+
+        history = {employee_id: [] for employee_id in employee_ids}
+        current = {}
+        for employee_id, diagnosis_id, date_diagnosis, name, attribute, values in self.env.cr.fetchall():
+            if current.get('id') != diagnosis_id:
+                current = {'id': diagnosis_id, 'entry': {
+                    'date': date_diagnosis.strftime('%Y-%m-%d'),
+                    label: name,
+                    'attributes': [],
+                }}
+                if with_ids:
+                    current['entry']['id'] = diagnosis_id
+                history[employee_id].append(current['entry'])
+            current['entry']['attributes'].append({'attribute': attribute, 'values': values})
+        return history
@@ -1,33 +1,69 @@
-from odoo import fields, models, tools
+from odoo import fields, models
 
 class HealthDiagnosisReport(models.Model):
     _name = 'health.diagnosis.report'
     _description = 'Health Diagnosis Report'
+    _inherit = ['health.materialized.report']
     _auto = False
     _order = 'date_diagnosis desc'
+    _report_source = 'health.diagnosis'
+    _report_key = 'diagnosis_id'
 
     date_diagnosis = fields.Datetime('Date of Diagnosis', readonly=True)
     employee_id = fields.Many2one('hr.employee', string='Employee', readonly=True)
     attribute_id = fields.Many2one('health.diagnosis.attribute', string='Attribute', readonly=True)
     attribute_value_id = fields.Many2one('health.diagnosis.attribute.value', string='Attribute Value', readonly=True)
     diagnosis_id = fields.Many2one('health.diagnosis', string='Diagnosis', readonly=True)
+    # 1 on a single row per diagnosis, so sums count diagnoses and not findings
     total_diagnoses = fields.Integer(string='Total Diagnoses', readonly=True)
+    total_findings = fields.Integer(string='Total Findings', readonly=True)
+
+    def _report_columns(self):
+        return """
+            id serial PRIMARY KEY,
+            date_diagnosis timestamp,
+            employee_id integer,
+            attribute_id integer,
+            attribute_value_id integer REFERENCES health_diagnosis_attribute_value (id) ON DELETE CASCADE,
+            diagnosis_id integer NOT NULL REFERENCES health_diagnosis (id) ON DELETE CASCADE,
+            total_diagnoses integer,
+            total_findings integer
+        """
+
+    def _report_indexes(self):
+        return ['diagnosis_id', 'date_diagnosis', 'employee_id', 'attribute_id', 'attribute_value_id']
+
+    def _report_select(self, where):
+        columns = 'date_diagnosis, employee_id, attribute_id, attribute_value_id, diagnosis_id, total_diagnoses, total_findings'
+        return columns, """
+            SELECT
+                src.date_diagnosis,
+                src.employee_id,
+                l.attribute_id,
+                rel.health_diagnosis_attribute_value_id,
+                src.id,
+                CASE WHEN row_number() OVER (PARTITION BY src.id ORDER BY l.id, rel.health_diagnosis_attribute_value_id) = 1
+                     THEN 1 ELSE 0 END,
+                CASE WHEN rel.health_diagnosis_attribute_value_id IS NULL THEN 0 ELSE 1 END
+            FROM health_diagnosis src
+            LEFT JOIN health_diagnosis_attribute_line l ON l.diagnosis_id = src.id
+            LEFT JOIN health_diagnosis_attribute_value_rel rel ON rel.health_diagnosis_attribute_line_id = l.id
+            WHERE %s
+        """ % where
+
+    def _report_changed_ids(self, since):
+        # Lines are changed without touching their diagnosis as well
+        ids = super()._report_changed_ids(since)
+        self.env['health.diagnosis.attribute.line'].flush_model()
+        self.env.cr.execute("""
+            SELECT DISTINCT diagnosis_id FROM health_diagnosis_attribute_line
+             WHERE %(since)s IS NULL OR write_date > %(since)s
+        """, {'since': since})
+        return list(set(ids).union(row[0] for row in self.env.cr.fetchall()))
 
     def init(self):
-        tools.drop_view_if_exists(self._cr, 'health_diagnosis_report')
+        super().init()
         self._cr.execute("""
-            CREATE VIEW health_diagnosis_report AS (
-                SELECT 
-                    hl.id as id,
-                    hl.date_diagnosis as date_diagnosis,
-                    hl.employee_id as employee_id,
-                    l.attribute_id as attribute_id,
-                    v.id as attribute_value_id,
-                    hl.id as diagnosis_id,
-                    COUNT(hl.id) OVER() as total_diagnoses
-                FROM health_diagnosis hl
-                LEFT JOIN health_diagnosis_attribute_line l ON l.diagnosis_id = hl.id
-                LEFT JOIN health_diagnosis_attribute_value_rel rel ON rel.health_diagnosis_attribute_line_id = l.id
-                LEFT JOIN health_diagnosis_attribute_value v ON v.id = rel.health_diagnosis_attribute_value_id
-            )
+            CREATE INDEX IF NOT EXISTS health_diagnosis_attribute_line_write_date_index
+            ON health_diagnosis_attribute_line (write_date)
         """)
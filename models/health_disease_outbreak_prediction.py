@@ -1,25 +1,42 @@
 from odoo import fields, models, api, tools, _
-import requests
-import json
 import logging
 from odoo.exceptions import UserError
-import re
+
+from .health_ai_response import to_number
+from .health_ai_prompt import compact_json
+from .hr_employee import shrink_health_digest
 
 _logger = logging.getLogger(__name__)
 
 class HealthDiseaseOutbreakPrediction(models.Model):
     _name = 'health.disease.outbreak.prediction'
     _description = 'Disease Outbreak Prediction'
+    _inherit = ['health.ai.engine.mixin']
+    _ai_engine = 'outbreak_prediction'
+    _ai_response_schema = {'prediction_result': 'text', 'predicted_disease': 'text', 'accuracy': 'any', 'title': 'text'}
 
     # Fields to store predictive results and input data
     name = fields.Char('Prediction Title', required=True, default="New Disease Prediction")
-    employee_id = fields.Many2one('hr.employee', string='Employee', required=True)
+    employee_id = fields.Many2one('hr.employee', string='Employee')
     predicted_disease = fields.Char('Predicted Disease', readonly=True)
-    region = fields.Char('Region', compute='_compute_region', store=True, readonly=True)
+    region = fields.Char('Region', compute='_compute_region', store=True, readonly=False)
     prediction_date = fields.Datetime('Prediction Date', default=fields.Datetime.now)
     historical_data = fields.Text('Historical Data', readonly=True)
     prediction_result = fields.Text('Prediction Result', readonly=True)
     accuracy_rate = fields.Float('Prediction Accuracy', readonly=True)
+    # Clusters flagged by the statistical detector, see health.outbreak.detector
+    source = fields.Selection([
+        ('employee', 'Employee History'),
+        ('detector', 'Outbreak Detector'),
+    ], string='Source', default='employee', required=True, readonly=True)
+    department_id = fields.Many2one('hr.department', string='Department', readonly=True)
+    attribute_value_id = fields.Many2one('health.diagnosis.attribute.value', string='Finding', readonly=True)
+    observed_cases = fields.Integer('Observed Cases', readonly=True)
+    expected_cases = fields.Float('Expected Cases', readonly=True)
+    p_value = fields.Float('P-Value', digits=(16, 6), readonly=True)
+    cusum_score = fields.Float('CUSUM Score', readonly=True)
+    date_from = fields.Date('Period Start', readonly=True)
+    date_to = fields.Date('Period End', readonly=True)
 
     @api.depends('employee_id')
     def _compute_region(self):
@@ -28,21 +45,112 @@ class HealthDiseaseOutbreakPrediction(models.Model):
             if record.employee_id and record.employee_id.address_id:
                 # Assuming 'city' in res.partner is used as the region
                 record.region = record.employee_id.address_id.city or 'Unknown Region'
-            else:
+            elif record.employee_id or not record.region:
                 record.region = 'Unknown Region'
 
+    @api.model
+    def _cron_detect_outbreaks(self):
+        """ Create a prediction for every new cluster flagged by the detector
+        and queue the AI narrative of those only. """
+        clusters = self.env['health.outbreak.detector']._detect()
+        if not clusters:
+            return self.browse()
+
+        # Clusters already reported for an overlapping period are not repeated
+        reported = self.search([
+            ('source', '=', 'detector'),
+            ('date_to', '>=', min(cluster['date_from'] for cluster in clusters)),
+        ])
+        seen = {(p.attribute_value_id.id, p.region, p.department_id.id) for p in reported}
+        values = self.env['health.diagnosis.attribute.value'].browse({cluster['value_id'] for cluster in clusters})
+        departments = self.env['hr.department'].browse({cluster['department_id'] for cluster in clusters} - {False})
+        names = {value.id: '%s: %s' % (value.attribute_id.name, value.name) for value in values}
+        department_names = {department.id: department.name for department in departments}
+
+        vals_list = []
+        for cluster in clusters:
+            if (cluster['value_id'], cluster['region'], cluster['department_id']) in seen:
+                continue
+            where = ' / '.join(filter(None, [cluster['region'], department_names.get(cluster['department_id'])]))
+            vals_list.append({
+                'name': _("Possible outbreak of %s in %s") % (names[cluster['value_id']], where),
+                'source': 'detector',
+                'region': cluster['region'],
+                'department_id': cluster['department_id'],
+                'attribute_value_id': cluster['value_id'],
+                'predicted_disease': names[cluster['value_id']],
+                'observed_cases': cluster['observed'],
+                'expected_cases': cluster['expected'],
+                'p_value': cluster['p_value'],
+                'cusum_score': cluster['cusum'],
+                'accuracy_rate': (1.0 - cluster['p_value']) * 100.0,
+                'date_from': cluster['date_from'],
+                'date_to': cluster['date_to'],
+                'historical_data': compact_json(dict(
+                    cluster,
+                    finding=names[cluster['value_id']],
+                    department=department_names.get(cluster['department_id']),
+                    date_from=fields.Date.to_string(cluster['date_from']),
+                    date_to=fields.Date.to_string(cluster['date_to']),
+                )),
+            })
+        predictions = self.create(vals_list)
+        predictions.trigger_prediction()
+        return predictions
+
+    @api.model
+    def action_detect_outbreaks(self):
+        """ Run the detector now and show the predictions it created. """
+        predictions = self._cron_detect_outbreaks()
+        action = self.env['ir.actions.act_window']._for_xml_id('%s.action_health_disease_outbreak_prediction' % self._module)
+        action['domain'] = [('id', 'in', predictions.ids)]
+        return action
+
     def trigger_prediction(self):
-        """ Trigger the AI-based prediction logic. """
-        # Fetch the historical diagnosis data for the selected employee
-        historical_data = self._get_historical_data()
+        """ Queue the AI-based prediction logic. """
+        self._enqueue_ai_job('_run_prediction')
+
+    def _run_prediction(self):
+        """ Run the AI-based prediction logic for every record in the set. """
+        return self._run_ai_batch()
+
+    def _prepare_ai_request(self):
+        """ Build the prediction request for the current record. """
+        self.ensure_one()
+        if self.source == 'detector':
+            # Only the narrative of an already detected cluster is asked for
+            return self._ai_request(
+                messages=self._build_cluster_messages(self.historical_data),
+                max_tokens=300,
+                temperature=0.5,
+                error_message=_("Failed to retrieve prediction from the AI API."),
+                historical_data=self.historical_data,
+            )
+        if not self.employee_id:
+            raise UserError(_("Select an employee to run the prediction."))
+        # Fetch the historical diagnosis data for the selected employee,
+        # reduced to fit the token budget
+        historical_data, = self.env['health.ai.prompt']._fit([(self._get_historical_data(), shrink_health_digest)])
+        return self._ai_request(
+            messages=self._build_prediction_messages(historical_data),
+            max_tokens=300,
+            temperature=0.5,  # Adjust based on required creativity level
+            error_message=_("Failed to retrieve prediction from the AI API."),
+            historical_data=historical_data,
+        )
 
-        # Call AI-based prediction API
-        prediction_result, predicted_disease, accuracy, new_title = self._call_prediction_api(historical_data)
+    def _apply_ai_response(self, content, request):
+        """ Store the prediction returned by the AI service. """
+        prediction_result, predicted_disease, accuracy, new_title = self._parse_prediction_response(content)
+        if self.source == 'detector':
+            # Keep the statistics of the detector, the AI only explains them
+            self.write({'name': new_title, 'prediction_result': prediction_result})
+            return
 
         # Update the prediction results and set the new title returned by OpenAI
         self.write({
             'name': new_title,
-            'historical_data': historical_data,
+            'historical_data': request['historical_data'],
             'prediction_result': prediction_result,
             'predicted_disease': predicted_disease,
             'accuracy_rate': accuracy,
@@ -50,87 +158,50 @@ class HealthDiseaseOutbreakPrediction(models.Model):
 
     def _get_historical_data(self):
         """Fetch actual historical diagnosis data for prediction."""
-        # Fetch historical diagnosis data specific to the selected employee
-        diagnoses = self.env['health.diagnosis'].search([
-            ('employee_id', '=', self.employee_id.id),  # Get diagnoses only for this employee
-            ('date_diagnosis', '!=', False),  # Ensure the record has a diagnosis date
-            ('diagnosis_attribute_line_ids.value_ids', '!=', False)  # Ensure non-empty attribute values
-        ])
-
-        # Prepare a list to hold the filtered historical data
-        data_for_prediction = []
-
-        for diagnosis in diagnoses:
-            # Gather attributes with non-empty values
-            attributes_with_values = []
-            for line in diagnosis.diagnosis_attribute_line_ids:
-                if line.value_ids:  # Check if the attribute has any values
-                    attribute_values = [value.name for value in line.value_ids]
-                    attributes_with_values.append({
-                        'attribute': line.attribute_id.name,
-                        'values': attribute_values
-                    })
-
-            # If there are any attributes with values, add this diagnosis to the historical data
-            if attributes_with_values:
-                data_for_prediction.append({
-                    'date': diagnosis.date_diagnosis.strftime('%Y-%m-%d'),
-                    'disease': diagnosis.name,
-                    'attributes': attributes_with_values
-                })
-
-        return json.dumps(data_for_prediction, indent=4)
-
-    def _call_prediction_api(self, historical_data):
-        """ Call AI-based prediction API using OpenAI. """
-        # Retrieve the API key and model details from system parameters
-        config = self.env['ir.config_parameter'].sudo()
-        api_key = config.get_param('ai_health.openai_api_key')
-        model = config.get_param('ai_health.openai_model')
-
-        if not api_key or not model:
-            raise UserError(_("Missing configuration for AI-based prediction API."))
+        return self.employee_id._get_health_digest_prompt(label='disease')
 
+    def _build_prediction_messages(self, historical_data):
+        """ Build the OpenAI messages asking for an outbreak prediction. """
         # Build the prediction prompt based on historical data
         prompt = (
             f"Here is the historical diagnosis data for the employee:\n"
             f"{historical_data}\n"
             "Based on this data, predict any significant disease outbreak trends for the next week. "
             "Please return the prediction as a JSON object with the following structure:\n"
-            "{'prediction_result': {}, 'predicted_disease': {}, 'accuracy': {}, 'title': {}}.\n"
+            "{\"prediction_result\": \"...\", \"predicted_disease\": \"...\", \"accuracy\": 0, \"title\": \"...\"}.\n"
+            "Ensure that the 'accuracy' is a numeric value between 0 and 100, representing a percentage confidence level."
+        )
+
+        return [
+            {"role": "system", "content": "You are a highly intelligent AI that predicts disease outbreaks based on historical health data."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _build_cluster_messages(self, cluster_data):
+        """ Build the OpenAI messages asking to explain a detected cluster. """
+        prompt = (
+            f"A statistical detector flagged the following cluster of diagnoses among our employees:\n"
+            f"{cluster_data}\n"
+            "'observed' is the number of cases during the period, 'expected' the number expected from the "
+            "previous weeks and 'daily_cases' the cases per day. Explain what this cluster may indicate and "
+            "which preventive actions should be taken. "
+            "Please return the answer as a JSON object with the following structure:\n"
+            "{\"prediction_result\": \"...\", \"predicted_disease\": \"...\", \"accuracy\": 0, \"title\": \"...\"}.\n"
             "Ensure that the 'accuracy' is a numeric value between 0 and 100, representing a percentage confidence level."
         )
 
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
-        }
-
-        # Construct the API call payload
-        data = {
-            'model': model,
-            'messages': [
-                {"role": "system", "content": "You are a highly intelligent AI that predicts disease outbreaks based on historical health data."},
-                {"role": "user", "content": prompt}
-            ],
-            'max_tokens': 300,
-            'temperature': 0.5,  # Adjust based on required creativity level
-        }
-
-        # Make the request to OpenAI's API
-        response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
-
-        if response.status_code != 200:
-            _logger.error("Error from OpenAI API: %s", response.text)
-            raise UserError(_("Failed to retrieve prediction from the AI API."))
+        return [
+            {"role": "system", "content": "You are a highly intelligent AI that predicts disease outbreaks based on historical health data."},
+            {"role": "user", "content": prompt}
+        ]
 
+    def _parse_prediction_response(self, prediction_content):
+        """ Extract the prediction, disease, accuracy and title from the AI response. """
         try:
-            # Get the AI's response and parse the result
-            prediction_content = response.json()['choices'][0]['message']['content']
             _logger.info("OpenAI prediction response: %s", prediction_content)
 
             # Parse the response as a JSON object
-            prediction_data = json.loads(re.search(r'({.*})', prediction_content, re.DOTALL).group(1))
+            prediction_data = self._parse_ai_json(prediction_content)
 
             prediction_result = prediction_data.get('prediction_result', 'No significant trends detected')
             predicted_disease = prediction_data.get('predicted_disease', 'Unknown')
@@ -141,7 +212,10 @@ class HealthDiseaseOutbreakPrediction(models.Model):
             
             if isinstance(accuracy, (str, float, int)):
                 # If accuracy is a string, float, or integer, convert it to a float
-                accuracy = float(accuracy)
+                try:
+                    accuracy = to_number(accuracy)
+                except ValueError:
+                    accuracy = 0.0
             elif isinstance(accuracy, dict):
                 # In case a dictionary is returned, try to force the confidence into a numeric form
                 if 'confidence_level' in accuracy:
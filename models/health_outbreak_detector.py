@@ -0,0 +1,160 @@
+from odoo import fields, models, api, _
+from odoo.exceptions import UserError
+from datetime import timedelta
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    _logger.debug("Cannot import numpy, the outbreak detector is unavailable.")
+    np = None
+
+DEFAULT_BASELINE_DAYS = 28
+DEFAULT_WINDOW_DAYS = 7
+DEFAULT_ALPHA = 0.01
+DEFAULT_MIN_CASES = 3
+DEFAULT_CUSUM_K = 0.5
+DEFAULT_CUSUM_H = 4.0
+
+
+def _poisson_sf(observed, expected):
+    """ P(X >= observed) for X ~ Poisson(expected), element-wise.
+
+    The probability terms are accumulated in log space so large expected
+    counts do not underflow.
+    """
+    log_expected = np.log(expected)
+    log_term = -expected  # log P(X = 0)
+    cdf = np.zeros_like(expected)
+    for k in range(int(observed.max())):
+        cdf += np.where(k < observed, np.exp(log_term), 0.0)
+        log_term = log_term + log_expected - np.log(k + 1)
+    return np.clip(1.0 - cdf, 0.0, 1.0)
+
+
+class HealthOutbreakDetector(models.AbstractModel):
+    _name = 'health.outbreak.detector'
+    _description = 'Statistical Outbreak Detector'
+
+    @api.model
+    def _get_settings(self):
+        config = self.env['ir.config_parameter'].sudo()
+        return {
+            'baseline_days': int(config.get_param('ai_health.outbreak_baseline_days') or DEFAULT_BASELINE_DAYS),
+            'window_days': int(config.get_param('ai_health.outbreak_window_days') or DEFAULT_WINDOW_DAYS),
+            'alpha': float(config.get_param('ai_health.outbreak_alpha') or DEFAULT_ALPHA),
+            'min_cases': int(config.get_param('ai_health.outbreak_min_cases') or DEFAULT_MIN_CASES),
+            'cusum_k': float(config.get_param('ai_health.outbreak_cusum_k') or DEFAULT_CUSUM_K),
+            'cusum_h': float(config.get_param('ai_health.outbreak_cusum_h') or DEFAULT_CUSUM_H),
+        }
+
+    @api.model
+    def _load_daily_counts(self, date_from, days):
+        """ Return ``(series, counts)`` for the ``days`` days from ``date_from``.
+
+        A series is a ``(value_id, region, department_id)`` triple and
+        ``counts`` a ``len(series) x days`` matrix holding, for each day, the
+        number of diagnoses with that attribute value among the employees of
+        that region and department. Everything is aggregated by one query.
+        """
+        self.env['health.diagnosis'].flush_model(['employee_id', 'date_diagnosis'])
+        self.env['health.diagnosis.attribute.line'].flush_model(['diagnosis_id', 'value_ids'])
+        self.env['hr.employee'].flush_model(['address_id', 'department_id'])
+
+        self.env.cr.execute("""
+            SELECT dense_rank() OVER (ORDER BY c.value_id, c.region, c.department_id) - 1,
+                   c.value_id, c.region, c.department_id, c.day, c.cases
+              FROM (
+                SELECT rel.health_diagnosis_attribute_value_id AS value_id,
+                       COALESCE(NULLIF(p.city, ''), 'Unknown Region') AS region,
+                       COALESCE(e.department_id, 0) AS department_id,
+                       (d.date_diagnosis::date - %(date_from)s::date) AS day,
+                       COUNT(DISTINCT d.id) AS cases
+                  FROM health_diagnosis d
+                  JOIN hr_employee e ON e.id = d.employee_id
+                  LEFT JOIN res_partner p ON p.id = e.address_id
+                  JOIN health_diagnosis_attribute_line l ON l.diagnosis_id = d.id
+                  JOIN health_diagnosis_attribute_value_rel rel ON rel.health_diagnosis_attribute_line_id = l.id
+                 WHERE d.date_diagnosis >= %(date_from)s
+                   AND d.date_diagnosis < %(date_to)s
+                 GROUP BY 1, 2, 3, 4
+              ) c
+        """, {'date_from': date_from, 'date_to': date_from + timedelta(days=days)})
+        rows = self.env.cr.fetchall()
+        if not rows:
+            return [], np.zeros((0, days))
+
+        series_idx = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        day_idx = np.fromiter((row[4] for row in rows), dtype=np.int64, count=len(rows))
+        cases = np.fromiter((row[5] for row in rows), dtype=np.float64, count=len(rows))
+        counts = np.zeros((series_idx.max() + 1, days))
+        counts[series_idx, day_idx] = cases
+
+        _unique, first = np.unique(series_idx, return_index=True)
+        series = [(rows[i][1], rows[i][2], rows[i][3] or False) for i in first]
+        return series, counts
+
+    @api.model
+    def _detect(self, date_to=None):
+        """ Flag the series whose recent counts are abnormally high.
+
+        The last ``window_days`` days are compared with the rate of the
+        ``baseline_days`` before them, for all series at once: a Poisson
+        test on the total of the window and a one-sided CUSUM on the
+        standardized daily counts. A series is flagged when it has at least
+        ``min_cases`` cases in the window and either test fires. Returns
+        one dict per flagged cluster, most significant first.
+        """
+        if np is None:
+            raise UserError(_("The outbreak detector requires the numpy Python package."))
+        settings = self._get_settings()
+        baseline_days, window_days = settings['baseline_days'], settings['window_days']
+        date_to = date_to or fields.Date.context_today(self) + timedelta(days=1)
+        date_from = date_to - timedelta(days=baseline_days + window_days)
+
+        start = time.perf_counter()
+        series, counts = self._load_daily_counts(date_from, baseline_days + window_days)
+        if not series:
+            return []
+        baseline, recent = counts[:, :baseline_days], counts[:, baseline_days:]
+
+        # Baseline daily rate, with half a case added so a new finding does not
+        # get a zero rate
+        rate = (baseline.sum(axis=1) + 0.5) / baseline_days
+        observed = recent.sum(axis=1)
+        expected = rate * window_days
+        candidates = observed >= settings['min_cases']
+
+        p_values = np.ones(len(series))
+        if candidates.any():
+            p_values[candidates] = _poisson_sf(observed[candidates], expected[candidates])
+
+        cusum = np.zeros(len(series))
+        score = np.zeros(len(series))
+        residuals = (recent - rate[:, None]) / np.sqrt(rate)[:, None]
+        for day in range(window_days):
+            cusum = np.maximum(0.0, cusum + residuals[:, day] - settings['cusum_k'])
+            score = np.maximum(score, cusum)
+
+        flagged = candidates & ((p_values < settings['alpha']) | (score > settings['cusum_h']))
+        indexes = np.flatnonzero(flagged)
+        indexes = indexes[np.argsort(p_values[indexes], kind='stable')]
+        _logger.info("Outbreak detection over %s series took %.3fs, %s flagged",
+                     len(series), time.perf_counter() - start, len(indexes))
+
+        window_from = date_to - timedelta(days=window_days)
+        return [{
+            'value_id': series[i][0],
+            'region': series[i][1],
+            'department_id': series[i][2],
+            'observed': int(observed[i]),
+            'expected': float(expected[i]),
+            'p_value': float(p_values[i]),
+            'cusum': float(score[i]),
+            'date_from': window_from,
+            'date_to': date_to - timedelta(days=1),
+            'daily_cases': [int(count) for count in recent[i]],
+        } for i in indexes]
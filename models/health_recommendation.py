@@ -1,15 +1,17 @@
 from odoo import fields, models, api, _
-import json
 import logging
-import requests
-import re
 from odoo.exceptions import UserError
 
+from .hr_employee import shrink_health_digest
+
 _logger = logging.getLogger(__name__)
 
 class HealthRecommendation(models.Model):
     _name = 'health.recommendation'
     _description = 'Health Recommendation'
+    _inherit = ['health.ai.engine.mixin']
+    _ai_engine = 'recommendation'
+    _ai_response_schema = {'recommendation': 'text', 'lifestyle_suggestion': 'text', 'preventive_measures': 'text', 'title': 'text'}
     
     # Fields
     name = fields.Char('Recommendation Title', required=True, default="New Health Recommendation")
@@ -28,18 +30,38 @@ class HealthRecommendation(models.Model):
             record.symptoms = record.diagnosis_id.symptom_description if record.diagnosis_id else ''
 
     def trigger_recommendation(self):
-        """ Trigger AI-based recommendation for the employee. """
-        # Fetch the diagnosis details and employee's past health records
-        diagnosis_data = self._get_diagnosis_data()
-        historical_data = self._get_historical_data()
+        """ Queue AI-based recommendation for the employee. """
+        self._enqueue_ai_job('_run_recommendation')
+
+    def _run_recommendation(self):
+        """ Run AI-based recommendation for every record in the set. """
+        return self._run_ai_batch()
+
+    def _prepare_ai_request(self):
+        """ Build the recommendation request for the current record. """
+        self.ensure_one()
+        # Fetch the diagnosis details and employee's past health records,
+        # the records are reduced to fit the token budget
+        diagnosis_data, historical_data = self.env['health.ai.prompt']._fit([
+            (self._get_diagnosis_data(), None),
+            (self._get_historical_data(), shrink_health_digest),
+        ])
+        return self._ai_request(
+            messages=self._build_recommendation_messages(diagnosis_data, historical_data),
+            max_tokens=500,
+            temperature=0.7,
+            error_message=_("Failed to retrieve health recommendations."),
+            historical_data=historical_data,
+        )
 
-        # Call the AI service to get recommendations
-        recommendation, lifestyle_suggestion, preventive_measures, new_title = self._call_recommendation_api(diagnosis_data, historical_data)
+    def _apply_ai_response(self, content, request):
+        """ Store the recommendations returned by the AI service. """
+        recommendation, lifestyle_suggestion, preventive_measures, new_title = self._parse_recommendation_response(content)
 
         # Update the record with the returned recommendations
         self.write({
             'name': new_title,
-            'historical_data': historical_data,
+            'historical_data': request['historical_data'],
             'recommendation_result': recommendation,
             'lifestyle_suggestion': lifestyle_suggestion,
             'preventive_measures': preventive_measures
@@ -55,92 +77,45 @@ class HealthRecommendation(models.Model):
 
     def _get_historical_data(self):
         """ Fetch past medical history for the employee. """
-        diagnoses = self.env['health.diagnosis'].search([
-            ('employee_id', '=', self.employee_id.id),
-            ('date_diagnosis', '!=', False),  # Ensure valid diagnosis dates
-            ('diagnosis_attribute_line_ids.value_ids', '!=', False)  # Ensure non-empty attribute values
-        ])
-        
-        historical_data = []
-        for diagnosis in diagnoses:
-            attributes_with_values = []
-            for line in diagnosis.diagnosis_attribute_line_ids:
-                if line.value_ids:
-                    attribute_values = [value.name for value in line.value_ids]
-                    attributes_with_values.append({
-                        'attribute': line.attribute_id.name,
-                        'values': attribute_values
-                    })
-
-            if attributes_with_values:
-                historical_data.append({
-                    'date': diagnosis.date_diagnosis.strftime('%Y-%m-%d'),
-                    'diagnosis': diagnosis.name,
-                    'attributes': attributes_with_values
-                })
-        
-        return json.dumps(historical_data, indent=4)
-
-    def _call_recommendation_api(self, diagnosis_data, historical_data):
-        """ Call OpenAI's API to get health recommendations. """
-        config = self.env['ir.config_parameter'].sudo()
-        api_key = config.get_param('ai_health.openai_api_key')
-        model = config.get_param('ai_health.openai_model')
-
-        if not api_key or not model:
-            raise UserError(_("Missing configuration for OpenAI API."))
+        return self.employee_id._get_health_digest_prompt(label='diagnosis')
 
+    def _build_recommendation_messages(self, diagnosis_data, historical_data):
+        """ Build the OpenAI messages asking for health recommendations. """
         # Build the recommendation prompt
         prompt = (
             f"Here is the diagnosis data:\n"
-            f"{json.dumps(diagnosis_data, indent=4)}\n"
+            f"{diagnosis_data}\n"
             f"Here is the employee's medical history:\n"
             f"{historical_data}\n"
             "Please provide a detailed health recommendation based on this diagnosis, including lifestyle suggestions and preventive measures. "
             "Return the data in the following JSON structure:\n"
-            "{'recommendation': {}, 'lifestyle_suggestion': {}, 'preventive_measures': {}, 'title': {}}."
+            "{\"recommendation\": \"...\", \"lifestyle_suggestion\": \"...\", \"preventive_measures\": \"...\", \"title\": \"...\"}."
         )
 
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-
-        # Payload for OpenAI API
-        data = {
-            'model': model,
-            'messages': [
-                {"role": "system", "content": "You are a highly intelligent AI that provides personalized health recommendations based on medical data."},
-                {"role": "user", "content": prompt}
-            ],
-            'max_tokens': 500,  # Increased token limit
-            'temperature': 0.7
-        }
-
-        response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
-
-        if response.status_code != 200:
-            _logger.error("Error from OpenAI API: %s", response.text)
-            raise UserError(_("Failed to retrieve health recommendations."))
+        return [
+            {"role": "system", "content": "You are a highly intelligent AI that provides personalized health recommendations based on medical data."},
+            {"role": "user", "content": prompt}
+        ]
 
+    def _parse_recommendation_response(self, recommendation_content):
+        """ Extract the recommendation, lifestyle suggestion, preventive measures and title from the AI response. """
         try:
-            recommendation_content = response.json()['choices'][0]['message']['content']
             _logger.info("Received AI recommendation response: %s", recommendation_content)  # Log the full response
 
             # Attempt to parse the response as JSON
-            recommendation_data = json.loads(re.search(r'({.*})', recommendation_content, re.DOTALL).group(1))
-
-            return (
-                recommendation_data.get('recommendation', 'No recommendation available'),
-                recommendation_data.get('lifestyle_suggestion', 'No lifestyle suggestion available'),
-                recommendation_data.get('preventive_measures', 'No preventive measures available'),
-                recommendation_data.get('title', 'New Health Recommendation')
-            )
-        except json.JSONDecodeError as e:
-            _logger.error("Failed to decode JSON from AI response: %s", str(e))
-            _logger.info("Full response text: %s", recommendation_content)
-            raise UserError(_("Error decoding AI response. Please check the logs for details."))
+            recommendation_data = self._parse_ai_json(recommendation_content)
+            return self._read_recommendation_data(recommendation_data)
         except Exception as e:
             _logger.error("Error processing AI recommendation: %s", str(e))
             raise UserError(_("Error processing AI recommendation: %s") % str(e))
 
+    @api.model
+    def _read_recommendation_data(self, recommendation_data):
+        """ Recommendation, lifestyle suggestion, preventive measures and title of parsed data, with defaults. """
+        return (
+            recommendation_data.get('recommendation', 'No recommendation available'),
+            recommendation_data.get('lifestyle_suggestion', 'No lifestyle suggestion available'),
+            recommendation_data.get('preventive_measures', 'No preventive measures available'),
+            recommendation_data.get('title', 'New Health Recommendation')
+        )
+
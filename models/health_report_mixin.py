@@ -0,0 +1,122 @@
+from odoo import models, api
+from odoo.tools import split_every
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Rows written by transactions still open when the watermark was taken carry
+# an older write_date, so every refresh looks back this far again.
+REFRESH_OVERLAP = 900  # seconds
+REFRESH_CHUNK = 5000
+
+
+class HealthMaterializedReport(models.AbstractModel):
+    _name = 'health.materialized.report'
+    _description = 'Incrementally Refreshed Report'
+
+    # Model the report rows are derived from; the report table holds the
+    # ``_report_key`` column referencing it, with ON DELETE CASCADE
+    _report_source = None
+    _report_key = None
+
+    def _report_columns(self):
+        """ Column definitions of the report table. """
+        raise NotImplementedError()
+
+    def _report_indexes(self):
+        """ Columns of the report table to index. """
+        return [self._report_key]
+
+    def _report_select(self, where):
+        """ Return ``(columns, query)`` selecting the report rows of the
+        source rows matching the SQL condition ``where``. """
+        raise NotImplementedError()
+
+    def _report_changed_ids(self, since):
+        """ Ids of the source rows changed since ``since`` (or all of them). """
+        source = self.env[self._report_source]
+        source.flush_model()
+        self.env.cr.execute(
+            "SELECT id FROM %s WHERE %%(since)s IS NULL OR write_date > %%(since)s" % source._table,
+            {'since': since},
+        )
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _report_expected_columns(self):
+        columns, _query = self._report_select('TRUE')
+        return {'id'} | {column.strip() for column in columns.split(',')}
+
+    def _report_table_columns(self):
+        self._cr.execute("""
+            SELECT column_name FROM information_schema.columns
+             WHERE table_schema = current_schema() AND table_name = %s
+        """, (self._table,))
+        return {row[0] for row in self._cr.fetchall()}
+
+    def init(self):
+        if not self._report_source:
+            return
+        cr = self._cr
+        cr.execute("SELECT relkind FROM pg_class WHERE relname = %s", (self._table,))
+        kind = cr.fetchone()
+        if kind and kind[0] == 'r':
+            if self._report_table_columns() == self._report_expected_columns():
+                return
+            _logger.info("Columns of %s changed, rebuilding it", self._table)
+            cr.execute("DROP TABLE %s CASCADE" % self._table)
+        elif kind:
+            # Previous versions were plain views computed on every read
+            cr.execute("DROP VIEW IF EXISTS %s CASCADE" % self._table)
+        cr.execute("CREATE TABLE %s (%s)" % (self._table, self._report_columns()))
+        for column in self._report_indexes():
+            cr.execute("CREATE INDEX %s_%s_index ON %s (%s)" % (self._table, column, self._table, column))
+        source_table = self.env[self._report_source]._table
+        cr.execute("CREATE INDEX IF NOT EXISTS %s_write_date_index ON %s (write_date)" % (source_table, source_table))
+        self._refresh_rows()
+
+    @api.model
+    def _get_watermark(self):
+        self.env.cr.execute("SELECT value FROM ir_config_parameter WHERE key = %s", ('ai_health.report_watermark.%s' % self._table,))
+        row = self.env.cr.fetchone()
+        return row and row[0] or None
+
+    @api.model
+    def _set_watermark(self, value):
+        # Written directly so the parameter cache of every worker is not
+        # invalidated on each refresh
+        self.env.cr.execute("""
+            INSERT INTO ir_config_parameter (key, value, create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'))
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, write_date = EXCLUDED.write_date
+        """, ('ai_health.report_watermark.%s' % self._table, value, self.env.uid, self.env.uid))
+
+    @api.model
+    def _refresh_rows(self, source_ids=None):
+        """ Rebuild the report rows of ``source_ids``, or the whole table. """
+        cr = self.env.cr
+        # Readers go on, a concurrent refresh waits: otherwise both could
+        # delete the old rows of a key before either inserts the new ones
+        cr.execute("LOCK TABLE %s IN EXCLUSIVE MODE" % self._table)
+        if source_ids is None:
+            cr.execute("SELECT (now() at time zone 'UTC') - %s * interval '1 second'", (REFRESH_OVERLAP,))
+            watermark = cr.fetchone()[0]
+            columns, query = self._report_select('TRUE')
+            cr.execute("DELETE FROM %s" % self._table)
+            cr.execute("INSERT INTO %s (%s) %s" % (self._table, columns, query))
+            self._set_watermark(str(watermark))
+            return
+        columns, query = self._report_select('src.id IN %(ids)s')
+        for ids in split_every(REFRESH_CHUNK, source_ids, tuple):
+            cr.execute("DELETE FROM %s WHERE %s IN %%(ids)s" % (self._table, self._report_key), {'ids': ids})
+            cr.execute("INSERT INTO %s (%s) %s" % (self._table, columns, query), {'ids': ids})
+
+    @api.model
+    def _cron_refresh(self):
+        """ Rebuild the rows of the source records changed since the last run. """
+        since = self._get_watermark()
+        self.env.cr.execute("SELECT (now() at time zone 'UTC') - %s * interval '1 second'", (REFRESH_OVERLAP,))
+        watermark = self.env.cr.fetchone()[0]
+        source_ids = self._report_changed_ids(since)
+        self._refresh_rows(source_ids)
+        self._set_watermark(str(watermark))
+        _logger.info("Refreshed %s rows of %s source records", self._table, len(source_ids))
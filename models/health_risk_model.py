@@ -0,0 +1,281 @@
+from odoo import fields, models, api, _
+from odoo.exceptions import UserError
+import base64
+import io
+import threading
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    _logger.debug("Cannot import numpy, the local risk model is unavailable.")
+    np = None
+
+MIN_SAMPLES = 50
+# Finding values shared by fewer employees are too rare to weigh
+MIN_VALUE_EMPLOYEES = 5
+MAX_VALUES = 128
+# Mean life of a diagnosis in the features, older ones weigh less
+DECAY_DAYS = 180.0
+RECENCY_DAYS = 90.0
+# Frequency and recency features, before the finding values
+BASE_FEATURES = 3
+RIDGE = 1.0
+# AI scores are clipped to this share of the scale before the logit
+SCORE_EPSILON = 0.01
+HOLDOUT_EVERY = 5
+KEEP_ARTIFACTS = 3
+
+# Per-worker cache of the loaded model: (model id, _RiskModel)
+_loaded = [None, None]
+_loaded_lock = threading.Lock()
+
+
+class _RiskModel(object):
+    """ Ridge regression on the logit of the AI risk scores.
+
+    The features of an employee are the number of diagnoses of the last
+    month and year, the recency of the last one and, for the most common
+    finding values, how often they were found, decayed with age. Scores
+    are the logistic of a linear function of the standardized features,
+    scaled to 0-100, so they stay on the scale of the AI scores.
+    """
+
+    def __init__(self, values, mean, scale, weights, intercept):
+        self.values = values
+        self.mean = mean
+        self.scale = scale
+        self.weights = weights
+        self.intercept = intercept
+
+    def predict(self, matrix):
+        logits = ((matrix - self.mean) / self.scale) @ self.weights + self.intercept
+        return 100.0 / (1.0 + np.exp(-logits))
+
+    @classmethod
+    def load(cls, data):
+        arrays = np.load(io.BytesIO(data), allow_pickle=False)
+        return cls(arrays['values'], arrays['mean'], arrays['scale'], arrays['weights'], float(arrays['intercept']))
+
+    def dump(self):
+        output = io.BytesIO()
+        np.savez_compressed(
+            output, values=self.values, mean=self.mean, scale=self.scale,
+            weights=self.weights, intercept=np.array(self.intercept),
+        )
+        return output.getvalue()
+
+
+def _select_values(rows):
+    """ The finding values of the feature rows found for most employees. """
+    value_rows = rows[rows[:, 1] > 0]
+    if not len(value_rows):
+        return np.zeros(0, dtype=np.int64)
+    values, counts = np.unique(value_rows[:, 1].astype(np.int64), return_counts=True)
+    order = np.lexsort((values, -counts))  # by decreasing count, then id
+    order = order[counts[order] >= MIN_VALUE_EMPLOYEES][:MAX_VALUES]
+    return np.sort(values[order])
+
+
+def _build_matrix(rows, employee_ids, values):
+    """ Feature matrix of ``employee_ids`` (sorted) from the feature rows. """
+    matrix = np.zeros((len(employee_ids), BASE_FEATURES + len(values)), dtype=np.float32)
+    if not len(rows) or not len(employee_ids):
+        return matrix
+    positions = np.minimum(np.searchsorted(employee_ids, rows[:, 0]), len(employee_ids) - 1)
+    known = employee_ids[positions] == rows[:, 0]
+    rows, positions = rows[known], positions[known]
+
+    base = rows[:, 1] == 0
+    matrix[positions[base], 0] = np.log1p(rows[base, 2])
+    matrix[positions[base], 1] = np.log1p(rows[base, 3])
+    matrix[positions[base], 2] = np.exp(-rows[base, 4] / RECENCY_DAYS)
+
+    if len(values):
+        found = rows[:, 1] > 0
+        columns = np.searchsorted(values, rows[:, 1])
+        found &= (columns < len(values)) & (values[np.minimum(columns, len(values) - 1)] == rows[:, 1])
+        matrix[positions[found], BASE_FEATURES + columns[found]] = np.log1p(rows[found, 3])
+    return matrix
+
+
+def _fit(matrix, scores, values):
+    """ Fit a ``_RiskModel`` of ``matrix`` to the AI ``scores`` (0-100). """
+    matrix = matrix.astype(np.float64)
+    mean = matrix.mean(axis=0)
+    scale = matrix.std(axis=0)
+    scale[scale < 1e-6] = 1.0
+    standardized = (matrix - mean) / scale
+    shares = np.clip(np.asarray(scores, dtype=np.float64) / 100.0, SCORE_EPSILON, 1.0 - SCORE_EPSILON)
+    target = np.log(shares / (1.0 - shares))
+    intercept = float(target.mean())
+    gram = standardized.T @ standardized + RIDGE * np.eye(standardized.shape[1])
+    weights = np.linalg.solve(gram, standardized.T @ (target - intercept))
+    return _RiskModel(values, mean.astype(np.float32), scale.astype(np.float32), weights.astype(np.float32), intercept)
+
+
+class HealthRiskModel(models.Model):
+    _name = 'health.risk.model'
+    _description = 'Local Risk Scoring Model'
+    _order = 'date_trained desc, id desc'
+
+    name = fields.Char('Name', required=True, readonly=True)
+    active = fields.Boolean('Active', default=True)
+    date_trained = fields.Datetime('Trained On', readonly=True)
+    sample_count = fields.Integer('Training Samples', readonly=True,
+                                  help="Employees whose latest AI risk score the model was fitted to.")
+    feature_count = fields.Integer('Features', readonly=True)
+    holdout_mae = fields.Float('Mean Absolute Error', readonly=True,
+                               help="Average difference, in points of the 0-100 scale, between the local and AI scores of the held out employees.")
+    date_scored = fields.Datetime('Last Scoring', readonly=True)
+    scored_count = fields.Integer('Scored Employees', readonly=True)
+    scoring_duration = fields.Float('Scoring Duration (s)', readonly=True)
+    artifact = fields.Binary('Artifact', attachment=True, readonly=True)
+    artifact_size = fields.Integer('Artifact Size (bytes)', readonly=True)
+
+    @api.model
+    def _load_feature_rows(self):
+        """ Return the feature rows of all the employees, read in one query.
+
+        Each row is ``(employee, 0, diagnoses in 30 days, diagnoses in a
+        year, days since the last one)`` or ``(employee, value, diagnoses
+        with the value, decayed count, 0)`` for the finding values.
+        """
+        self.env['health.diagnosis'].flush_model(['employee_id', 'date_diagnosis'])
+        self.env['health.diagnosis.attribute.line'].flush_model(['diagnosis_id', 'value_ids'])
+        self.env.cr.execute("""
+            WITH diagnosis AS (
+                SELECT id, employee_id,
+                       GREATEST(EXTRACT(EPOCH FROM (now() at time zone 'UTC') - date_diagnosis) / 86400.0, 0) AS age
+                  FROM health_diagnosis
+                 WHERE date_diagnosis IS NOT NULL
+            )
+            SELECT employee_id, 0, count(*) FILTER (WHERE age <= 30), count(*) FILTER (WHERE age <= 365), min(age)
+              FROM diagnosis
+             GROUP BY employee_id
+             UNION ALL
+            SELECT d.employee_id, rel.health_diagnosis_attribute_value_id, count(*), sum(exp(-d.age / %s)), 0
+              FROM diagnosis d
+              JOIN health_diagnosis_attribute_line l ON l.diagnosis_id = d.id
+              JOIN health_diagnosis_attribute_value_rel rel ON rel.health_diagnosis_attribute_line_id = l.id
+             GROUP BY d.employee_id, rel.health_diagnosis_attribute_value_id
+        """, (DECAY_DAYS,))
+        rows = self.env.cr.fetchall()
+        return np.array(rows, dtype=np.float64).reshape(len(rows), 5)
+
+    @api.model
+    def _load_ai_scores(self):
+        """ Return the sorted employee ids and their latest AI risk score. """
+        self.env['health.risk.scoring'].flush_model(['employee_id', 'risk_score', 'scoring_date', 'ai_state'])
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (employee_id) employee_id, risk_score
+              FROM health_risk_scoring
+             WHERE ai_state = 'done'
+             ORDER BY employee_id, scoring_date DESC NULLS LAST, id DESC
+        """)
+        rows = self.env.cr.fetchall()
+        return (np.array([row[0] for row in rows], dtype=np.float64),
+                np.array([row[1] or 0.0 for row in rows], dtype=np.float64))
+
+    @api.model
+    def _train(self):
+        """ Fit a model to the AI risk scores and activate it.
+
+        A fifth of the employees is held out to measure the error, then the
+        model is fitted again on all of them. Returns the new model, or an
+        empty recordset when there are not enough AI scores.
+        """
+        if np is None:
+            raise UserError(_("The local risk model requires the numpy Python package."))
+        employee_ids, scores = self._load_ai_scores()
+        if len(employee_ids) < MIN_SAMPLES:
+            _logger.info("Not enough AI risk scores to train the local risk model (%s)", len(employee_ids))
+            return self.browse()
+
+        rows = self._load_feature_rows()
+        values = _select_values(rows)
+        matrix = _build_matrix(rows, employee_ids, values)
+        holdout = np.arange(len(employee_ids)) % HOLDOUT_EVERY == 0
+        model = _fit(matrix[~holdout], scores[~holdout], values)
+        error = float(np.abs(model.predict(matrix[holdout]) - scores[holdout]).mean())
+
+        model = _fit(matrix, scores, values)
+        data = model.dump()
+        risk_model = self.create({
+            'name': _("Risk model %s") % fields.Datetime.to_string(fields.Datetime.now()),
+            'date_trained': fields.Datetime.now(),
+            'sample_count': len(employee_ids),
+            'feature_count': matrix.shape[1],
+            'holdout_mae': error,
+            'artifact': base64.b64encode(data),
+            'artifact_size': len(data),
+        })
+        self.search([('id', '!=', risk_model.id)]).write({'active': False})
+        self.with_context(active_test=False).search([('active', '=', False)], offset=KEEP_ARTIFACTS - 1).unlink()
+        _logger.info("Trained local risk model on %s employees, %s features", len(employee_ids), matrix.shape[1])
+        return risk_model
+
+    @api.model
+    def _get_model(self):
+        """ Return ``(record, loaded model)`` of the active model, loading it once per worker. """
+        if np is None:
+            return self.browse(), None
+        risk_model = self.sudo().search([], limit=1)
+        if not risk_model:
+            return risk_model, None
+        with _loaded_lock:
+            if _loaded[0] != risk_model.id:
+                _loaded[:] = [risk_model.id, _RiskModel.load(base64.b64decode(risk_model.artifact))]
+            return risk_model, _loaded[1]
+
+    @api.model
+    def _rescore(self):
+        """ Score all the active employees with the active model in one pass
+        and store the scores. Returns the number of employees scored. """
+        risk_model, model = self._get_model()
+        if model is None:
+            return 0
+        started = time.monotonic()
+        self.env.cr.execute("SELECT id FROM hr_employee WHERE active ORDER BY id")
+        employee_ids = np.array([row[0] for row in self.env.cr.fetchall()], dtype=np.float64)
+        scores = model.predict(_build_matrix(self._load_feature_rows(), employee_ids, model.values))
+
+        Employee = self.env['hr.employee']
+        Employee.flush_model(['local_risk_score'])
+        self.env.cr.execute("""
+            UPDATE hr_employee e SET local_risk_score = t.score
+              FROM unnest(%s::int[], %s::float8[]) AS t(id, score)
+             WHERE e.id = t.id
+        """, (employee_ids.astype(np.int64).tolist(), np.round(scores, 2).tolist()))
+        Employee.invalidate_model(['local_risk_score'])
+        duration = time.monotonic() - started
+        risk_model.write({
+            'date_scored': fields.Datetime.now(),
+            'scored_count': len(employee_ids),
+            'scoring_duration': duration,
+        })
+        _logger.info("Scored the risk of %s employees in %.2fs", len(employee_ids), duration)
+        return len(employee_ids)
+
+    @api.model
+    def _cron_rescore(self):
+        self._train()
+        self._rescore()
+
+    def action_retrain(self):
+        risk_model = self._train()
+        if not risk_model:
+            raise UserError(_("At least %s employees with an AI risk score are needed to train the risk model.") % MIN_SAMPLES)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': risk_model.id,
+            'view_mode': 'form',
+        }
+
+    def action_rescore(self):
+        if not self._rescore():
+            raise UserError(_("Train the risk model first."))
@@ -1,10 +1,13 @@
-from odoo import fields, models, tools
+from odoo import fields, models
 
 class HealthRiskScoringReport(models.Model):
     _name = 'health.risk.scoring.report'
     _description = 'Health Risk Scoring Report'
+    _inherit = ['health.materialized.report']
     _auto = False
     _order = 'scoring_date desc'
+    _report_source = 'health.risk.scoring'
+    _report_key = 'id'
 
     scoring_date = fields.Datetime('Scoring Date', readonly=True)
     employee_id = fields.Many2one('hr.employee', string='Employee', readonly=True)
@@ -12,17 +15,29 @@ class HealthRiskScoringReport(models.Model):
     diagnosis_id = fields.Many2one('health.diagnosis', string='Diagnosis', readonly=True)
     total_risks = fields.Integer(string='Total Risk Assessments', readonly=True)
 
-    def init(self):
-        tools.drop_view_if_exists(self._cr, 'health_risk_scoring_report')
-        self._cr.execute("""
-            CREATE VIEW health_risk_scoring_report AS (
-                SELECT
-                    s.id AS id,
-                    s.scoring_date AS scoring_date,
-                    s.employee_id AS employee_id,
-                    s.risk_score AS risk_score,
-                    s.diagnosis_id AS diagnosis_id,
-                    COUNT(s.id) OVER() AS total_risks
-                FROM health_risk_scoring s
-            )
-        """)
+    def _report_columns(self):
+        return """
+            id integer PRIMARY KEY REFERENCES health_risk_scoring (id) ON DELETE CASCADE,
+            scoring_date timestamp,
+            employee_id integer,
+            risk_score double precision,
+            diagnosis_id integer,
+            total_risks integer
+        """
+
+    def _report_indexes(self):
+        return ['scoring_date', 'employee_id', 'diagnosis_id']
+
+    def _report_select(self, where):
+        columns = 'id, scoring_date, employee_id, risk_score, diagnosis_id, total_risks'
+        return columns, """
+            SELECT
+                src.id,
+                src.scoring_date,
+                src.employee_id,
+                src.risk_score,
+                src.diagnosis_id,
+                1
+            FROM health_risk_scoring src
+            WHERE %s
+        """ % where
@@ -0,0 +1,260 @@
+from odoo import models, api
+from datetime import date
+import hashlib
+import random
+import re
+import threading
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    _logger.debug("Cannot import numpy, near-duplicate lookups will query the database.")
+    np = None
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+DEFAULT_THRESHOLD = 0.8
+# Seconds between two reads of the bands indexed by other workers
+REFRESH_INTERVAL = 60
+# Bands kept in the per-worker dict before they are merged into the arrays
+MERGE_SIZE = 100000
+BACKFILL_CHUNK = 5000
+STOPWORDS = {
+    'and', 'or', 'the', 'a', 'an', 'of', 'with', 'since', 'for', 'in', 'on', 'at', 'to', 'my', 'me',
+    'have', 'has', 'had', 'am', 'is', 'are', 'was', 'been', 'feel', 'feeling', 'some', 'bit', 'very',
+}
+
+# Same permutations in every worker and across restarts, the band keys are persisted
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME)) for _i in range(NUM_PERM)]
+
+# Per-worker LSH index of each database
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def symptom_tokens(text):
+    """ Set of the normalized words of a symptom description. """
+    words = re.findall(r'[^\W\d_]{2,}', (text or '').lower())
+    return {word[:-1] if len(word) > 4 and word.endswith('s') else word for word in words if word not in STOPWORDS}
+
+
+def jaccard(tokens, other):
+    if not tokens or not other:
+        return 0.0
+    return len(tokens & other) / float(len(tokens | other))
+
+
+def minhash(tokens):
+    """ MinHash signature of a token set. """
+    hashes = [int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big') for token in tokens]
+    return [min((a * value + b) % MERSENNE_PRIME for value in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_keys(tokens, bucket):
+    """ One signed 64 bit key per LSH band, scoped to the profile ``bucket``. """
+    if not tokens:
+        return []
+    signature = minhash(tokens)
+    keys = []
+    for band in range(BANDS):
+        raw = '%s|%s|%s' % (bucket, band, ','.join(map(str, signature[band * ROWS:(band + 1) * ROWS])))
+        keys.append(int.from_bytes(hashlib.blake2b(raw.encode('utf-8'), digest_size=8).digest(), 'big', signed=True))
+    return keys
+
+
+class _BandIndex(object):
+    """ In-memory copy of ``health_symptom_band`` for one database.
+
+    The bulk of the bands is held in two sorted numpy arrays, searched by
+    bisection; the bands added since the last merge are kept in a dict.
+    """
+
+    def __init__(self):
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.recent = {}
+        self.recent_count = 0
+        self.loaded_id = 0
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+    def load(self, cr):
+        cr.execute("SELECT band_key, diagnosis_id FROM health_symptom_band ORDER BY band_key")
+        rows = cr.fetchall()
+        self.keys = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.ids = np.fromiter((row[1] for row in rows), dtype=np.int32, count=len(rows))
+        self.loaded_id = int(self.ids.max()) if len(rows) else 0
+        self.refreshed_at = time.monotonic()
+
+    def refresh(self, cr):
+        """ Add the bands other workers indexed since the last refresh.
+
+        Diagnoses committed out of id order can be missed until the worker
+        restarts; they are only a missed reuse, never a wrong one.
+        """
+        cr.execute("""
+            SELECT band_key, diagnosis_id FROM health_symptom_band WHERE diagnosis_id > %s
+        """, (self.loaded_id,))
+        self.add(cr.fetchall())
+        self.refreshed_at = time.monotonic()
+
+    def add(self, rows):
+        for key, diagnosis_id in rows:
+            self.recent.setdefault(key, set()).add(diagnosis_id)
+            self.loaded_id = max(self.loaded_id, diagnosis_id)
+        self.recent_count += len(rows)
+        if self.recent_count >= MERGE_SIZE:
+            pairs = [(key, diagnosis_id) for key, ids in self.recent.items() for diagnosis_id in ids]
+            keys = np.concatenate([self.keys, np.array([key for key, _id in pairs], dtype=np.int64)])
+            ids = np.concatenate([self.ids, np.array([diagnosis_id for _key, diagnosis_id in pairs], dtype=np.int32)])
+            order = np.argsort(keys, kind='stable')
+            self.keys, self.ids = keys[order], ids[order]
+            self.recent, self.recent_count = {}, 0
+
+    def lookup(self, keys):
+        found = set()
+        query = np.array(keys, dtype=np.int64)
+        starts = np.searchsorted(self.keys, query, side='left')
+        ends = np.searchsorted(self.keys, query, side='right')
+        for start, end in zip(starts, ends):
+            if end > start:
+                found.update(int(diagnosis_id) for diagnosis_id in self.ids[start:end])
+        for key in keys:
+            found.update(self.recent.get(key, ()))
+        return found
+
+
+class HealthSymptomIndex(models.AbstractModel):
+    """ Near-duplicate lookup of symptom descriptions (MinHash LSH).
+
+    Each diagnosis gets one key per band of the MinHash signature of its
+    symptom words, scoped by the employee's profile bucket, in
+    ``health_symptom_band``. Every worker keeps a copy of that table in
+    memory, loaded on first use, so finding the candidates sharing a band
+    with a new description does not query the database; the candidates are
+    then checked against their current description.
+    """
+    _name = 'health.symptom.index'
+    _description = 'Symptom Near-Duplicate Index'
+
+    def init(self):
+        self._cr.execute("""
+            CREATE TABLE IF NOT EXISTS health_symptom_band (
+                diagnosis_id integer NOT NULL REFERENCES health_diagnosis(id) ON DELETE CASCADE,
+                band_key bigint NOT NULL
+            )
+        """)
+        self._cr.execute("CREATE INDEX IF NOT EXISTS health_symptom_band_key_idx ON health_symptom_band (band_key)")
+        self._cr.execute("CREATE INDEX IF NOT EXISTS health_symptom_band_diagnosis_idx ON health_symptom_band (diagnosis_id)")
+
+    @api.model
+    def _get_threshold(self):
+        return float(self.env['ir.config_parameter'].sudo().get_param('ai_health.reuse_threshold') or DEFAULT_THRESHOLD)
+
+    @api.model
+    def _profile_bucket(self, employee):
+        """ Employees whose diagnoses can be reused for one another: same
+        gender and age decade, as both are sent to the AI service. """
+        age = ''
+        if employee.birthday:
+            age = (date.today() - employee.birthday).days // 3652
+        return '%s:%s' % (employee.gender or '', age)
+
+    @api.model
+    def _get_index(self):
+        """ The in-memory index of this database, or None without numpy. """
+        if np is None:
+            return None
+        dbname = self.env.cr.dbname
+        with _indexes_lock:
+            index = _indexes.get(dbname)
+            if index is None:
+                index = _indexes[dbname] = _BandIndex()
+        with index.lock:
+            if not index.refreshed_at:
+                index.load(self.env.cr)
+            elif time.monotonic() - index.refreshed_at > REFRESH_INTERVAL:
+                index.refresh(self.env.cr)
+        return index
+
+    @api.model
+    def _index_diagnoses(self, diagnoses):
+        """ (Re)compute the bands of ``diagnoses`` and add them to the index
+        of this worker once the transaction is committed. """
+        if not diagnoses:
+            return
+        diagnoses.flush_model(['symptom_description', 'employee_id'])
+        rows = []
+        for diagnosis in diagnoses:
+            keys = band_keys(symptom_tokens(diagnosis.symptom_description), self._profile_bucket(diagnosis.employee_id))
+            rows.extend((diagnosis.id, key) for key in keys)
+        self.env.cr.execute("DELETE FROM health_symptom_band WHERE diagnosis_id IN %s", (tuple(diagnoses.ids),))
+        if rows:
+            self.env.cr.execute("""
+                INSERT INTO health_symptom_band (diagnosis_id, band_key)
+                SELECT * FROM unnest(%s::int[], %s::bigint[])
+            """, ([row[0] for row in rows], [row[1] for row in rows]))
+        diagnoses.sudo().write({'symptom_indexed': True})
+
+        index = self._get_index()
+        if index is not None:
+            def add_to_index():
+                with index.lock:
+                    index.add([(key, diagnosis_id) for diagnosis_id, key in rows])
+            self.env.cr.postcommit.add(add_to_index)
+
+    @api.model
+    def _find_similar(self, diagnosis):
+        """ Return ``(diagnosis, similarity)`` of the most similar finished
+        diagnosis with attribute lines, or ``(None, 0.0)`` below the threshold. """
+        tokens = symptom_tokens(diagnosis.symptom_description)
+        keys = band_keys(tokens, self._profile_bucket(diagnosis.employee_id))
+        if not keys:
+            return None, 0.0
+        index = self._get_index()
+        if index is not None:
+            with index.lock:
+                candidates = index.lookup(keys)
+        else:
+            self.env.cr.execute("SELECT DISTINCT diagnosis_id FROM health_symptom_band WHERE band_key = ANY(%s)", (keys,))
+            candidates = {row[0] for row in self.env.cr.fetchall()}
+        candidates.discard(diagnosis.id)
+        if not candidates:
+            return None, 0.0
+
+        # Bands only say the descriptions are probably close: compare the
+        # current words of the candidates
+        self.env.cr.execute("""
+            SELECT d.id, d.symptom_description
+              FROM health_diagnosis d
+             WHERE d.id IN %s AND d.ai_state = 'done'
+               AND EXISTS (SELECT 1 FROM health_diagnosis_attribute_line l WHERE l.diagnosis_id = d.id)
+        """, (tuple(candidates),))
+        threshold = self._get_threshold()
+        best_id, best = None, 0.0
+        for candidate_id, description in self.env.cr.fetchall():
+            similarity = jaccard(tokens, symptom_tokens(description))
+            if similarity > best or (similarity == best and best_id and candidate_id > best_id):
+                best_id, best = candidate_id, similarity
+        if best_id is None or best < threshold:
+            return None, 0.0
+        return self.env['health.diagnosis'].browse(best_id), best
+
+    @api.model
+    def _cron_backfill(self):
+        """ Index the diagnoses created before the index, a chunk per transaction. """
+        Diagnosis = self.env['health.diagnosis'].sudo()
+        while True:
+            diagnoses = Diagnosis.search([('symptom_indexed', '=', False)], limit=BACKFILL_CHUNK, order='id')
+            if not diagnoses:
+                return
+            self._index_diagnoses(diagnoses)
+            self.env.cr.commit()
+            self.env.invalidate_all()
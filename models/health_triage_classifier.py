@@ -0,0 +1,293 @@
+from odoo import fields, models, api, _
+from odoo.exceptions import UserError
+from collections import Counter
+import base64
+import io
+import math
+import re
+import threading
+import logging
+
+from .health_diagnosis_dictionary import normalize_name, clean_name
+from .health_diagnosis import DEFAULT_TITLE, UNKNOWN_TITLE
+from .symptom_checker import NO_CONDITIONS
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    _logger.debug("Cannot import numpy, the triage classifier is unavailable.")
+    np = None
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_MAX_SAMPLES = 20000
+MIN_SAMPLES = 50
+MIN_CLASS_SAMPLES = 3
+MIN_DOCUMENT_FREQUENCY = 2
+MAX_FEATURES = 5000
+# Below this cosine similarity the text is unlike anything seen in training
+MIN_SIMILARITY = 0.3
+# Sharpness of the softmax turning similarities into a confidence
+SOFTMAX_SCALE = 20.0
+HOLDOUT_EVERY = 5
+KEEP_ARTIFACTS = 3
+
+# Placeholder answers, never learnt as conditions
+PLACEHOLDER_LABELS = {normalize_name(name) for name in (DEFAULT_TITLE, UNKNOWN_TITLE, NO_CONDITIONS)}
+
+# Per-worker cache of the loaded classifier: (classifier id, _TriageModel)
+_loaded = [None, None]
+_loaded_lock = threading.Lock()
+
+
+def _features(text):
+    """ Lower-cased word unigrams and bigrams of ``text``. """
+    words = re.findall(r'[^\W\d_]{2,}', (text or '').lower())
+    return words + ['%s %s' % pair for pair in zip(words, words[1:])]
+
+
+class _TriageModel(object):
+    """ TF-IDF nearest-centroid classifier.
+
+    Each class is the normalized centroid of the TF-IDF vectors of its
+    training texts; a text is assigned to the most similar centroid.
+    """
+
+    def __init__(self, vocabulary, idf, centroids, conditions, recommendations):
+        self.index = {term: position for position, term in enumerate(vocabulary)}
+        self.idf = idf
+        self.centroids = centroids
+        self.conditions = conditions
+        self.recommendations = recommendations
+
+    def vectorize(self, text):
+        """ Return the (indices, weights) of the L2-normalized TF-IDF vector of ``text``. """
+        counts = Counter(self.index[term] for term in _features(text) if term in self.index)
+        if not counts:
+            return None, None
+        indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        weights = (1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))) * self.idf[indices]
+        return indices, weights / np.linalg.norm(weights)
+
+    def predict(self, text):
+        """ Return ``(class index, confidence)`` for ``text``, or ``(None, 0.0)``. """
+        indices, weights = self.vectorize(text)
+        if indices is None or not len(self.centroids):
+            return None, 0.0
+        similarities = self.centroids[:, indices] @ weights
+        best = int(np.argmax(similarities))
+        if similarities[best] < MIN_SIMILARITY:
+            return None, 0.0
+        scores = np.exp((similarities - similarities[best]) * SOFTMAX_SCALE)
+        return best, float(scores[best] / scores.sum())
+
+    @classmethod
+    def load(cls, data):
+        arrays = np.load(io.BytesIO(data), allow_pickle=False)
+        return cls(
+            [str(term) for term in arrays['vocabulary']], arrays['idf'], arrays['centroids'],
+            [str(value) for value in arrays['conditions']], [str(value) for value in arrays['recommendations']],
+        )
+
+    def dump(self):
+        vocabulary = sorted(self.index, key=self.index.get)
+        output = io.BytesIO()
+        np.savez_compressed(
+            output, vocabulary=np.array(vocabulary), idf=self.idf, centroids=self.centroids,
+            conditions=np.array(self.conditions), recommendations=np.array(self.recommendations),
+        )
+        return output.getvalue()
+
+
+def _fit(texts, labels, outputs):
+    """ Train a ``_TriageModel`` on ``texts`` and their class ``labels``.
+
+    ``outputs`` maps each label to its ``(conditions, recommendation)``.
+    """
+    documents = [set(_features(text)) for text in texts]
+    frequencies = Counter(term for document in documents for term in document)
+    terms = [term for term, count in frequencies.most_common(MAX_FEATURES) if count >= MIN_DOCUMENT_FREQUENCY]
+    idf = np.array([math.log((1.0 + len(texts)) / (1.0 + frequencies[term])) + 1.0 for term in terms], dtype=np.float32)
+    classes = sorted(set(labels))
+    class_index = {label: position for position, label in enumerate(classes)}
+
+    model = _TriageModel(terms, idf, np.zeros((len(classes), len(terms)), dtype=np.float32),
+                         [outputs[label][0] for label in classes], [outputs[label][1] for label in classes])
+    model.labels = classes
+    for text, label in zip(texts, labels):
+        indices, weights = model.vectorize(text)
+        if indices is not None:
+            model.centroids[class_index[label], indices] += weights
+    norms = np.linalg.norm(model.centroids, axis=1, keepdims=True)
+    model.centroids /= np.maximum(norms, 1e-12)
+    return model
+
+
+class HealthTriageClassifier(models.Model):
+    _name = 'health.triage.classifier'
+    _description = 'Symptom Triage Classifier'
+    _order = 'date_trained desc, id desc'
+
+    name = fields.Char('Name', required=True, readonly=True)
+    active = fields.Boolean('Active', default=True)
+    date_trained = fields.Datetime('Trained On', readonly=True)
+    sample_count = fields.Integer('Training Samples', readonly=True)
+    class_count = fields.Integer('Conditions', readonly=True)
+    vocabulary_size = fields.Integer('Vocabulary Size', readonly=True)
+    holdout_precision = fields.Float('Precision (%)', readonly=True,
+                                     help="Share of correct answers among the held out checks the classifier was confident about.")
+    holdout_coverage = fields.Float('Coverage (%)', readonly=True,
+                                    help="Share of the held out checks the classifier was confident enough to answer.")
+    artifact = fields.Binary('Artifact', attachment=True, readonly=True)
+    artifact_size = fields.Integer('Artifact Size (bytes)', readonly=True)
+
+    @api.model
+    def _get_threshold(self):
+        return float(self.env['ir.config_parameter'].sudo().get_param('ai_health.triage_threshold') or DEFAULT_THRESHOLD)
+
+    @api.model
+    def _load_samples(self):
+        """ Return ``(texts, labels, outputs)`` from the finished AI checks and diagnoses.
+
+        Checks answered by the classifier itself are left out so it does
+        not learn from its own answers, and so are the placeholder titles
+        and conditions stored when the AI gave none. Diagnoses give their title as
+        condition and their treatment findings as recommendation.
+        """
+        limit = int(self.env['ir.config_parameter'].sudo().get_param('ai_health.triage_max_samples') or DEFAULT_MAX_SAMPLES)
+        self.env.cr.execute("""
+            SELECT symptom_description, suggested_conditions, recommendation
+              FROM symptom_checker
+             WHERE ai_state = 'done' AND COALESCE(triage_source, 'ai') = 'ai'
+               AND suggested_conditions IS NOT NULL
+             ORDER BY id DESC
+             LIMIT %s
+        """, (limit,))
+        rows = self.env.cr.fetchall()
+        self.env.cr.execute("""
+            SELECT d.symptom_description, d.name,
+                   string_agg(a.name || ': ' || v.name, '; ' ORDER BY a.id, v.id)
+              FROM health_diagnosis d
+              LEFT JOIN health_diagnosis_attribute_line l ON l.diagnosis_id = d.id
+              LEFT JOIN health_diagnosis_attribute a ON a.id = l.attribute_id
+              LEFT JOIN health_diagnosis_attribute_set s ON s.id = a.attribute_set_id AND lower(s.name) = 'treatment'
+              LEFT JOIN health_diagnosis_attribute_value_rel rel
+                     ON rel.health_diagnosis_attribute_line_id = l.id AND s.id IS NOT NULL
+              LEFT JOIN health_diagnosis_attribute_value v ON v.id = rel.health_diagnosis_attribute_value_id
+             WHERE d.ai_state = 'done'
+             GROUP BY d.id
+             ORDER BY d.id DESC
+             LIMIT %s
+        """, (limit,))
+        rows += self.env.cr.fetchall()
+
+        texts, labels, answers = [], [], {}
+        for text, conditions, recommendation in rows:
+            label = normalize_name(conditions)
+            if not text or not label or label in PLACEHOLDER_LABELS:
+                continue
+            texts.append(text)
+            labels.append(label)
+            answers.setdefault(label, Counter())[(clean_name(conditions), recommendation or '')] += 1
+
+        # Keep the conditions seen often enough, answered with their most
+        # frequent wording and recommendation
+        counts = Counter(labels)
+        outputs = {}
+        for label, pairs in answers.items():
+            recommended = [(pair, count) for pair, count in pairs.most_common() if pair[1]]
+            if counts[label] >= MIN_CLASS_SAMPLES and recommended:
+                outputs[label] = recommended[0][0]
+        kept = [(text, label) for text, label in zip(texts, labels) if label in outputs]
+        return [text for text, _label in kept], [label for _text, label in kept], outputs
+
+    @api.model
+    def _train(self):
+        """ Train a classifier on the current records and activate it.
+
+        A fifth of the samples is held out to measure the precision and
+        coverage at the configured threshold, then the classifier is
+        retrained on all of them. Returns the new classifier, or an empty
+        recordset when there is not enough data.
+        """
+        if np is None:
+            raise UserError(_("The triage classifier requires the numpy Python package."))
+        texts, labels, outputs = self._load_samples()
+        if len(texts) < MIN_SAMPLES:
+            _logger.info("Not enough samples to train the triage classifier (%s)", len(texts))
+            return self.browse()
+
+        threshold = self._get_threshold()
+        train = [index for index in range(len(texts)) if index % HOLDOUT_EVERY]
+        holdout = [index for index in range(len(texts)) if not index % HOLDOUT_EVERY]
+        model = _fit([texts[index] for index in train], [labels[index] for index in train], outputs)
+        answered = correct = 0
+        for index in holdout:
+            best, confidence = model.predict(texts[index])
+            if best is not None and confidence >= threshold:
+                answered += 1
+                correct += model.labels[best] == labels[index]
+
+        model = _fit(texts, labels, outputs)
+        data = model.dump()
+        classifier = self.create({
+            'name': _("Triage classifier %s") % fields.Datetime.to_string(fields.Datetime.now()),
+            'date_trained': fields.Datetime.now(),
+            'sample_count': len(texts),
+            'class_count': len(model.conditions),
+            'vocabulary_size': len(model.index),
+            'holdout_precision': 100.0 * correct / answered if answered else 0.0,
+            'holdout_coverage': 100.0 * answered / len(holdout) if holdout else 0.0,
+            'artifact': base64.b64encode(data),
+            'artifact_size': len(data),
+        })
+        self.search([('id', '!=', classifier.id)]).write({'active': False})
+        self.with_context(active_test=False).search([('active', '=', False)], offset=KEEP_ARTIFACTS - 1).unlink()
+        _logger.info("Trained triage classifier on %s samples, %s conditions", len(texts), len(model.conditions))
+        return classifier
+
+    @api.model
+    def _cron_retrain(self):
+        self._train()
+
+    def action_retrain(self):
+        classifier = self._train()
+        if not classifier:
+            raise UserError(_("At least %s finished symptom checks or diagnoses are needed to train the classifier.") % MIN_SAMPLES)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': classifier.id,
+            'view_mode': 'form',
+        }
+
+    @api.model
+    def _get_model(self):
+        """ Return the loaded active classifier, loading it once per worker. """
+        if np is None:
+            return None
+        classifier = self.sudo().search([], limit=1)
+        if not classifier:
+            return None
+        with _loaded_lock:
+            if _loaded[0] != classifier.id:
+                _loaded[:] = [classifier.id, _TriageModel.load(base64.b64decode(classifier.artifact))]
+            return _loaded[1]
+
+    @api.model
+    def _predict(self, texts):
+        """ Return, for each text, ``(conditions, recommendation, confidence)``
+        when the classifier is confident enough, else ``None``. """
+        model = self._get_model()
+        if model is None:
+            return [None] * len(texts)
+        threshold = self._get_threshold()
+        predictions = []
+        for text in texts:
+            best, confidence = model.predict(text)
+            if best is None or confidence < threshold:
+                predictions.append(None)
+            else:
+                predictions.append((model.conditions[best], model.recommendations[best], confidence))
+        return predictions
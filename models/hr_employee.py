@@ -1,4 +1,30 @@
-from odoo import models, fields
+from odoo import models, fields, api
+import json
+
+DEFAULT_DIGEST_RECENT = 5
+DEFAULT_DIGEST_TOP = 20
+
+
+def shrink_health_digest(history):
+    """ Drop the least useful detail of a prompt history: the rare items
+    of the summary first, then the summary, then the oldest diagnoses. """
+    history = dict(history)
+    summary = history.get('older_summary')
+    if summary:
+        frequent = [key for key in summary if key.startswith('frequent_') and len(summary[key]) > 1]
+        if frequent:
+            summary = dict(summary)
+            for key in frequent:
+                summary[key] = dict(list(summary[key].items())[:len(summary[key]) // 2])
+            history['older_summary'] = summary
+        else:
+            del history['older_summary']
+        return history
+    if history.get('recent'):
+        history['recent'] = history['recent'][1:]
+        return history
+    return None
+
 
 class HrEmployee(models.Model):
     _inherit = 'hr.employee'
@@ -6,3 +32,101 @@ class HrEmployee(models.Model):
     # One2many relationship with health.diagnosis
     # This field allows you to store multiple health diagnosis records for each employee
     diagnosis_ids = fields.One2many('health.diagnosis', 'employee_id', string="Health Diagnoses")
+    # Rolling summary of the diagnoses, maintained when a diagnosis is finalized:
+    # the most recent ones verbatim plus aggregated counts for the older ones
+    health_history_digest = fields.Text('Health History Digest', readonly=True, copy=False, groups='hr.group_hr_user')
+    # Written in bulk by the local risk model, see health.risk.model
+    local_risk_score = fields.Float('Local Risk Score', readonly=True, copy=False, groups='hr.group_hr_user',
+                                    help="Risk score (0-100) computed without AI from the diagnosis history.")
+
+    @api.model
+    def _get_digest_settings(self):
+        config = self.env['ir.config_parameter'].sudo()
+        return {
+            'recent': int(config.get_param('ai_health.digest_recent') or DEFAULT_DIGEST_RECENT),
+            'top': int(config.get_param('ai_health.digest_top') or DEFAULT_DIGEST_TOP),
+        }
+
+    @api.model
+    def _empty_digest(self):
+        return {'recent': [], 'older': {'count': 0, 'from': None, 'to': None, 'diagnoses': {}, 'findings': {}}}
+
+    @api.model
+    def _fold_into_older(self, older, entry, top):
+        """ Add a diagnosis to the aggregate of older diagnoses.
+
+        Counters are pruned to a multiple of ``top`` so the digest stays
+        bounded; the counts of rare items become approximate.
+        """
+        older['count'] += 1
+        older['from'] = min(filter(None, [older['from'], entry['date']]))
+        older['to'] = max(filter(None, [older['to'], entry['date']]))
+        older['diagnoses'][entry['diagnosis']] = older['diagnoses'].get(entry['diagnosis'], 0) + 1
+        for attribute in entry['attributes']:
+            for value in attribute['values']:
+                finding = '%s: %s' % (attribute['attribute'], value)
+                older['findings'][finding] = older['findings'].get(finding, 0) + 1
+        for key in ('diagnoses', 'findings'):
+            if len(older[key]) > top * 5:
+                kept = sorted(older[key].items(), key=lambda item: -item[1])[:top * 5]
+                older[key] = dict(kept)
+
+    def _load_health_digest(self):
+        self.ensure_one()
+        digest = self.sudo().health_history_digest
+        if digest:
+            return json.loads(digest)
+        return self._rebuild_health_digest()
+
+    def _rebuild_health_digest(self):
+        """ Build the digest from the full history, for employees created before it existed. """
+        self.ensure_one()
+        settings = self._get_digest_settings()
+        history = self.env['health.diagnosis.history']._get_history(self.ids, with_ids=True)
+        digest = self._empty_digest()
+        entries = sorted(history.get(self.id, []), key=lambda item: (item['date'], item['id']))
+        # With no recent entries kept, everything goes into the aggregate
+        split = max(len(entries) - max(settings['recent'], 0), 0)
+        for entry in entries[:split]:
+            self._fold_into_older(digest['older'], entry, settings['top'])
+        digest['recent'] = entries[split:]
+        self.sudo().health_history_digest = json.dumps(digest)
+        return digest
+
+    def _update_health_digest(self, entry):
+        """ Push a finalized diagnosis into the digest, folding the oldest recent one into the aggregate. """
+        self.ensure_one()
+        settings = self._get_digest_settings()
+        digest = self._load_health_digest()
+        # A retried diagnosis replaces its previous entry
+        recent = [item for item in digest['recent'] if item.get('id') != entry['id']]
+        recent.append(entry)
+        recent.sort(key=lambda item: (item['date'], item['id']))
+        while len(recent) > settings['recent']:
+            self._fold_into_older(digest['older'], recent.pop(0), settings['top'])
+        digest['recent'] = recent
+        self.sudo().health_history_digest = json.dumps(digest)
+
+    def _get_health_digest_prompt(self, label='diagnosis'):
+        """ Bounded history for the AI prompts: recent diagnoses plus a summary of the older ones.
+        Items go by decreasing frequency, see ``shrink_health_digest``. """
+        self.ensure_one()
+        settings = self._get_digest_settings()
+        digest = self._load_health_digest()
+        history = {
+            'recent': [{
+                'date': entry['date'],
+                label: entry['diagnosis'],
+                'attributes': entry['attributes'],
+            } for entry in digest['recent']],
+        }
+        older = digest['older']
+        if older['count']:
+            history['older_summary'] = {
+                'count': older['count'],
+                'from': older['from'],
+                'to': older['to'],
+                'frequent_%ss' % label: dict(sorted(older['diagnoses'].items(), key=lambda item: -item[1])[:settings['top']]),
+                'frequent_findings': dict(sorted(older['findings'].items(), key=lambda item: -item[1])[:settings['top']]),
+            }
+        return history
@@ -6,12 +6,60 @@ class ResConfigSettings(models.TransientModel):
     openai_api_key = fields.Char('OpenAI API Key')
     openai_prompt = fields.Text('OpenAI Prompt')
     openai_model = fields.Char('OpenAI Model', default='gpt-3.5-turbo')
+    openai_base_url = fields.Char('OpenAI Base URL', default='https://api.openai.com/v1')
+    openai_connect_timeout = fields.Float('Connect Timeout (s)', default=5.0)
+    openai_read_timeout = fields.Float('Read Timeout (s)', default=60.0)
+    openai_max_retries = fields.Integer('Max Retries', default=3)
+    openai_max_concurrency = fields.Integer('Max Concurrent Requests', default=8)
+    openai_json_mode = fields.Selection([
+        ('auto', 'When Supported'),
+        ('off', 'Never'),
+    ], string='JSON Response Format', default='auto')
+    ai_rate_limit_rpm = fields.Integer('Requests per Minute Quota')
+    ai_rate_limit_tpm = fields.Integer('Tokens per Minute Quota')
+    ai_prompt_token_budget = fields.Integer('Prompt Data Token Budget', default=3000)
+    ai_context_window = fields.Integer('Model Context Window (tokens)', default=16385)
+    ai_cache_ttl = fields.Integer('Cache Lifetime (s)', default=86400)
+    ai_cache_max_entries = fields.Integer('Max Cached Responses', default=10000)
+    ai_cache_hits = fields.Integer('Cache Hits', readonly=True)
+    ai_cache_misses = fields.Integer('Cache Misses', readonly=True)
+    ai_cache_entries = fields.Integer('Cached Responses', readonly=True)
+    ai_price_prompt_1k = fields.Float('Prompt Price per 1K Tokens', digits=(16, 6))
+    ai_price_completion_1k = fields.Float('Completion Price per 1K Tokens', digits=(16, 6))
+    ai_telemetry_retention_days = fields.Integer('Keep AI Calls (days)', default=90)
+    ai_triage_enabled = fields.Boolean('Local Symptom Triage')
+    ai_triage_threshold = fields.Float('Triage Confidence Threshold', default=0.8)
+    ai_reuse_auto = fields.Boolean('Reuse Similar Diagnoses')
+    ai_reuse_threshold = fields.Float('Similarity Threshold', default=0.8)
+    ai_rescore_time_budget = fields.Integer('Scheduled Run Time Budget (s)', default=240)
+    ai_rescore_chunk_size = fields.Integer('Employees per Chunk', default=50)
 
     def set_values(self):
         super(ResConfigSettings, self).set_values()
         self.env['ir.config_parameter'].set_param('ai_health.openai_api_key', self.openai_api_key)
         self.env['ir.config_parameter'].set_param('ai_health.openai_prompt', self.openai_prompt)
         self.env['ir.config_parameter'].set_param('ai_health.openai_model', self.openai_model)
+        self.env['ir.config_parameter'].set_param('ai_health.openai_base_url', self.openai_base_url)
+        self.env['ir.config_parameter'].set_param('ai_health.connect_timeout', self.openai_connect_timeout)
+        self.env['ir.config_parameter'].set_param('ai_health.read_timeout', self.openai_read_timeout)
+        self.env['ir.config_parameter'].set_param('ai_health.max_retries', self.openai_max_retries)
+        self.env['ir.config_parameter'].set_param('ai_health.max_concurrency', self.openai_max_concurrency)
+        self.env['ir.config_parameter'].set_param('ai_health.json_mode', self.openai_json_mode)
+        self.env['ir.config_parameter'].set_param('ai_health.rate_limit_rpm', self.ai_rate_limit_rpm)
+        self.env['ir.config_parameter'].set_param('ai_health.rate_limit_tpm', self.ai_rate_limit_tpm)
+        self.env['ir.config_parameter'].set_param('ai_health.prompt_token_budget', self.ai_prompt_token_budget)
+        self.env['ir.config_parameter'].set_param('ai_health.context_window', self.ai_context_window)
+        self.env['ir.config_parameter'].set_param('ai_health.cache_ttl', self.ai_cache_ttl)
+        self.env['ir.config_parameter'].set_param('ai_health.cache_max_entries', self.ai_cache_max_entries)
+        self.env['ir.config_parameter'].set_param('ai_health.price_prompt_1k', self.ai_price_prompt_1k)
+        self.env['ir.config_parameter'].set_param('ai_health.price_completion_1k', self.ai_price_completion_1k)
+        self.env['ir.config_parameter'].set_param('ai_health.telemetry_retention_days', self.ai_telemetry_retention_days)
+        self.env['ir.config_parameter'].set_param('ai_health.triage_enabled', self.ai_triage_enabled)
+        self.env['ir.config_parameter'].set_param('ai_health.triage_threshold', self.ai_triage_threshold)
+        self.env['ir.config_parameter'].set_param('ai_health.reuse_auto', self.ai_reuse_auto)
+        self.env['ir.config_parameter'].set_param('ai_health.reuse_threshold', self.ai_reuse_threshold)
+        self.env['ir.config_parameter'].set_param('ai_health.rescore_time_budget', self.ai_rescore_time_budget)
+        self.env['ir.config_parameter'].set_param('ai_health.rescore_chunk_size', self.ai_rescore_chunk_size)
 
     @api.model
     def get_values(self):
@@ -20,5 +68,35 @@ class ResConfigSettings(models.TransientModel):
             openai_api_key=self.env['ir.config_parameter'].get_param('ai_health.openai_api_key', default=''),
             openai_prompt=self.env['ir.config_parameter'].get_param('ai_health.openai_prompt', default=''),
             openai_model=self.env['ir.config_parameter'].get_param('ai_health.openai_model', default='gpt-3.5-turbo'),
+            openai_base_url=self.env['ir.config_parameter'].get_param('ai_health.openai_base_url', default='https://api.openai.com/v1'),
+            openai_connect_timeout=float(self.env['ir.config_parameter'].get_param('ai_health.connect_timeout', default=5.0)),
+            openai_read_timeout=float(self.env['ir.config_parameter'].get_param('ai_health.read_timeout', default=60.0)),
+            openai_max_retries=int(self.env['ir.config_parameter'].get_param('ai_health.max_retries', default=3)),
+            openai_max_concurrency=int(self.env['ir.config_parameter'].get_param('ai_health.max_concurrency', default=8)),
+            openai_json_mode=self.env['ir.config_parameter'].get_param('ai_health.json_mode', default='auto'),
+            ai_rate_limit_rpm=int(self.env['ir.config_parameter'].get_param('ai_health.rate_limit_rpm', default=0)),
+            ai_rate_limit_tpm=int(self.env['ir.config_parameter'].get_param('ai_health.rate_limit_tpm', default=0)),
+            ai_prompt_token_budget=int(self.env['ir.config_parameter'].get_param('ai_health.prompt_token_budget', default=3000)),
+            ai_context_window=int(self.env['ir.config_parameter'].get_param('ai_health.context_window', default=16385)),
+            ai_cache_ttl=int(self.env['ir.config_parameter'].get_param('ai_health.cache_ttl', default=86400)),
+            ai_cache_max_entries=int(self.env['ir.config_parameter'].get_param('ai_health.cache_max_entries', default=10000)),
+            ai_price_prompt_1k=float(self.env['ir.config_parameter'].get_param('ai_health.price_prompt_1k', default=0.0)),
+            ai_price_completion_1k=float(self.env['ir.config_parameter'].get_param('ai_health.price_completion_1k', default=0.0)),
+            ai_telemetry_retention_days=int(self.env['ir.config_parameter'].get_param('ai_health.telemetry_retention_days', default=90)),
+            ai_triage_enabled=bool(self.env['ir.config_parameter'].get_param('ai_health.triage_enabled')),
+            ai_triage_threshold=float(self.env['ir.config_parameter'].get_param('ai_health.triage_threshold', default=0.8)),
+            ai_reuse_auto=bool(self.env['ir.config_parameter'].get_param('ai_health.reuse_auto')),
+            ai_reuse_threshold=float(self.env['ir.config_parameter'].get_param('ai_health.reuse_threshold', default=0.8)),
+            ai_rescore_time_budget=int(self.env['ir.config_parameter'].get_param('ai_health.rescore_time_budget', default=240)),
+            ai_rescore_chunk_size=int(self.env['ir.config_parameter'].get_param('ai_health.rescore_chunk_size', default=50)),
+        )
+        stats = self.env['health.ai.cache'].sudo()._get_stats()
+        res.update(
+            ai_cache_hits=stats['hits'],
+            ai_cache_misses=stats['misses'],
+            ai_cache_entries=stats['entries'],
         )
         return res
+
+    def action_clear_ai_cache(self):
+        self.env['health.ai.cache'].sudo().action_clear()
@@ -1,15 +1,20 @@
 from odoo import fields, models, api, _
-import requests
-import json
-import re
 import logging
 from odoo.exceptions import UserError
 
+from .health_ai_prompt import compact_json
+
 _logger = logging.getLogger(__name__)
 
+# Conditions stored when the AI did not suggest any
+NO_CONDITIONS = 'No conditions suggested'
+
 class SymptomChecker(models.Model):
     _name = 'symptom.checker'
     _description = 'Symptom Checker with AI Diagnostics'
+    _inherit = ['health.ai.engine.mixin']
+    _ai_engine = 'symptom_check'
+    _ai_response_schema = {'suggested_conditions': 'text', 'recommendation': 'text'}
 
     name = fields.Char('Check Title', required=True, default="New Symptom Check")
     employee_id = fields.Many2one('hr.employee', string='Employee', required=True)
@@ -17,75 +22,98 @@ class SymptomChecker(models.Model):
     check_date = fields.Datetime('Check Date', default=fields.Datetime.now)
     suggested_conditions = fields.Text('Suggested Conditions', readonly=True)
     recommendation = fields.Text('Recommendation', readonly=True)
+    triage_source = fields.Selection([
+        ('local', 'Local Classifier'),
+        ('ai', 'AI'),
+    ], string='Answered By', readonly=True, copy=False)
+    triage_confidence = fields.Float('Classifier Confidence', readonly=True, copy=False)
 
     def trigger_check(self):
-        """ Trigger the AI-based symptom check. """
+        """ Answer the checks the local classifier is confident about right
+        away and queue the AI-based symptom check for the others. """
+        remaining = self._run_local_triage()
+        remaining._enqueue_ai_job('_run_check')
+
+    def _run_local_triage(self):
+        """ Answer from the local triage classifier and return the checks it
+        is not confident enough about. """
+        if not self or not self.env['ir.config_parameter'].sudo().get_param('ai_health.triage_enabled'):
+            return self
+        predictions = self.env['health.triage.classifier']._predict(self.mapped('symptom_description'))
+        remaining = self.browse()
+        for check, prediction in zip(self, predictions):
+            if prediction is None:
+                remaining |= check
+                continue
+            conditions, recommendation, confidence = prediction
+            check.write({
+                'suggested_conditions': conditions,
+                'recommendation': recommendation,
+                'triage_source': 'local',
+                'triage_confidence': confidence,
+                'ai_state': 'done',
+                'ai_error': False,
+            })
+        return remaining
+
+    def _run_check(self):
+        """ Run the AI-based symptom check for every record in the set. """
+        return self._run_ai_batch()
+
+    def _prepare_ai_request(self):
+        """ Build the symptom check request for the current record. """
+        self.ensure_one()
         # Prepare symptom data for AI API call
         symptoms = self._get_symptom_data()
+        return self._ai_request(
+            messages=self._build_diagnostics_messages(symptoms),
+            max_tokens=300,
+            temperature=0.5,
+            error_message=_("Failed to retrieve symptom check results."),
+        )
 
-        # Call the AI service to get possible conditions
-        conditions, recommendation = self._call_ai_diagnostics(symptoms)
+    def _apply_ai_response(self, content, request):
+        """ Store the possible conditions returned by the AI service. """
+        conditions, recommendation = self._parse_diagnostics_response(content)
 
         # Update the record with the results
         self.write({
             'suggested_conditions': conditions,
             'recommendation': recommendation,
+            'triage_source': 'ai',
         })
 
     def _get_symptom_data(self):
-        """ Fetch symptom information provided by the employee. """
+        """ Fetch symptom information provided by the employee. The employee
+        name and check time do not change the answer, they are left out so
+        identical checks share their cached response. """
         return {
-            'employee_name': self.employee_id.name,
             'symptoms': self.symptom_description,
-            'date': self.check_date.strftime('%Y-%m-%d %H:%M:%S'),
         }
 
-    def _call_ai_diagnostics(self, symptoms):
-        """ Call OpenAI's API to get possible conditions based on symptoms. """
-        config = self.env['ir.config_parameter'].sudo()
-        api_key = config.get_param('ai_health.openai_api_key')
-        model = config.get_param('ai_health.openai_model')
-
-        if not api_key or not model:
-            raise UserError(_("Missing configuration for OpenAI API."))
-
+    def _build_diagnostics_messages(self, symptoms):
+        """ Build the OpenAI messages asking for possible conditions based on symptoms. """
         # Build the diagnostic prompt
         prompt = (
             f"Here is the symptom data:\n"
-            f"{json.dumps(symptoms, indent=4)}\n"
+            f"{compact_json(symptoms)}\n"
             "Based on the symptoms provided, suggest possible conditions and provide a recommendation. "
             "Return the data in the following JSON structure:\n"
-            "{'suggested_conditions': {}, 'recommendation': {}}."
+            "{\"suggested_conditions\": \"...\", \"recommendation\": \"...\"}."
         )
 
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-
-        # Payload for OpenAI API
-        data = {
-            'model': model,
-            'messages': [
-                {"role": "system", "content": "You are a highly intelligent AI that provides diagnostic suggestions based on symptoms."},
-                {"role": "user", "content": prompt}
-            ],
-            'max_tokens': 300,
-            'temperature': 0.5
-        }
-
-        response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
-
-        if response.status_code != 200:
-            _logger.error("Error from OpenAI API: %s", response.text)
-            raise UserError(_("Failed to retrieve symptom check results."))
+        return [
+            {"role": "system", "content": "You are a highly intelligent AI that provides diagnostic suggestions based on symptoms."},
+            {"role": "user", "content": prompt}
+        ]
 
+    def _parse_diagnostics_response(self, check_content):
+        """ Extract the suggested conditions and recommendation from the AI response. """
         try:
-            check_content = response.json()['choices'][0]['message']['content']
-            check_data = json.loads(re.search(r'({.*})', check_content, re.DOTALL).group(1))
+            check_data = self._parse_ai_json(check_content)
 
             return (
-                check_data.get('suggested_conditions', 'No conditions suggested'),
+                check_data.get('suggested_conditions', NO_CONDITIONS),
                 check_data.get('recommendation', 'No recommendation available')
             )
         except Exception as e:
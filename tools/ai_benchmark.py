@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark of the AI paths of the module.
+
+Every engine is driven through its public trigger (``get_health_advice``,
+``trigger_check``, ``trigger_risk_scoring``, ``trigger_recommendation``,
+``trigger_prediction``) then through the job worker, at increasing data
+sizes and upstream concurrency, against ``tools/mock_llm_server.py``. For
+each run it reports the latency percentiles of the trigger calls and of the
+worker batches, the SQL queries per record and the peak Python memory.
+Queries are counted on every cursor of the benchmark thread, including
+the ones the module opens besides the main cursor (telemetry, in-flight
+calls, cache statistics).
+
+Start the mock server, then, on a disposable database with the module
+installed::
+
+    python3 tools/ai_benchmark.py -c /etc/odoo/odoo.conf -d bench \\
+        --sizes 10 100 1000 --concurrency 1 4 16
+
+or from ``odoo-bin shell``::
+
+    exec(open('tools/ai_benchmark.py').read())
+    run(env, sizes=(10, 100), concurrency=(1, 8))
+
+The benchmark commits: it creates employees and records prefixed with
+``[bench]``, removes them afterwards and restores the system parameters it
+changes.
+"""
+import argparse
+import json
+import threading
+import time
+import tracemalloc
+
+BENCH_PREFIX = '[bench]'
+ENGINES = {
+    'diagnosis': ('health.diagnosis', 'get_health_advice'),
+    'symptom_check': ('symptom.checker', 'trigger_check'),
+    'risk_scoring': ('health.risk.scoring', 'trigger_risk_scoring'),
+    'recommendation': ('health.recommendation', 'trigger_recommendation'),
+    'outbreak_prediction': ('health.disease.outbreak.prediction', 'trigger_prediction'),
+}
+SYMPTOMS = [
+    'fever and dry cough since two days',
+    'headache, fatigue and light sensitivity',
+    'sneezing, itchy eyes and runny nose',
+    'nausea and stomach cramps after lunch',
+    'sore throat and mild fever',
+]
+
+
+def percentile(values, pct):
+    """ Nearest-rank percentile of ``values``. """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))]
+
+
+def _set_params(env, params):
+    config = env['ir.config_parameter'].sudo()
+    previous = {key: config.get_param(key) for key in params}
+    for key, value in params.items():
+        config.set_param(key, value)
+    return previous
+
+
+def _create_fixtures(env, engine, size):
+    """ Create ``size`` records of ``engine`` and return them. """
+    employees = env['hr.employee'].create([
+        {'name': '%s Employee %s' % (BENCH_PREFIX, index)} for index in range(min(size, 50))
+    ])
+    diagnoses = env['health.diagnosis'].create([{
+        'name': '%s Diagnosis %s' % (BENCH_PREFIX, index),
+        'employee_id': employees[index % len(employees)].id,
+        'symptom_description': SYMPTOMS[index % len(SYMPTOMS)],
+    } for index in range(size)])
+    model_name = ENGINES[engine][0]
+    if model_name == 'health.diagnosis':
+        records = diagnoses
+    elif model_name == 'symptom.checker':
+        records = env[model_name].create([{
+            'name': '%s Check %s' % (BENCH_PREFIX, index),
+            'employee_id': diagnosis.employee_id.id,
+            'symptom_description': diagnosis.symptom_description,
+        } for index, diagnosis in enumerate(diagnoses)])
+    elif model_name == 'health.disease.outbreak.prediction':
+        records = env[model_name].create([{
+            'name': '%s Prediction %s' % (BENCH_PREFIX, index),
+            'employee_id': diagnosis.employee_id.id,
+        } for index, diagnosis in enumerate(diagnoses)])
+    else:
+        records = env[model_name].create([{
+            'name': '%s Record %s' % (BENCH_PREFIX, index),
+            'employee_id': diagnosis.employee_id.id,
+            'diagnosis_id': diagnosis.id,
+        } for index, diagnosis in enumerate(diagnoses)])
+    return employees, diagnoses, records
+
+
+def _cleanup(env, employees, diagnoses, records):
+    Job = env['health.ai.job'].sudo()
+    for recordset in (records, diagnoses):
+        Job.search([('res_model', '=', recordset._name), ('res_id', 'in', recordset.ids)]).unlink()
+    records.exists().unlink()
+    diagnoses.exists().unlink()
+    employees.exists().unlink()
+    env.cr.commit()
+
+
+def _query_count():
+    """ Queries run so far by this thread, on any cursor. """
+    return threading.current_thread().query_count
+
+
+def _process_jobs(env, batch_size):
+    """ Run the job worker cron, timing every batch. """
+    Job = env['health.ai.job'].sudo()
+    durations = []
+    # The batches are run by the cron itself, only timed here
+    model_class = type(Job)
+    run = model_class._run
+
+    def timed_run(jobs):
+        start = time.perf_counter()
+        try:
+            return run(jobs)
+        finally:
+            durations.append(time.perf_counter() - start)
+
+    model_class._run = timed_run
+    try:
+        Job._cron_process_jobs(limit=batch_size)
+    finally:
+        model_class._run = run
+    return durations
+
+
+def run_one(env, engine, size, concurrency):
+    """ Benchmark one engine for one data size and concurrency. """
+    employees, diagnoses, records = _create_fixtures(env, engine, size)
+    env.cr.commit()
+    trigger = ENGINES[engine][1]
+    try:
+        # Interactive path: one trigger call per record, as from the form
+        queries = _query_count()
+        trigger_times = []
+        for record in records:
+            start = time.perf_counter()
+            getattr(record, trigger)()
+            trigger_times.append(time.perf_counter() - start)
+        trigger_queries = _query_count() - queries
+        env.cr.commit()
+
+        # Background path: the job worker drains the queue
+        tracemalloc.start()
+        queries = _query_count()
+        start = time.perf_counter()
+        batch_times = _process_jobs(env, max(concurrency, 20))
+        total = time.perf_counter() - start
+        process_queries = _query_count() - queries
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        records.invalidate_recordset(['ai_state'])
+        states = {}
+        for state in records.mapped('ai_state'):
+            states[state] = states.get(state, 0) + 1
+        return {
+            'engine': engine,
+            'size': size,
+            'concurrency': concurrency,
+            'trigger_p50_ms': percentile(trigger_times, 50) * 1000,
+            'trigger_p95_ms': percentile(trigger_times, 95) * 1000,
+            'trigger_p99_ms': percentile(trigger_times, 99) * 1000,
+            'trigger_queries_per_record': trigger_queries / float(size),
+            'batch_p50_ms': percentile(batch_times, 50) * 1000,
+            'batch_p95_ms': percentile(batch_times, 95) * 1000,
+            'batch_p99_ms': percentile(batch_times, 99) * 1000,
+            'total_s': total,
+            'records_per_s': size / total if total else 0.0,
+            'process_queries_per_record': process_queries / float(size),
+            'peak_memory_mb': peak / 1024.0 / 1024.0,
+            'states': states,
+        }
+    finally:
+        env.cr.rollback()
+        _cleanup(env, employees, diagnoses, records)
+
+
+def run(env, sizes=(10, 100), concurrency=(1, 8), engines=None,
+        base_url='http://127.0.0.1:8765/v1', use_cache=False):
+    """ Run the benchmark matrix and return the list of results. """
+    # Counted by the cursors of Odoo threads, the request and cron ones
+    thread = threading.current_thread()
+    if not hasattr(thread, 'query_count'):
+        thread.query_count = 0
+        thread.query_time = 0
+    params = {
+        'ai_health.openai_api_key': 'mock-key',
+        'ai_health.openai_model': 'mock',
+        'ai_health.openai_base_url': base_url,
+        'ai_health.max_concurrency': str(concurrency[0]),
+        # The worker drains the whole queue in one run
+        'ai_health.job_time_budget': '86400',
+    }
+    if not use_cache:
+        params['ai_health.cache_ttl'] = '0'
+    previous = _set_params(env, params)
+    env.cr.commit()
+    config = env['ir.config_parameter'].sudo()
+    results = []
+    try:
+        for engine in engines or list(ENGINES):
+            for size in sizes:
+                for workers in concurrency:
+                    config.set_param('ai_health.max_concurrency', str(workers))
+                    env.cr.commit()
+                    result = run_one(env, engine, size, workers)
+                    results.append(result)
+                    print(format_result(result), flush=True)
+    finally:
+        for key, value in previous.items():
+            config.set_param(key, value or False)
+        env.cr.commit()
+    return results
+
+
+def format_result(result):
+    return (
+        "%(engine)-20s size=%(size)-6s conc=%(concurrency)-3s "
+        "trigger p50/p95/p99=%(trigger_p50_ms).1f/%(trigger_p95_ms).1f/%(trigger_p99_ms).1f ms "
+        "(%(trigger_queries_per_record).1f q/rec)  "
+        "batch p50/p95/p99=%(batch_p50_ms).0f/%(batch_p95_ms).0f/%(batch_p99_ms).0f ms  "
+        "%(records_per_s).1f rec/s (%(process_queries_per_record).1f q/rec)  "
+        "peak %(peak_memory_mb).1f MB  %(states)s"
+    ) % result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-c', '--config', help="Odoo configuration file")
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES))
+    parser.add_argument('--base-url', default='http://127.0.0.1:8765/v1')
+    parser.add_argument('--use-cache', action='store_true', help="keep the AI response cache enabled")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    import odoo
+    from odoo import api, SUPERUSER_ID
+
+    odoo.tools.config.parse_config(['-c', args.config] if args.config else [])
+    registry = odoo.registry(args.database)
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        results = run(env, sizes=args.sizes, concurrency=args.concurrency, engines=args.engines,
+                      base_url=args.base_url, use_cache=args.use_cache)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Mock OpenAI chat completions server for local development and benchmarks.
+
+Answers ``POST /v1/chat/completions`` with canned JSON matching what each
+engine of the module expects, recognized from the system prompt. Latency,
+error rate and the share of malformed answers are configurable, so the
+retry, parsing and concurrency paths can be exercised without an API key.
+Streaming (``"stream": true``) is answered with server-sent events.
+
+Only the standard library is used::
+
+    python3 tools/mock_llm_server.py --port 8765 --latency 0.8 --jitter 0.4 \\
+        --error-rate 0.02 --malformed-rate 0.05
+
+then set ``ai_health.openai_base_url`` to ``http://127.0.0.1:8765/v1`` and
+any non-empty ``ai_health.openai_api_key``.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONDITIONS = ['Common cold', 'Influenza', 'Seasonal allergy', 'Migraine', 'Gastroenteritis', 'Bronchitis']
+SYMPTOMS = ['Fever', 'Cough', 'Headache', 'Fatigue', 'Sore throat', 'Nausea', 'Sneezing']
+TREATMENTS = ['Rest', 'Hydration', 'Paracetamol', 'Antihistamine', 'See a doctor if symptoms persist']
+
+
+def _diagnosis():
+    condition = random.choice(CONDITIONS)
+    return {
+        'title': {'diagnosis': condition},
+        'preliminary': {
+            'condition': condition,
+            'symptoms': random.sample(SYMPTOMS, 3),
+            'severity': random.choice(['Mild', 'Moderate', 'Severe']),
+        },
+        'treatment': {'medication': random.sample(TREATMENTS, 2), 'duration': '%s days' % random.randint(2, 10)},
+        'notes': {'follow_up': random.choice(['None', 'One week', 'Two weeks'])},
+    }
+
+
+def _symptom_check():
+    return {
+        'suggested_conditions': ', '.join(random.sample(CONDITIONS, 2)),
+        'recommendation': random.choice(TREATMENTS),
+    }
+
+
+def _risk_scoring():
+    return {
+        'risk_score': round(random.uniform(0, 100), 1),
+        'escalation_steps': 'Monitor symptoms and escalate to the occupational physician if they worsen.',
+        'risk_analysis': 'Recurring %s over the last weeks.' % random.choice(SYMPTOMS).lower(),
+        'title': 'Risk assessment',
+    }
+
+
+def _recommendation():
+    return {
+        'recommendation': random.choice(TREATMENTS),
+        'lifestyle_suggestion': 'Sleep at least 7 hours and take regular breaks.',
+        'preventive_measures': 'Yearly vaccination and hand hygiene.',
+        'title': 'Health recommendation',
+    }
+
+
+def _prediction():
+    return {
+        'prediction_result': 'Possible increase of %s cases next week.' % random.choice(CONDITIONS).lower(),
+        'predicted_disease': random.choice(CONDITIONS),
+        'accuracy': random.randint(40, 95),
+        'title': 'Outbreak prediction',
+    }
+
+
+# Keyword of the system prompt -> canned answer
+ANSWERS = [
+    ('health diagnosis', _diagnosis),
+    ('diagnostic suggestions', _symptom_check),
+    ('risk scores', _risk_scoring),
+    ('health recommendations', _recommendation),
+    ('disease outbreaks', _prediction),
+]
+
+
+def _malformed(content):
+    return random.choice([
+        content[:len(content) // 2],  # truncated
+        "I'm sorry, I cannot provide a diagnosis.",  # prose
+        content.replace('"', "'"),  # Python-style quotes
+        'Here is the result:\n```json\n%s\n```' % content,  # fenced, still parseable
+    ])
+
+
+def _usage(payload, content):
+    # Rough count, about four characters per token
+    prompt_tokens = sum(len(m.get('content', '')) for m in payload.get('messages', [])) // 4
+    completion_tokens = len(content) // 4
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = None
+    stats = None
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        if self.settings.verbose:
+            super().log_message(format, *args)
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with self.stats_lock:
+                return self._send_json(200, dict(self.stats))
+        self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': 'Not found'}})
+        self._count('requests')
+
+        settings = self.settings
+        time.sleep(max(0.0, random.gauss(settings.latency, settings.jitter)))
+        if random.random() < settings.error_rate:
+            self._count('errors')
+            if random.random() < 0.5:
+                return self._send_json(429, {'error': {'message': 'Rate limit reached'}}, [('Retry-After', '1')])
+            return self._send_json(500, {'error': {'message': 'Internal error'}})
+
+        system = ' '.join(m.get('content', '') for m in payload.get('messages', []) if m.get('role') == 'system')
+        answer = next((build for keyword, build in ANSWERS if keyword in system), _symptom_check)
+        content = json.dumps(answer())
+        if random.random() < settings.malformed_rate:
+            self._count('malformed')
+            content = _malformed(content)
+
+        if payload.get('stream'):
+            return self._stream(payload, content)
+        self._send_json(200, {
+            'id': 'chatcmpl-%s' % uuid.uuid4().hex,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'mock'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': _usage(payload, content),
+        })
+
+    def _stream(self, payload, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        chunk_id = 'chatcmpl-%s' % uuid.uuid4().hex
+        for start in range(0, len(content), 16):
+            event = {
+                'id': chunk_id,
+                'object': 'chat.completion.chunk',
+                'model': payload.get('model', 'mock'),
+                'choices': [{'index': 0, 'delta': {'content': content[start:start + 16]}}],
+            }
+            self.wfile.write(('data: %s\n\n' % json.dumps(event)).encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.settings.token_delay)
+        if (payload.get('stream_options') or {}).get('include_usage'):
+            usage = _usage(payload, content)
+            event = {'id': chunk_id, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage}
+            self.wfile.write(('data: %s\n\n' % json.dumps(event)).encode('utf-8'))
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help="mean response time in seconds")
+    parser.add_argument('--jitter', type=float, default=0.1, help="standard deviation of the response time")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of 429/500 answers")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="share of malformed contents")
+    parser.add_argument('--token-delay', type=float, default=0.01, help="delay between streamed chunks")
+    parser.add_argument('--seed', type=int, help="random seed, for repeatable runs")
+    parser.add_argument('--verbose', action='store_true')
+    settings = parser.parse_args()
+    if settings.seed is not None:
+        random.seed(settings.seed)
+
+    MockHandler.settings = settings
+    MockHandler.stats = {}
+    server = ThreadingHTTPServer((settings.host, settings.port), MockHandler)
+    print("Mock chat completions on http://%s:%s/v1" % (settings.host, settings.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()